@@ -0,0 +1,204 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import http_pool
+import tracing
+
+# Defaults for the asset store
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+DEFAULT_SPILL_THRESHOLD = 16 * 1024 * 1024
+
+
+# Downloads each asset URL once and keeps the bytes for every later use.
+# Recent assets stay in memory up to memory_budget bytes; anything larger
+# than spill_threshold, or pushed out of the budget, lives in a temp file.
+class AssetStore:
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill_threshold=DEFAULT_SPILL_THRESHOLD, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir or tempfile.mkdtemp(prefix='game_maker_assets_')
+        self.downloads = 0
+        self.hits = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._files = {}
+        # URLs served from files owned by someone else (e.g. project blobs),
+        # which are never deleted here
+        self._attached = set()
+        self._lock = threading.Lock()
+        self._url_locks = {}
+
+    def configure(self, memory_budget=None, spill_threshold=None):
+        with self._lock:
+            if memory_budget is not None:
+                self.memory_budget = memory_budget
+            if spill_threshold is not None:
+                self.spill_threshold = spill_threshold
+            self._enforce_budget()
+
+    def __contains__(self, url):
+        with self._lock:
+            return url in self._memory or url in self._files
+
+    # Lock held while a URL is being downloaded so it is only fetched once
+    def url_lock(self, url):
+        with self._lock:
+            return self._url_locks.setdefault(url, threading.Lock())
+
+    # Return the bytes for a URL, downloading it only the first time
+    def fetch(self, url, timeout=60):
+        data = self.get(url)
+        if data is not None:
+            return data
+        with self.url_lock(url):
+            data = self.get(url)
+            if data is not None:
+                return data
+            with tracing.span('fetch', 'download', url=url) as span:
+                response = http_pool.get(url, timeout=timeout)
+                response.raise_for_status()
+                data = response.content
+                span.set(bytes_received=len(data))
+            self.put(url, data)
+            with self._lock:
+                self.downloads += 1
+            return data
+
+    # Return stored bytes for a URL, or None if it has not been fetched.
+    # A file removed while it is being read counts as not fetched.
+    def get(self, url):
+        with self._lock:
+            if url in self._memory:
+                self._memory.move_to_end(url)
+                self.hits += 1
+                return self._memory[url]
+            path = self._files.get(url)
+            if path is None:
+                return None
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    # Open the stored asset as a binary file, downloading it if needed
+    def open(self, url, timeout=60):
+        with self._lock:
+            path = self._files.get(url)
+        if path is not None:
+            try:
+                return open(path, 'rb')
+            except FileNotFoundError:
+                pass
+        return BytesIO(self.fetch(url, timeout=timeout))
+
+    # Return a local file path for a URL, spilling it to disk if needed
+    def path(self, url):
+        with self._lock:
+            if url not in self._files:
+                if url not in self._memory:
+                    return None
+                self._spill(url)
+            return self._files[url]
+
+    def put(self, url, data):
+        with self._lock:
+            self._remove(url)
+            if len(data) > self.spill_threshold:
+                self._write_file(url, data)
+            else:
+                self._memory[url] = data
+                self._memory_bytes += len(data)
+                self._enforce_budget()
+
+    # Take ownership of a downloaded file; small files are moved into memory
+    def adopt(self, url, path):
+        size = os.path.getsize(path)
+        data = None
+        if size <= self.spill_threshold:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.remove(path)
+        with self._lock:
+            self._remove(url)
+            self.downloads += 1
+            if data is None:
+                self._files[url] = path
+            else:
+                self._memory[url] = data
+                self._memory_bytes += len(data)
+                self._enforce_budget()
+
+    # Serve a URL from an existing file without copying or ever deleting it
+    def attach(self, url, path):
+        with self._lock:
+            if self._files.get(url) == path:
+                return
+            self._remove(url)
+            self._files[url] = path
+            self._attached.add(url)
+
+    def _write_file(self, url, data):
+        fd, path = tempfile.mkstemp(dir=self.spill_dir)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        self._files[url] = path
+
+    def _spill(self, url):
+        data = self._memory.pop(url)
+        self._memory_bytes -= len(data)
+        self._write_file(url, data)
+
+    def _enforce_budget(self):
+        while self._memory and self._memory_bytes > self.memory_budget:
+            self._spill(next(iter(self._memory)))
+
+    def _remove(self, url):
+        self._url_locks.pop(url, None)
+        data = self._memory.pop(url, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        path = self._files.pop(url, None)
+        if url in self._attached:
+            self._attached.discard(url)
+        elif path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def discard(self, url):
+        with self._lock:
+            self._remove(url)
+
+    def clear(self):
+        with self._lock:
+            for url in list(self._memory) + list(self._files):
+                self._remove(url)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_items': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_items': len(self._files),
+                'disk_bytes': sum(os.path.getsize(p) for p in self._files.values() if os.path.exists(p)),
+                'downloads': self.downloads,
+                'hits': self.hits,
+            }
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide asset store
+def get_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = AssetStore()
+        return _default_store
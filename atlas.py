@@ -0,0 +1,202 @@
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+# Defaults for texture atlases
+ATLAS_TYPES = ['Object', 'Sprite', 'UI']
+DEFAULT_MAX_SIZE = 2048
+DEFAULT_PADDING = 2
+DEFAULT_TOLERANCE = 8
+
+
+def next_power_of_two(value):
+    return 1 << max(0, int(value) - 1).bit_length()
+
+
+# Bounding box (left, top, right, bottom) of an RGBA array's content. With
+# transparency the border is whatever is (nearly) transparent; otherwise it
+# is the colour most corners share, within tolerance.
+def trim_bounds(pixels, tolerance=DEFAULT_TOLERANCE):
+    alpha = pixels[..., 3]
+    if alpha.min() < 255:
+        mask = alpha > tolerance
+    else:
+        corners = [tuple(pixel) for pixel in pixels[[0, 0, -1, -1], [0, -1, 0, -1], :3].tolist()]
+        background = np.array(max(corners, key=corners.count), dtype=np.int16)
+        mask = (np.abs(pixels[..., :3].astype(np.int16) - background) > tolerance).any(axis=2)
+    rows = np.flatnonzero(mask.any(axis=1))
+    columns = np.flatnonzero(mask.any(axis=0))
+    if not rows.size:
+        return 0, 0, 1, 1
+    return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+
+# One atlas page packed with the MaxRects algorithm (best short side fit):
+# free space is kept as a list of maximal rectangles, each new rectangle
+# goes where it leaves the least space on its shorter side.
+class MaxRectsBin:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free = [(0, 0, width, height)]
+
+    # Place a width x height rectangle and return its (x, y), or None
+    def insert(self, width, height):
+        best = None
+        for fx, fy, fw, fh in self.free:
+            if width <= fw and height <= fh:
+                score = (min(fw - width, fh - height), max(fw - width, fh - height))
+                if best is None or score < best[0]:
+                    best = (score, fx, fy)
+        if best is None:
+            return None
+        _, x, y = best
+        self._place((x, y, width, height))
+        return x, y
+
+    def _place(self, rect):
+        x, y, w, h = rect
+        free = []
+        for fx, fy, fw, fh in self.free:
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                free.append((fx, fy, fw, fh))
+                continue
+            # Split the overlapped free rectangle around the placed one
+            if x > fx:
+                free.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                free.append((x + w, fy, fx + fw - x - w, fh))
+            if y > fy:
+                free.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                free.append((fx, y + h, fw, fy + fh - y - h))
+        # Drop free rectangles contained in another
+        self.free = [
+            a for i, a in enumerate(free)
+            if not any(
+                i != j and a[0] >= b[0] and a[1] >= b[1] and a[0] + a[2] <= b[0] + b[2] and a[1] + a[3] <= b[1] + b[3]
+                and (a != b or j < i)
+                for j, b in enumerate(free)
+            )
+        ]
+
+
+# Pack (width, height) sizes into power-of-two pages no larger than
+# max_size (grown to fit the largest size if needed). Returns a list of
+# (page width, page height, [(index, x, y), ...]).
+def pack(sizes, max_size=DEFAULT_MAX_SIZE, padding=DEFAULT_PADDING):
+    padded = [(w + 2 * padding, h + 2 * padding) for w, h in sizes]
+    max_size = max([max_size] + [next_power_of_two(max(size)) for size in padded])
+    remaining = sorted(range(len(sizes)), key=lambda i: (max(padded[i]), padded[i][0] * padded[i][1]), reverse=True)
+    pages = []
+    while remaining:
+        area = sum(padded[i][0] * padded[i][1] for i in remaining)
+        side = max(next_power_of_two(int(area ** 0.5)), max(next_power_of_two(max(padded[i])) for i in remaining))
+        width = height = min(side, max_size)
+        while True:
+            page = MaxRectsBin(width, height)
+            placed, left = [], []
+            for i in remaining:
+                position = page.insert(*padded[i])
+                if position is None:
+                    left.append(i)
+                else:
+                    placed.append((i, position[0] + padding, position[1] + padding))
+            if not left or (width == max_size and height == max_size):
+                break
+            if width <= height and width < max_size:
+                width *= 2
+            else:
+                height *= 2
+        # Shrink the page to the power-of-two extent actually used
+        width = min(width, next_power_of_two(max(x + sizes[i][0] + padding for i, x, _ in placed)))
+        height = min(height, next_power_of_two(max(y + sizes[i][1] + padding for i, _, y in placed)))
+        pages.append((width, height, sorted(placed)))
+        remaining = left
+    return pages
+
+
+# TexturePacker 'JSON (Hash)' data for one atlas page
+def texturepacker_json(image_name, size, frames):
+    return {
+        'frames': {
+            f"{frame['name']}.png": {
+                'frame': {'x': frame['x'], 'y': frame['y'], 'w': frame['w'], 'h': frame['h']},
+                'rotated': False,
+                'trimmed': frame['trimmed'],
+                'spriteSourceSize': {'x': frame['offset_x'], 'y': frame['offset_y'], 'w': frame['w'], 'h': frame['h']},
+                'sourceSize': {'w': frame['source_w'], 'h': frame['source_h']},
+                'pivot': {'x': 0.5, 'y': 0.5},
+            }
+            for frame in frames
+        },
+        'meta': {
+            'app': 'game-maker',
+            'version': '1.0',
+            'image': image_name,
+            'format': 'RGBA8888',
+            'size': {'w': size[0], 'h': size[1]},
+            'scale': '1',
+        },
+    }
+
+
+# Unity sprite sheet data for one atlas page: one entry per sprite in the
+# shape of UnityEditor.SpriteMetaData, with rects measured from the
+# bottom-left corner as Unity expects
+def unity_json(image_name, size, frames):
+    return {
+        'texture': image_name,
+        'size': {'width': size[0], 'height': size[1]},
+        'spriteMode': 'Multiple',
+        'sprites': [
+            {
+                'name': frame['name'],
+                'rect': {'x': frame['x'], 'y': size[1] - frame['y'] - frame['h'], 'width': frame['w'], 'height': frame['h']},
+                'alignment': 0,
+                'pivot': {'x': 0.5, 'y': 0.5},
+                'border': {'x': 0, 'y': 0, 'z': 0, 'w': 0},
+            }
+            for frame in frames
+        ],
+    }
+
+
+# Trim and pack named images (name, binary file) into atlas pages. images
+# may be a generator: each image is decoded in turn and only its trimmed
+# pixels are kept, so memory follows the atlas size, not the image count.
+# Returns [(page name, png bytes, texturepacker data, unity data), ...].
+def build_atlases(prefix, images, max_size=DEFAULT_MAX_SIZE, padding=DEFAULT_PADDING, tolerance=DEFAULT_TOLERANCE):
+    names, crops, frames = [], [], []
+    for name, source in images:
+        with Image.open(source) as image:
+            pixels = np.asarray(image.convert('RGBA'))
+        left, top, right, bottom = trim_bounds(pixels, tolerance)
+        names.append(name)
+        crops.append(pixels[top:bottom, left:right].copy())
+        frames.append({
+            'name': name, 'w': right - left, 'h': bottom - top,
+            'offset_x': left, 'offset_y': top,
+            'source_w': pixels.shape[1], 'source_h': pixels.shape[0],
+            'trimmed': (right - left, bottom - top) != (pixels.shape[1], pixels.shape[0]),
+        })
+
+    atlases = []
+    pages = pack([(frame['w'], frame['h']) for frame in frames], max_size, padding)
+    for number, (width, height, placed) in enumerate(pages, 1):
+        canvas = np.zeros((height, width, 4), dtype=np.uint8)
+        page_frames = []
+        for i, x, y in placed:
+            canvas[y:y + frames[i]['h'], x:x + frames[i]['w']] = crops[i]
+            page_frames.append({**frames[i], 'x': x, 'y': y})
+        page_name = f"{prefix}_atlas_{number}"
+        with BytesIO() as buffer:
+            Image.fromarray(canvas, 'RGBA').save(buffer, format='PNG', optimize=True)
+            png = buffer.getvalue()
+        atlases.append((
+            page_name, png,
+            texturepacker_json(f"{page_name}.png", (width, height), page_frames),
+            unity_json(f"{page_name}.png", (width, height), page_frames),
+        ))
+    return atlases
@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import asset_store
+import exporter
+import pipeline
+import tracing
+from scheduler import CallSlots
+
+DEFAULT_PARALLEL_PLANS = 4
+DEFAULT_MAX_CALLS = 16
+# Every plan of a batch shares one fair-share session, so a batch run in
+# the app's process gets one session's share of the provider budgets
+BATCH_SESSION = 'batch'
+
+
+# Read (plan id, concept, customization overrides) records from a JSONL file.
+# The concept comes from 'concept' or 'prompt', or from 'title' and 'body'
+# as in requests.jsonl; the id from 'id' or 'request_id'.
+def read_plan_requests(path):
+    with open(path, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            plan_id = str(record.get('id') or record.get('request_id') or f"plan_{line_number}")
+            concept = record.get('concept') or record.get('prompt') or '\n\n'.join(
+                part for part in (record.get('title'), record.get('body')) if part
+            )
+            yield plan_id, concept, record.get('customization', {})
+
+
+def safe_name(plan_id):
+    return re.sub(r'[^\w.-]', '_', plan_id)
+
+
+# Where a finished plan is written; its existence marks the plan as done
+def output_path(output_dir, plan_id, as_zip):
+    name = safe_name(plan_id)
+    return os.path.join(output_dir, f"{name}.zip" if as_zip else name)
+
+
+# Write a finished plan atomically, so a crash never leaves a plan that
+# looks complete
+def write_plan(output_dir, plan_id, concept, game_plan, as_zip, customization=None):
+    store = asset_store.get_store()
+    final_path = output_path(output_dir, plan_id, as_zip)
+    temp_path = final_path + '.partial'
+    package, errors = exporter.build_package(game_plan, store, customization)
+    with package:
+        if as_zip:
+            with open(temp_path, 'wb') as file:
+                shutil.copyfileobj(package, file)
+                file.flush()
+                os.fsync(file.fileno())
+        else:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            with zipfile.ZipFile(package) as zip_file:
+                zip_file.extractall(temp_path)
+            with open(os.path.join(temp_path, 'plan.json'), 'w') as file:
+                json.dump({'id': plan_id, 'concept': concept, 'plan': game_plan}, file, indent=2, default=str)
+    os.replace(temp_path, final_path)
+
+    # The assets are on disk now; free them from the shared store
+    for url in pipeline.plan_asset_urls(game_plan):
+        store.discard(url)
+    return final_path, errors
+
+
+# Generate every plan in a JSONL file, skipping plans that already have output
+def run_batch(input_path, output_dir, api_keys, parallel_plans=DEFAULT_PARALLEL_PLANS,
+              max_calls=DEFAULT_MAX_CALLS, as_zip=False, base_customization=None):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, 'manifest.jsonl')
+    manifest_lock = threading.Lock()
+    call_slots = {'*': CallSlots(max_calls)}
+
+    pending = []
+    for plan_id, concept, overrides in read_plan_requests(input_path):
+        if os.path.exists(output_path(output_dir, plan_id, as_zip)):
+            print(f"Skipping {plan_id}: already generated")
+            continue
+        pending.append((plan_id, concept, overrides))
+
+    def run_one(plan_id, concept, overrides):
+        started = time.time()
+        customization = pipeline.default_customization(base_customization, overrides)
+        warnings = []
+        ctx = pipeline.GenerationContext(api_keys, customization, on_warning=warnings.append, call_slots=call_slots, session=BATCH_SESSION)
+        game_plan = pipeline.generate_game_plan(ctx, concept)
+        path, errors = write_plan(output_dir, plan_id, concept, game_plan, as_zip, customization)
+        entry = {
+            'id': plan_id,
+            'path': path,
+            'seconds': round(time.time() - started, 2),
+            'warnings': warnings + errors,
+        }
+        with manifest_lock, open(manifest_path, 'a') as manifest:
+            manifest.write(json.dumps(entry) + '\n')
+        return entry
+
+    failures = 0
+    with ThreadPoolExecutor(max_workers=max(1, parallel_plans)) as pool:
+        futures = {pool.submit(run_one, *request): request[0] for request in pending}
+        for future in as_completed(futures):
+            plan_id = futures[future]
+            try:
+                entry = future.result()
+                print(f"Finished {plan_id} in {entry['seconds']}s -> {entry['path']}")
+            except Exception as e:
+                failures += 1
+                print(f"Failed {plan_id}: {str(e)}", file=sys.stderr)
+    return len(pending) - failures, failures
+
+
+# Load API keys from the environment, falling back to the saved key file
+def load_batch_api_keys():
+    openai_key, replicate_key = pipeline.load_api_keys()
+    return {
+        'openai': os.environ.get('OPENAI_API_KEY') or openai_key,
+        'replicate': os.environ.get('REPLICATE_API_TOKEN') or replicate_key,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate game plans headlessly from a JSONL file.")
+    parser.add_argument('input', help="JSONL file with one plan request per line")
+    parser.add_argument('--output', default='batch_output', help="Directory for finished plans")
+    parser.add_argument('--zip', action='store_true', help="Write each plan as a ZIP instead of a directory")
+    parser.add_argument('--parallel-plans', type=int, default=DEFAULT_PARALLEL_PLANS, help="Plans generated at the same time")
+    parser.add_argument('--max-calls', type=int, default=DEFAULT_MAX_CALLS, help="Provider calls in flight across all plans")
+    parser.add_argument('--customization', help="JSON file with customization applied to every plan")
+    parser.add_argument('--trace', help="Write a Chrome trace of every call to this file")
+    args = parser.parse_args(argv)
+    tracing.enable(bool(args.trace))
+
+    base_customization = None
+    if args.customization:
+        with open(args.customization, 'r') as file:
+            base_customization = json.load(file)
+
+    succeeded, failed = run_batch(
+        args.input, args.output, load_batch_api_keys(),
+        parallel_plans=args.parallel_plans, max_calls=args.max_calls,
+        as_zip=args.zip, base_customization=base_customization
+    )
+    print(f"{succeeded} plans generated, {failed} failed")
+    if args.trace:
+        with open(args.trace, 'w') as file:
+            file.write(tracing.get_tracer().chrome_trace_json())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
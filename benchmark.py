@@ -0,0 +1,219 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+
+import mock_providers
+import tracing
+
+DEFAULT_IMAGES = '0,4,16'
+DEFAULT_SCRIPTS = '0,2,8'
+DEFAULT_ELEMENTS = '1,4'
+BENCHMARK_PROMPT = "A cozy asteroid mining sim with a talking robot companion"
+
+
+# Samples resident memory on a background thread and keeps the peak.
+# Falls back to the process-wide peak where /proc is not available.
+class PeakRss:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name='rss-sampler', daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/statm', 'r') as file:
+                return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == 'darwin' else peak * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+# Spread a total count over names, one at a time in order
+def distribute(total, names):
+    counts = {name: 0 for name in names}
+    for _, name in zip(range(total), itertools.cycle(names)):
+        counts[name] += 1
+    return counts
+
+
+# Customization for one point of the benchmark matrix
+def scenario_customization(pipeline, images, scripts, elements, base_customization=None):
+    customization = pipeline.default_customization(base_customization)
+    customization['image_count'] = distribute(images, customization['image_types'])
+    customization['script_count'] = distribute(scripts, customization['script_types'])
+    element_names = list(customization['generate_elements'])
+    customization['generate_elements'] = {name: i < elements for i, name in enumerate(element_names)}
+    # Every call must reach the mock servers
+    customization['use_cache'] = False
+    customization['reuse_results'] = False
+    return customization
+
+
+# Provider call totals added since a previous retry summary
+def retry_delta(before, after):
+    delta = {}
+    for provider, totals in after.items():
+        previous = before.get(provider, {})
+        delta[provider] = {name: round(value - previous.get(name, 0), 4) for name, value in totals.items()}
+    return delta
+
+
+# Generate and export one plan against the mock servers and measure it
+def run_scenario(pipeline, servers, images, scripts, elements, base_customization=None):
+    import asset_store
+    import exporter
+    import retry
+
+    customization = scenario_customization(pipeline, images, scripts, elements, base_customization)
+    store = asset_store.get_store()
+    store.clear()
+    for server in servers:
+        server.reset()
+    retries_before = retry.get_stats().summary()
+    warnings = []
+    ctx = pipeline.GenerationContext({'openai': 'benchmark', 'replicate': 'benchmark'}, customization, on_warning=warnings.append)
+
+    with PeakRss() as rss:
+        started = time.perf_counter()
+        game_plan = pipeline.generate_game_plan(ctx, BENCHMARK_PROMPT)
+        generated = time.perf_counter()
+        optimization = {}
+        package, errors = exporter.build_package(game_plan, store, customization, optimization)
+        with package:
+            package.seek(0, os.SEEK_END)
+            zip_bytes = package.tell()
+        exported = time.perf_counter()
+
+    records = [record for server in servers for record in server.records()]
+    failed = sum(
+        1 for key in ('images', 'scripts') for value in game_plan.get(key, {}).values()
+        if isinstance(value, str) and value.startswith('Error')
+    ) + sum(1 for value in game_plan.values() if isinstance(value, str) and value.startswith('Error'))
+    return {
+        'images': images,
+        'scripts': scripts,
+        'elements': elements,
+        'wall_seconds': round(exported - started, 4),
+        'generate_seconds': round(generated - started, 4),
+        'export_seconds': round(exported - generated, 4),
+        'peak_rss_bytes': rss.peak,
+        'zip_bytes': zip_bytes,
+        'bytes_sent': sum(record['bytes_in'] for record in records),
+        'bytes_received': sum(record['bytes_out'] for record in records),
+        'calls': mock_providers.summarize(records),
+        'retries': retry_delta(retries_before, retry.get_stats().summary()),
+        'failed_items': failed,
+        'prompt_savings': game_plan.get('prompt_savings'),
+        'script_checks': game_plan.get('script_checks'),
+        'image_optimization': optimization,
+        'warnings': warnings + errors,
+    }
+
+
+# Run every combination of image, script and element counts against local
+# mock providers, repeat times each, and return the report
+def run_benchmark(images, scripts, elements, repeat=1, profile=None, base_customization=None, label=None):
+    with mock_providers.MockProviderServer('openai', profile) as openai_server, \
+            mock_providers.MockProviderServer('replicate', profile) as replicate_server:
+        # Point every provider client at the mocks before any is created
+        os.environ['REPLICATE_BASE_URL'] = replicate_server.url
+        import pipeline
+        pipeline.CHAT_API_URL = f"{openai_server.url}/v1/chat/completions"
+        pipeline.DALLE_API_URL = f"{openai_server.url}/v1/images/generations"
+
+        runs = []
+        for image_count, script_count, element_count in itertools.product(images, scripts, elements):
+            for iteration in range(repeat):
+                result = run_scenario(
+                    pipeline, (openai_server, replicate_server), image_count, script_count, element_count, base_customization
+                )
+                result['iteration'] = iteration
+                runs.append(result)
+                print(
+                    f"images={image_count} scripts={script_count} elements={element_count} "
+                    f"#{iteration + 1}: {result['wall_seconds']}s, {result['peak_rss_bytes'] / 1e6:.1f} MB peak RSS",
+                    file=sys.stderr
+                )
+
+    return {
+        'label': label,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'profile': openai_server.profile,
+        'customization': base_customization or {},
+        'runs': runs,
+    }
+
+
+def _counts(value):
+    return [int(part) for part in value.split(',') if part.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark plan generation and export against local mock providers.")
+    parser.add_argument('--images', type=_counts, default=_counts(DEFAULT_IMAGES), help="Comma-separated image counts")
+    parser.add_argument('--scripts', type=_counts, default=_counts(DEFAULT_SCRIPTS), help="Comma-separated script counts")
+    parser.add_argument('--elements', type=_counts, default=_counts(DEFAULT_ELEMENTS), help="Comma-separated text element counts")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per combination")
+    parser.add_argument('--profile', help="JSON file overriding the mock latency, failure and payload profile")
+    parser.add_argument('--scale', type=float, help="Multiply every mock latency by this factor")
+    parser.add_argument('--customization', help="JSON file with customization applied to every run")
+    parser.add_argument('--label', help="Name for this run, e.g. a git revision")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--trace', help="Write a Chrome trace of every run to this file")
+    args = parser.parse_args(argv)
+    tracing.enable(bool(args.trace))
+
+    profile = {}
+    if args.profile:
+        with open(args.profile, 'r') as file:
+            profile = json.load(file)
+    if args.scale is not None:
+        profile['scale'] = args.scale
+    base_customization = {'chat_model': 'gpt-4o-mini', 'code_model': 'gpt-4o-mini', 'code_types': {'unity': True}}
+    if args.customization:
+        with open(args.customization, 'r') as file:
+            base_customization.update(json.load(file))
+
+    report = run_benchmark(
+        args.images, args.scripts, args.elements, repeat=args.repeat,
+        profile=profile, base_customization=base_customization, label=args.label
+    )
+    if args.trace:
+        with open(args.trace, 'w') as file:
+            file.write(tracing.get_tracer().chrome_trace_json())
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+import json
+import re
+
+# Fields of a design brief and the most characters each may hold
+BRIEF_FIELDS = {
+    'art_style': 160,
+    'palette': 100,
+    'setting': 200,
+    'characters': 240,
+    'mechanics': 240,
+}
+
+# Brief fields each asset prompt needs
+ASSET_FIELDS = {
+    'Character': ('art_style', 'palette', 'characters'),
+    'Enemy': ('art_style', 'palette', 'characters', 'setting'),
+    'Background': ('art_style', 'palette', 'setting'),
+    'Object': ('art_style', 'palette', 'setting'),
+    'Texture': ('art_style', 'palette', 'setting'),
+    'Sprite': ('art_style', 'palette', 'characters'),
+    'UI': ('art_style', 'palette', 'mechanics'),
+    'music': ('setting', 'art_style', 'mechanics'),
+}
+
+# Most characters of brief context added to a single prompt
+DEFAULT_PROMPT_BUDGET = 600
+
+
+# Rough token count for English text (about four characters per token)
+def estimate_tokens(text):
+    return (len(text) + 3) // 4
+
+
+# Cut text to at most limit characters, at a word boundary where possible
+def clip(text, limit):
+    text = ' '.join(str(text).split())
+    if len(text) <= limit:
+        return text
+    cut = text[:limit + 1].rsplit(' ', 1)[0]
+    return (cut if len(cut) > limit // 2 else text[:limit]).rstrip(' ,;:.')
+
+
+# Prompt asking the chat model to condense a concept into a brief
+def brief_request(game_concept):
+    fields = ', '.join(f"{name} (at most {limit} characters)" for name, limit in BRIEF_FIELDS.items())
+    return (
+        "Condense the following game concept into a design brief for generating its art and music. "
+        f"Reply with only a JSON object with these keys: {fields}. "
+        "Each value is a short phrase or sentence.\n\n"
+        f"Game concept:\n{game_concept}"
+    )
+
+
+# Parse the model's reply into a size-bounded brief. Accepts a JSON object
+# (optionally fenced) or 'Field: value' lines; unknown fields are dropped.
+def parse_brief(text):
+    values = {}
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if match:
+        try:
+            parsed = json.loads(match.group(0))
+            if isinstance(parsed, dict):
+                values = parsed
+        except ValueError:
+            pass
+    if not values:
+        for line in text.splitlines():
+            name, separator, value = line.partition(':')
+            if separator:
+                values[re.sub(r'[^a-z]+', '_', name.strip(' *#-').lower()).strip('_')] = value.strip(' *')
+    brief = {}
+    for name, limit in BRIEF_FIELDS.items():
+        value = values.get(name)
+        if isinstance(value, list):
+            value = ', '.join(str(item) for item in value)
+        if value:
+            brief[name] = clip(value, limit)
+    return brief
+
+
+# Stand-in brief when condensing fails: the start of the concept itself
+def fallback_brief(game_concept, budget=DEFAULT_PROMPT_BUDGET):
+    return {'summary': clip(game_concept, budget)} if game_concept else {}
+
+
+# The part of a brief one asset prompt gets, within budget characters
+def brief_context(brief, asset, budget=DEFAULT_PROMPT_BUDGET):
+    fields = ASSET_FIELDS.get(asset, tuple(BRIEF_FIELDS))
+    parts = [f"{name.replace('_', ' ').capitalize()}: {brief[name]}" for name in fields if brief.get(name)]
+    if brief.get('summary'):
+        parts.append(brief['summary'])
+    return clip('; '.join(parts), budget)
@@ -0,0 +1,186 @@
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from io import BytesIO
+
+import requests
+
+import tracing
+
+# Keep the archive in memory up to this size, then spill it to disk
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEXT_ELEMENTS = ['game_concept', 'world_concept', 'character_concepts', 'plot']
+
+
+def _write_text(zip_file, name, text):
+    zip_file.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), text, compress_type=zipfile.ZIP_DEFLATED)
+
+
+# Copy an open binary file into a STORED zip entry without reading it whole
+def _write_stream(zip_file, name, source):
+    info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED
+    with zip_file.open(info, 'w', force_zip64=True) as entry:
+        shutil.copyfileobj(source, entry, COPY_CHUNK_SIZE)
+
+
+# Write an image entry, passing PNG bytes through and converting anything else
+def _write_image(zip_file, name, source):
+    if source.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE:
+        source.seek(0)
+        _write_stream(zip_file, name, source)
+        return
+    source.seek(0)
+    from PIL import Image
+    with tracing.span('convert_png', 'image', file=name), Image.open(source) as img, BytesIO() as img_buffer:
+        img.save(img_buffer, format='PNG')
+        img_buffer.seek(0)
+        _write_stream(zip_file, name, img_buffer)
+
+
+# Re-encode images with their type's export settings on the process pool
+# (quantised, optimised PNG or WebP, mipmaps) and write them with an
+# optimization_report.json. Images are read as the pool takes them and
+# written as they finish, so only a few are in memory at once. Returns the
+# report totals.
+def _write_optimized_images(zip_file, images, store, customization, errors):
+    import image_optimizer
+    types = {img_type.lower(): img_type for img_type in customization.get('image_types', image_optimizer.DEFAULT_SETTINGS)}
+
+    def jobs():
+        for name, url in images:
+            try:
+                data = store.fetch(url)
+            except requests.RequestException as e:
+                errors.append(f"Error downloading {name}: {str(e)}")
+                continue
+            img_type = types.get(name.rsplit('_image_', 1)[0])
+            yield name, data, image_optimizer.settings_for(img_type, customization.get('image_formats'))
+
+    report = {'original_bytes': 0, 'optimized_bytes': 0, 'mipmap_bytes': 0, 'bytes_saved': 0, 'images': {}}
+    with tracing.span('optimize_images', 'export', images=len(images)) as span:
+        for name, data, settings, outputs in image_optimizer.optimize_images(jobs()):
+            if isinstance(outputs, Exception):
+                errors.append(f"Error optimizing {name}: {str(outputs)}")
+                try:
+                    _write_image(zip_file, f"{name}.png", BytesIO(data))
+                except OSError as e:
+                    errors.append(f"Error converting {name}: {str(e)}")
+                continue
+            for file_name, content in outputs:
+                _write_stream(zip_file, file_name, BytesIO(content))
+            optimized = len(outputs[0][1])
+            mipmaps = sum(len(content) for _, content in outputs[1:])
+            report['images'][name] = {'file': outputs[0][0], 'original_bytes': len(data), 'optimized_bytes': optimized, 'mipmap_bytes': mipmaps, **settings}
+            report['original_bytes'] += len(data)
+            report['optimized_bytes'] += optimized
+            report['mipmap_bytes'] += mipmaps
+        report['bytes_saved'] = report['original_bytes'] - report['optimized_bytes']
+        span.set(bytes_saved=report['bytes_saved'])
+    if report['images']:
+        _write_text(zip_file, "optimization_report.json", json.dumps(report, indent=2))
+    return {name: value for name, value in report.items() if name != 'images'}
+
+
+# Pack the plan's images of each atlas type into texture atlases under
+# atlases/, with TexturePacker and Unity frame data next to each page
+def _write_atlases(zip_file, game_plan, store, customization, errors):
+    import atlas
+    for img_type in customization.get('atlas_types', atlas.ATLAS_TYPES):
+        prefix = img_type.lower()
+        names = [
+            (name, url) for name, url in game_plan.get('images', {}).items()
+            if name.rsplit('_image_', 1)[0] == prefix and isinstance(url, str) and url.startswith('http')
+        ]
+        if not names:
+            continue
+        try:
+            with tracing.span('write_atlas', 'export', type=img_type, images=len(names)):
+                sources = ((name, BytesIO(store.fetch(url))) for name, url in names)
+                pages = atlas.build_atlases(
+                    prefix, sources,
+                    max_size=customization.get('atlas_max_size', atlas.DEFAULT_MAX_SIZE),
+                    padding=customization.get('atlas_padding', atlas.DEFAULT_PADDING)
+                )
+                for page_name, png, texturepacker_data, unity_data in pages:
+                    _write_stream(zip_file, f"atlases/{page_name}.png", BytesIO(png))
+                    _write_text(zip_file, f"atlases/{page_name}.json", json.dumps(texturepacker_data, indent=2))
+                    _write_text(zip_file, f"atlases/{page_name}.unity.json", json.dumps(unity_data, indent=2))
+        except requests.RequestException as e:
+            errors.append(f"Error downloading {img_type} images for the atlas: {str(e)}")
+        except OSError as e:
+            errors.append(f"Error packing the {img_type} atlas: {str(e)}")
+
+
+# Build the game plan package into a spooled temp file.
+# Text and scripts are deflated; images are optimised per type and, like
+# MP3 music, stored as-is. Object, Sprite and UI images are also packed
+# into texture atlases unless customization says otherwise. Image
+# optimisation totals are added to report, if given. Returns (file,
+# errors) with the file rewound to the start.
+def build_package(game_plan, store, customization=None, report=None):
+    with tracing.span('build_package', 'export') as span:
+        package, errors = _build_package(game_plan, store, customization or {}, report)
+        package.seek(0, os.SEEK_END)
+        span.set(zip_bytes=package.tell(), errors=len(errors))
+        package.seek(0)
+    return package, errors
+
+
+def _build_package(game_plan, store, customization, report):
+    errors = []
+    package = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    with zipfile.ZipFile(package, 'w') as zip_file:
+        # Add text documents
+        with tracing.span('write_text', 'export'):
+            for key in TEXT_ELEMENTS:
+                if key in game_plan:
+                    _write_text(zip_file, f"{key}.txt", game_plan[key])
+            if game_plan.get('design_brief'):
+                brief = {name: value for name, value in game_plan['design_brief'].items() if name != 'concept_tokens'}
+                _write_text(zip_file, "design_brief.json", json.dumps(brief, indent=2))
+
+        # Add images
+        images = [
+            (name, url) for name, url in game_plan.get('images', {}).items()
+            if isinstance(url, str) and url.startswith('http')
+        ]
+        if customization.get('optimize_images', False):
+            optimized = _write_optimized_images(zip_file, images, store, customization, errors)
+            if report is not None:
+                report.update(optimized)
+        else:
+            for asset_name, asset_url in images:
+                try:
+                    with tracing.span('write_image', 'export', file=asset_name), store.open(asset_url) as source:
+                        _write_image(zip_file, f"{asset_name}.png", source)
+                except requests.RequestException as e:
+                    errors.append(f"Error downloading {asset_name}: {str(e)}")
+                except OSError as e:
+                    errors.append(f"Error converting {asset_name}: {str(e)}")
+        _write_atlases(zip_file, game_plan, store, customization, errors)
+
+        # Add scripts
+        with tracing.span('write_scripts', 'export'):
+            for script_name, script_code in game_plan.get('scripts', {}).items():
+                _write_text(zip_file, script_name, script_code)
+
+        # Add additional elements
+        for element_name, element_content in game_plan.get('additional_elements', {}).items():
+            _write_text(zip_file, f"{element_name}.txt", element_content)
+
+        # Add music if generated
+        if game_plan.get('music'):
+            try:
+                with tracing.span('write_music', 'export'), store.open(game_plan['music']) as source:
+                    _write_stream(zip_file, "background_music.mp3", source)
+            except requests.RequestException as e:
+                errors.append(f"Error downloading music: {str(e)}")
+
+    package.seek(0)
+    return package, errors
@@ -0,0 +1,300 @@
+import itertools
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import retry
+
+# Calls are served in priority order: text first, then music, then images
+PRIORITIES = {'text': 0, 'audio': 1, 'image': 2}
+# Seconds a call may wait before it is served as if it were text
+DEFAULT_AGING = 10.0
+# Budgets shared by every session; None is unlimited. Override with
+# GAME_MAKER_<PROVIDER>_CONCURRENCY and GAME_MAKER_<PROVIDER>_TPM (0 = unlimited).
+DEFAULT_BUDGETS = {
+    'openai': {'concurrency': 16, 'tokens_per_minute': 200000},
+    'replicate': {'concurrency': 16, 'tokens_per_minute': None},
+}
+DEFAULT_SESSION = 'local'
+# Idle sessions are forgotten after this many seconds
+SESSION_TTL = 3600
+# Waits kept per session for the percentiles
+WAIT_HISTORY = 200
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Budgets from DEFAULT_BUDGETS and the environment
+def budgets_from_env(environ=None):
+    environ = os.environ if environ is None else environ
+    budgets = {provider: dict(budget) for provider, budget in DEFAULT_BUDGETS.items()}
+    for provider, budget in budgets.items():
+        for key, suffix in (('concurrency', 'CONCURRENCY'), ('tokens_per_minute', 'TPM')):
+            value = environ.get(f"GAME_MAKER_{provider.upper()}_{suffix}")
+            if value:
+                budget[key] = int(value) or None
+    return budgets
+
+
+# One provider call waiting for, or holding, a slot
+class Ticket:
+    def __init__(self, provider, session, kind, tokens, start, seq, count=1):
+        self.provider = provider
+        self.session = session
+        self.kind = kind
+        self.tokens = tokens
+        self.count = count
+        self.start = start
+        self.seq = seq
+        self.queued_at = time.monotonic()
+        self.granted = threading.Event()
+        self.charged = 0
+        self.scheduler = None
+
+    # Sort key: priority class (text once aged), then fair-share start tag
+    def order(self, now, aging):
+        priority = 0 if now - self.queued_at >= aging else PRIORITIES.get(self.kind, 0)
+        return priority, self.start, self.seq
+
+    # Correct the token charge once the real usage is known
+    def used(self, tokens):
+        self.scheduler._reconcile(self, tokens)
+
+
+class _Provider:
+    def __init__(self):
+        self.concurrency = None
+        self.tokens_per_minute = None
+        self.tokens = 0.0
+        self.refilled = time.monotonic()
+        self.active = 0
+        self.waiting = []
+        # Virtual time and each session's last finish tag
+        self.virtual = 0.0
+        self.finish = {}
+
+    def refill(self, now):
+        if self.tokens_per_minute:
+            self.tokens = min(self.tokens_per_minute, self.tokens + (now - self.refilled) * self.tokens_per_minute / 60.0)
+        self.refilled = now
+
+    # A call larger than the whole budget runs once the bucket is full
+    def fits(self, tokens):
+        return not self.tokens_per_minute or not tokens or self.tokens >= min(tokens, self.tokens_per_minute)
+
+    # Seconds until the bucket holds tokens
+    def refill_delay(self, tokens):
+        if not self.tokens_per_minute:
+            return None
+        missing = min(tokens, self.tokens_per_minute) - self.tokens
+        return max(0.0, missing * 60.0 / self.tokens_per_minute)
+
+
+# Admits provider calls from every session of the process. Each provider
+# has a concurrency limit and a tokens-per-minute bucket shared by all
+# sessions. Waiting calls are served by priority class, then by start-time
+# fair queuing: a session's calls get start tags one slot apart, so a
+# session that queued a hundred images cannot hold back one that just
+# asked for a single chat reply. A slot may stand for several concurrent
+# calls (count), which are admitted together.
+class FairShareScheduler:
+    def __init__(self, budgets=None, aging=DEFAULT_AGING, limiter=None):
+        self.aging = aging
+        # Optional object with fraction(provider) that scales the limits
+        # down after rate-limit errors, e.g. retry.AdaptiveLimiter
+        self.limiter = limiter
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._providers = {}
+        self._sessions = {}
+        for provider, budget in (budgets or {}).items():
+            self.configure(provider, **budget)
+
+    def _provider(self, name):
+        if name not in self._providers:
+            self._providers[name] = _Provider()
+        return self._providers[name]
+
+    def _session(self, name):
+        if name not in self._sessions:
+            self._sessions[name] = {'queued': 0, 'active': 0, 'served': 0, 'waits': deque(maxlen=WAIT_HISTORY)}
+        session = self._sessions[name]
+        session['seen'] = time.monotonic()
+        return session
+
+    # Set a provider's budgets. The concurrency limit is also the shared
+    # limiter's maximum, which rate-limit errors scale down from.
+    def configure(self, provider, concurrency=None, tokens_per_minute=None):
+        if self.limiter is not None and concurrency:
+            self.limiter.set_max(provider, concurrency)
+        with self._lock:
+            state = self._provider(provider)
+            state.refill(time.monotonic())
+            if tokens_per_minute and not state.tokens_per_minute:
+                state.tokens = float(tokens_per_minute)
+            state.concurrency = concurrency
+            state.tokens_per_minute = tokens_per_minute
+            if tokens_per_minute:
+                state.tokens = min(state.tokens, tokens_per_minute)
+            self._dispatch(provider, state)
+
+    # Hold a slot for count calls to provider. kind picks the priority
+    # class and tokens is charged to the provider's budget; call used() on
+    # the yielded ticket with the real count to correct it. A slot larger
+    # than the limit is admitted once the provider is idle.
+    @contextmanager
+    def slot(self, provider, session=DEFAULT_SESSION, kind='text', tokens=0, count=1):
+        ticket = self._enqueue(provider, session, kind, tokens, max(1, int(count)))
+        try:
+            self._wait(ticket)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+    def _enqueue(self, provider, session, kind, tokens, count):
+        with self._lock:
+            state = self._provider(provider)
+            start = max(state.virtual, state.finish.get(session, 0.0))
+            state.finish[session] = start + count
+            ticket = Ticket(provider, session, kind, max(0, int(tokens)), start, next(self._seq), count)
+            ticket.scheduler = self
+            state.waiting.append(ticket)
+            self._session(session)['queued'] += 1
+            self._dispatch(provider, state)
+            return ticket
+
+    # Wait to be admitted, waking now and then to refill the token budget,
+    # age waiting calls and follow changes to the limits
+    def _wait(self, ticket):
+        state = self._providers[ticket.provider]
+        while True:
+            with self._lock:
+                delay = state.refill_delay(ticket.tokens) if ticket.tokens else None
+            if ticket.granted.wait(1.0 if delay is None else min(1.0, max(0.01, delay))):
+                return
+            with self._lock:
+                self._dispatch(ticket.provider, state)
+
+    def _cancel(self, ticket):
+        with self._lock:
+            state = self._providers[ticket.provider]
+            if ticket in state.waiting:
+                state.waiting.remove(ticket)
+                self._sessions[ticket.session]['queued'] -= 1
+            elif ticket.granted.is_set():
+                self._finish(ticket, state)
+
+    def _release(self, ticket):
+        with self._lock:
+            self._finish(ticket, self._providers[ticket.provider])
+
+    def _finish(self, ticket, state):
+        state.active -= ticket.count
+        self._sessions[ticket.session]['active'] -= 1
+        self._dispatch(ticket.provider, state)
+
+    def _reconcile(self, ticket, tokens):
+        with self._lock:
+            state = self._providers[ticket.provider]
+            if state.tokens_per_minute:
+                state.tokens += ticket.charged - tokens
+            ticket.charged = tokens
+
+    def _limit(self, provider, state):
+        if state.concurrency is None:
+            return None
+        fraction = self.limiter.fraction(provider) if self.limiter is not None else 1.0
+        return max(1, int(state.concurrency * fraction))
+
+    # The next call to admit: the first in order that fits the token
+    # budget. Once the first call that does not fit has waited past aging,
+    # only calls that use no tokens may pass it.
+    def _next(self, state, now):
+        ordered = sorted(state.waiting, key=lambda ticket: ticket.order(now, self.aging))
+        for ticket in ordered:
+            if state.fits(ticket.tokens):
+                return ticket
+            if now - ticket.queued_at >= self.aging:
+                return next((other for other in ordered if not other.tokens), None)
+        return None
+
+    # Admit waiting calls while the provider has capacity; call with the lock held
+    def _dispatch(self, provider, state):
+        now = time.monotonic()
+        state.refill(now)
+        limit = self._limit(provider, state)
+        while state.waiting:
+            ticket = self._next(state, now)
+            if ticket is None or (limit is not None and state.active and state.active + ticket.count > limit):
+                break
+            state.waiting.remove(ticket)
+            state.active += ticket.count
+            state.virtual = max(state.virtual, ticket.start)
+            if state.tokens_per_minute:
+                state.tokens -= ticket.tokens
+            ticket.charged = ticket.tokens
+            session = self._session(ticket.session)
+            session['queued'] -= 1
+            session['active'] += 1
+            session['served'] += 1
+            session['waits'].append(now - ticket.queued_at)
+            ticket.granted.set()
+
+    # Live queue depths per provider and per session
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            for name, session in list(self._sessions.items()):
+                if not session['queued'] and not session['active'] and now - session['seen'] > SESSION_TTL:
+                    del self._sessions[name]
+                    for state in self._providers.values():
+                        state.finish.pop(name, None)
+            providers = {}
+            for name, state in self._providers.items():
+                state.refill(now)
+                queued = {}
+                for ticket in state.waiting:
+                    queued[ticket.kind] = queued.get(ticket.kind, 0) + 1
+                providers[name] = {
+                    'active': state.active,
+                    'limit': self._limit(name, state),
+                    'queued': queued,
+                    'tokens_available': int(state.tokens) if state.tokens_per_minute else None,
+                    'tokens_per_minute': state.tokens_per_minute,
+                }
+            sessions = {
+                name: {
+                    'queued': session['queued'],
+                    'active': session['active'],
+                    'served': session['served'],
+                    'wait_p50': round(_percentile(session['waits'], 0.5), 3),
+                    'wait_p95': round(_percentile(session['waits'], 0.95), 3),
+                }
+                for name, session in self._sessions.items()
+            }
+            return {'providers': providers, 'sessions': sessions}
+
+
+_default_scheduler = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide scheduler, shared by every Streamlit session, job
+# and batch run in the process
+def get_scheduler():
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = FairShareScheduler(budgets_from_env(), limiter=retry.get_limiter())
+        return _default_scheduler
@@ -0,0 +1,110 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Default pool sizes for the shared HTTP sessions
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+# (connect, read) seconds for requests that do not set their own timeout;
+# read is the longest gap between bytes, not the whole response
+DEFAULT_TIMEOUT = (10, 120)
+
+# Process-wide state; imported modules survive Streamlit reruns and are
+# shared by every session served from the same process.
+_lock = threading.Lock()
+_sessions = {}
+_replicate_clients = {}
+_config = {'pool_connections': DEFAULT_POOL_CONNECTIONS, 'pool_maxsize': DEFAULT_POOL_MAXSIZE}
+_counters = {'sessions_created': 0, 'replicate_clients_created': 0, 'replicate_client_hits': 0}
+
+
+# Change the pool sizes; existing sessions are rebuilt on next use
+def configure(pool_connections=None, pool_maxsize=None):
+    with _lock:
+        new_config = dict(_config)
+        if pool_connections is not None:
+            new_config['pool_connections'] = max(1, int(pool_connections))
+        if pool_maxsize is not None:
+            new_config['pool_maxsize'] = max(1, int(pool_maxsize))
+        if new_config == _config:
+            return
+        _config.update(new_config)
+        old_sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in old_sessions:
+        session.close()
+
+
+# Applies DEFAULT_TIMEOUT to requests sent without a timeout, so a stalled
+# provider cannot hold a worker (and its call slot) forever
+class _TimeoutAdapter(HTTPAdapter):
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=DEFAULT_TIMEOUT if timeout is None else timeout, **kwargs)
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = _TimeoutAdapter(pool_connections=_config['pool_connections'], pool_maxsize=_config['pool_maxsize'])
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Get the keep-alive session for the host of a URL
+def get_session(url):
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session()
+            _counters['sessions_created'] += 1
+        return session
+
+
+def get(url, **kwargs):
+    return get_session(url).get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_session(url).post(url, **kwargs)
+
+
+# Get the shared Replicate client for an API token
+def get_replicate_client(api_token):
+    with _lock:
+        client = _replicate_clients.get(api_token)
+        if client is None:
+            import replicate
+            client = _replicate_clients[api_token] = replicate.Client(api_token=api_token)
+            _counters['replicate_clients_created'] += 1
+        else:
+            _counters['replicate_client_hits'] += 1
+        return client
+
+
+# Connection reuse counters across all shared sessions
+def stats():
+    with _lock:
+        sessions = dict(_sessions)
+        result = dict(_counters)
+    connections = 0
+    requests_sent = 0
+    for session in sessions.values():
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+    result.update({
+        'hosts': len(sessions),
+        'connections_opened': connections,
+        'requests_sent': requests_sent,
+        'connections_reused': max(0, requests_sent - connections),
+    })
+    return result
@@ -0,0 +1,171 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+# NumPy and Pillow are imported where they are used, so the app can read
+# the settings below without loading them
+
+# Export formats an image type can be written in
+FORMATS = ['png', 'webp', 'webp-lossless']
+
+# Default export settings per image type: lossless and without mipmaps,
+# until the user opts in from the export settings. colors > 0 quantises to
+# a palette of that many colours; mipmaps adds a NumPy-built mip chain.
+DEFAULT_SETTINGS = {
+    'Character': {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False},
+    'Enemy': {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False},
+    'Background': {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False},
+    'Object': {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False},
+    'Texture': {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False},
+    'Sprite': {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False},
+    'UI': {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False},
+}
+FALLBACK_SETTINGS = {'format': 'png', 'quality': 90, 'colors': 0, 'mipmaps': False}
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+
+# Export settings for an image type: the defaults with overrides applied
+def settings_for(img_type, overrides=None):
+    return {**FALLBACK_SETTINGS, **DEFAULT_SETTINGS.get(img_type, {}), **(overrides or {}).get(img_type, {})}
+
+
+def file_extension(format):
+    return 'webp' if format.startswith('webp') else 'png'
+
+
+# Reduce an image to a palette of at most colors colours, keeping alpha
+def quantize(image, colors):
+    from PIL import Image, features
+    method = Image.Quantize.LIBIMAGEQUANT if features.check('libimagequant') else Image.Quantize.FASTOCTREE
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    return image.quantize(colors=min(256, colors), method=method, dither=Image.Dither.FLOYDSTEINBERG)
+
+
+def encode(image, format, quality):
+    with BytesIO() as buffer:
+        if format == 'webp':
+            image.save(buffer, format='WEBP', quality=quality, method=6)
+        elif format == 'webp-lossless':
+            image.save(buffer, format='WEBP', lossless=True, quality=quality, method=6)
+        else:
+            image.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+
+# Halve an image repeatedly down to 1x1 with a 2x2 box filter. Colour is
+# averaged premultiplied by alpha so transparent pixels do not bleed.
+def mipmap_chain(image):
+    import numpy as np
+    from PIL import Image
+    pixels = np.asarray(image.convert('RGBA'), dtype=np.float32) / 255.0
+    pixels[..., :3] *= pixels[..., 3:]
+    levels = []
+    while pixels.shape[0] > 1 or pixels.shape[1] > 1:
+        height, width = max(1, pixels.shape[0] // 2), max(1, pixels.shape[1] // 2)
+        if pixels.shape[0] == 1:
+            pixels = pixels[:, :width * 2].reshape(1, width, 2, 4).mean(axis=2)
+        elif pixels.shape[1] == 1:
+            pixels = pixels[:height * 2].reshape(height, 2, 1, 4).mean(axis=1)
+        else:
+            pixels = pixels[:height * 2, :width * 2].reshape(height, 2, width, 2, 4).mean(axis=(1, 3))
+        level = pixels.copy()
+        alpha = level[..., 3:]
+        level[..., :3] = np.divide(level[..., :3], alpha, out=np.zeros_like(level[..., :3]), where=alpha > 0)
+        levels.append(Image.fromarray(np.round(level * 255.0).astype(np.uint8), 'RGBA'))
+    return levels
+
+
+# Optimise one image. Runs in a worker process, so it only takes and
+# returns plain data: [(file name, bytes), ...], base image first.
+def optimize_image(name, data, settings):
+    from PIL import Image
+    format = settings.get('format', 'png')
+    quality = settings.get('quality', 90)
+    extension = file_extension(format)
+    with Image.open(BytesIO(data)) as source:
+        source.load()
+        image = source
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        # Drop an alpha channel that is fully opaque
+        if image.mode == 'RGBA' and image.getextrema()[3][0] == 255:
+            image = image.convert('RGB')
+        colors = settings.get('colors') or 0
+        outputs = [(f"{name}.{extension}", encode(quantize(image, colors) if colors else image, format, quality))]
+        if settings.get('mipmaps'):
+            for level, mip in enumerate(mipmap_chain(image), 1):
+                outputs.append((f"{name}_mip{level}.{extension}", encode(mip, format, quality)))
+    return outputs
+
+
+_default_pool = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide worker pool for image optimisation. Workers come
+# from a fork server rather than forking this process, whose Streamlit,
+# job and prediction threads may hold locks.
+def get_pool():
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = ProcessPoolExecutor(max_workers=DEFAULT_WORKERS, mp_context=multiprocessing.get_context('forkserver'))
+        return _default_pool
+
+
+def _reset_pool():
+    global _default_pool
+    with _default_lock:
+        _default_pool = None
+
+
+# Optimise images on the process pool. jobs is an iterable of (name,
+# bytes, settings), read only as results are taken, so at most
+# max_in_flight images are held at once; yields (name, bytes, settings,
+# outputs or the exception raised) in job order. Falls back to this
+# process if the pool cannot start.
+def optimize_images(jobs, max_in_flight=None):
+    max_in_flight = max(1, max_in_flight or 2 * DEFAULT_WORKERS)
+    pool = None
+    try:
+        pool = get_pool()
+    except (OSError, RuntimeError):
+        _reset_pool()
+
+    def submit(job):
+        nonlocal pool
+        if pool is not None:
+            try:
+                return pool.submit(optimize_image, *job)
+            except (BrokenProcessPool, RuntimeError):
+                _reset_pool()
+                pool = None
+        return None
+
+    def result(job, future):
+        nonlocal pool
+        try:
+            try:
+                return future.result() if future is not None else optimize_image(*job)
+            except BrokenProcessPool:
+                _reset_pool()
+                pool = None
+                return optimize_image(*job)
+        except Exception as e:
+            return e
+
+    in_flight = deque()
+    for job in jobs:
+        in_flight.append((job, submit(job)))
+        if len(in_flight) >= max_in_flight:
+            job, future = in_flight.popleft()
+            yield (*job, result(job, future))
+    while in_flight:
+        job, future = in_flight.popleft()
+        yield (*job, result(job, future))
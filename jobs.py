@@ -0,0 +1,182 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import asset_store
+import pipeline
+import projects
+import response_cache
+
+# Defaults for background generation jobs
+DEFAULT_JOB_DB = os.path.join(response_cache.DEFAULT_CACHE_DIR, 'jobs.sqlite3')
+DEFAULT_JOB_WORKERS = 2
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _dump(value):
+    return json.dumps(value, default=str)
+
+
+# SQLite record of jobs, their progress and every partial result
+class JobStore:
+    def __init__(self, path=DEFAULT_JOB_DB):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, prompt TEXT NOT NULL, customization TEXT NOT NULL, "
+            "progress REAL NOT NULL DEFAULT 0, message TEXT NOT NULL DEFAULT '', warnings TEXT NOT NULL DEFAULT '[]', "
+            "plan TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS job_results ("
+            "job_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (job_id, key));"
+        )
+        self._conn.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self._conn.execute(sql, params)
+            self._conn.commit()
+
+    def create(self, prompt, customization):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, prompt, customization, created, updated) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, prompt, _dump(customization), now, now)
+        )
+        return job_id
+
+    def update(self, job_id, **fields):
+        fields['updated'] = time.time()
+        for name in ('warnings', 'plan'):
+            if name in fields:
+                fields[name] = _dump(fields[name])
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def add_result(self, job_id, key, value):
+        self._execute(
+            "INSERT OR REPLACE INTO job_results (job_id, key, value) VALUES (?, ?, ?)",
+            (job_id, _dump(key), _dump(value))
+        )
+
+    def results(self, job_id):
+        with self._lock:
+            rows = self._conn.execute("SELECT key, value FROM job_results WHERE job_id = ?", (job_id,)).fetchall()
+        return [(json.loads(key), json.loads(value)) for key, value in rows]
+
+    def get(self, job_id):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        if row is None:
+            return None
+        job = dict(zip(columns, row))
+        job['customization'] = json.loads(job['customization'])
+        job['warnings'] = json.loads(job['warnings'])
+        job['plan'] = json.loads(job['plan']) if job['plan'] else None
+        return job
+
+    def recent(self, limit=10):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, status, prompt, progress, created FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(zip(('id', 'status', 'prompt', 'progress', 'created'), row)) for row in rows]
+
+    # Jobs left active by a previous process can never finish
+    def mark_interrupted(self):
+        self._execute(
+            "UPDATE jobs SET status = 'interrupted', message = 'Interrupted by a restart', updated = ? "
+            "WHERE status IN ('queued', 'running')",
+            (time.time(),)
+        )
+
+
+# Runs game plan jobs on worker threads, independent of any Streamlit
+# session, so a rerun or disconnect never loses work in progress.
+class JobRunner:
+    def __init__(self, store, workers=DEFAULT_JOB_WORKERS):
+        self.store = store
+        store.mark_interrupted()
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._live = {}
+
+    # Queue a plan and return its job id; API keys are kept in memory only.
+    # Unchanged parts of a previous plan are reused instead of regenerated.
+    # Provider calls share the fair-share scheduler as session.
+    def submit(self, api_keys, customization, prompt, previous=None, session=None):
+        customization = copy.deepcopy(customization)
+        job_id = self.store.create(prompt, customization)
+        self._pool.submit(self._run, job_id, dict(api_keys), customization, prompt, previous, session)
+        return job_id
+
+    # Text streamed so far for each unfinished task of a running job
+    def live_output(self, job_id):
+        with self._lock:
+            return dict(self._live.get(job_id, {}))
+
+    def _run(self, job_id, api_keys, customization, prompt, previous, session):
+        warnings = []
+
+        def on_warning(message):
+            warnings.append(message)
+            self.store.update(job_id, warnings=warnings)
+
+        def on_status(message, progress):
+            self.store.update(job_id, message=message, progress=progress)
+
+        def on_stream(key, text):
+            with self._lock:
+                self._live.setdefault(job_id, {})[key] = text
+
+        def on_result(key, value):
+            with self._lock:
+                self._live.get(job_id, {}).pop(key, None)
+            self.store.add_result(job_id, key, value)
+
+        self.store.update(job_id, status='running')
+        ctx = pipeline.GenerationContext(api_keys, customization, on_warning=on_warning, session=session)
+        try:
+            game_plan = pipeline.generate_game_plan(
+                ctx, prompt, on_status=on_status, on_stream=on_stream, on_result=on_result, previous=previous
+            )
+            # Keep the plan and its assets as a project under the job's id
+            if customization.get('save_projects', True):
+                on_status("Saving the project...", 1.0)
+                try:
+                    projects.get_store().save(
+                        game_plan, prompt, customization, asset_store.get_store(), project_id=job_id, on_error=on_warning
+                    )
+                except (OSError, sqlite3.Error) as e:
+                    on_warning(f"Unable to save the project: {str(e)}")
+            self.store.update(job_id, status='done', progress=1.0, plan=game_plan)
+        except Exception as e:
+            self.store.update(job_id, status='failed', error=str(e))
+        finally:
+            with self._lock:
+                self._live.pop(job_id, None)
+
+
+_default_runner = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide job runner
+def get_runner():
+    global _default_runner
+    with _default_lock:
+        if _default_runner is None:
+            _default_runner = JobRunner(JobStore())
+        return _default_runner
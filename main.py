@@ -1,351 +1,218 @@
+import time
+import uuid
+
 import streamlit as st
 import requests
-import json
-import os
-import zipfile
-from io import BytesIO
-from PIL import Image
-import replicate
-import base64 
-import re
-
-# Constants
-CHAT_API_URL = "https://api.openai.com/v1/chat/completions"
-DALLE_API_URL = "https://api.openai.com/v1/images/generations"
-API_KEY_FILE = "api_keys.json"
+import asset_store
+import exporter
+import fair_share
+import http_pool
+import image_optimizer
+import jobs
+import pipeline
+import predictions
+import projects
+import providers
+import response_cache
+import retry
+import thumbnails
+import tracing
 
 # Initialize session state
 if 'api_keys' not in st.session_state:
     st.session_state.api_keys = {'openai': None, 'replicate': None}
 
-if 'customization' not in st.session_state:
-    st.session_state.customization = {
-        'image_types': ['Character', 'Enemy', 'Background', 'Object', 'Texture', 'Sprite', 'UI'],
-        'script_types': ['Player', 'Enemy', 'Game Object', 'Level Background'],
-        'image_count': {t: 0 for t in ['Character', 'Enemy', 'Background', 'Object', 'Texture', 'Sprite', 'UI']},
-        'script_count': {t: 0 for t in ['Player', 'Enemy', 'Game Object', 'Level Background']},
-        'use_replicate': {'generate_music': False},
-        'code_types': {'unity': False, 'unreal': False, 'blender': False},
-        'generate_elements': {
-            'game_concept': True,
-            'world_concept': True,
-            'character_concepts': True,
-            'plot': True,
-            'storyline': False,
-            'dialogue': False,
-            'game_mechanics': False,
-            'level_design': False
-        },
-        'image_model': 'dall-e-3',
-        'chat_model': 'gpt-4o',
-        'code_model': 'gpt-4o',
-    }
-
-# Load API keys from a file
-def load_api_keys():
-    if os.path.exists(API_KEY_FILE):
-        with open(API_KEY_FILE, 'r') as file:
-            data = json.load(file)
-            return data.get('openai'), data.get('replicate')
-    return None, None
-
-# Save API keys to a file
-def save_api_keys(openai_key, replicate_key):
-    with open(API_KEY_FILE, 'w') as file:
-        json.dump({"openai": openai_key, "replicate": replicate_key}, file)
-
-# Get headers for OpenAI API
-def get_openai_headers():
-    return {
-        "Authorization": f"Bearer {st.session_state.api_keys['openai']}",
-        "Content-Type": "application/json"
-    }
-
-# Generate content using selected chat model
-def generate_content(prompt, role):
-    if st.session_state.customization['chat_model'] in ['gpt-4', 'gpt-4o-mini']:
-        data = {
-            "model": st.session_state.customization['chat_model'],
-            "messages": [
-                {"role": "system", "content": f"You are a highly skilled assistant specializing in {role}. Provide detailed, creative, and well-structured responses optimized for game development."},
-                {"role": "user", "content": prompt}
-            ]
-        }
-
-        try:
-            response = requests.post(CHAT_API_URL, headers=get_openai_headers(), json=data)
-            response.raise_for_status()
-            response_data = response.json()
-            if "choices" not in response_data:
-                error_message = response_data.get("error", {}).get("message", "Unknown error")
-                return f"Error: {error_message}"
-
-            content_text = response_data["choices"][0]["message"]["content"]
-            return content_text
-
-        except requests.RequestException as e:
-            return f"Error: Unable to communicate with the OpenAI API: {str(e)}"
-    elif st.session_state.customization['chat_model'] == 'llama':
-        try:
-            client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-            output = client.run(
-                "meta/llama-2-70b-chat:02e509c789964a7ea8736978a43525956ef40397be9033abf9fd2badfe68c9e3",
-                input={
-                    "prompt": f"You are a highly skilled assistant specializing in {role}. Provide detailed, creative, and well-structured responses optimized for game development.\n\nHuman: {prompt}\n\nAssistant:",
-                    "temperature": 0.75,
-                    "top_p": 0.9,
-                    "max_length": 500,
-                    "repetition_penalty": 1
-                }
-            )
-            return ''.join(output)
-        except Exception as e:
-            return f"Error: Unable to generate content using Llama: {str(e)}"
-    else:
-        return "Error: Invalid chat model selected."
-
-# Generate images using selected image model
-# Generate images using selected image model
-def generate_image(prompt, size, steps=25, guidance=3.0, interval=2.0):
-    if st.session_state.customization['image_model'] == 'dall-e-3':
-        data = {
-            "model": "dall-e-3",
-            "prompt": prompt,
-            "size": f"{size[0]}x{size[1]}",
-            "n": 1,
-            "response_format": "url"
-        }
-        try:
-            response = requests.post(DALLE_API_URL, headers=get_openai_headers(), json=data)
-            response.raise_for_status()
-            response_data = response.json()
-            if "data" not in response_data:
-                error_message = response_data.get("error", {}).get("message", "Unknown error")
-                return f"Error: {error_message}"
-            if not response_data["data"]:
-                return "Error: No data returned from API."
-            return response_data["data"][0]["url"]
-        except requests.RequestException as e:
-            return f"Error: Unable to generate image: {str(e)}"
-    elif st.session_state.customization['image_model'] == 'SD Flux-1':
-        try:
-            # Convert size to aspect ratio
-            width, height = size
-            if width == height:
-                aspect_ratio = "1:1"
-            elif width > height:
-                aspect_ratio = "16:9" if width / height > 1.7 else "3:2"
-            else:
-                aspect_ratio = "9:16" if height / width > 1.7 else "2:3"
-
-            # Debug print statement to check API key
-            print(f"Debug: Replicate API key: {st.session_state.api_keys['replicate'][:5]}...")
-
-            # Initialize Replicate client with API key
-            client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-
-            output = client.run(
-                "black-forest-labs/flux-pro",
-                input={
-                    "prompt": prompt,
-                    "aspect_ratio": aspect_ratio,
-                    "steps": steps,
-                    "guidance": guidance,
-                    "interval": interval,
-                    "safety_tolerance": 2,
-                    "output_format": "png",
-                    "output_quality": 100
-                }
-            )
-            return output
-        except Exception as e:
-            return f"Error: Unable to generate image using SD Flux-1: {str(e)}"
-    elif st.session_state.customization['image_model'] == 'SDXL Lightning':
-        try:
-            client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-            output = client.run(
-                "bytedance/sdxl-lightning-4step:5f24084160c9089501c1b3545d9be3c27883ae2239b6f412990e82d4a6210f8f",
-                input={"prompt": prompt}
-            )
-            return output[0] if output else None
-        except Exception as e:
-            return f"Error: Unable to generate image using SDXL Lightning: {str(e)}"
-    else:
-        return "Error: Invalid image model selected."
+# Names this browser session in the fair-share scheduler
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:12]
 
-# Generate music using Replicate's MusicGen
-def generate_music(prompt):
-    try:
-        client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-        output = client.run(
-            "meta/musicgen:671ac645ce5e552cc63a54a2bbff63fcf798043055d2dac5fc9e36a837eedcfb",
-            input={
-                "prompt": prompt,
-                "model_version": "stereo-large",
-                "output_format": "mp3",
-                "normalization_strategy": "peak"
-            }
-        )
-        if isinstance(output, str) and output.startswith("http"):
-            return output
+if 'customization' not in st.session_state:
+    st.session_state.customization = pipeline.default_customization({
+        'pool_maxsize': http_pool.DEFAULT_POOL_MAXSIZE,
+        'cache_max_mb': response_cache.DEFAULT_MAX_BYTES // (1024 * 1024),
+        'cache_ttl_hours': 0,
+        'asset_memory_mb': asset_store.DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+    })
+
+# Poll a running job, showing its progress and streamed output
+@st.fragment(run_every=1.0)
+def show_job_progress(job_id):
+    job = jobs.get_runner().store.get(job_id)
+    if job is None or job['status'] not in jobs.ACTIVE_STATUSES:
+        st.rerun()
+    st.info(f"Job {job_id} is {job['status']}. You can refresh or leave this page; it keeps running.")
+    st.text(job['message'] or "Waiting for a worker...")
+    st.progress(job['progress'])
+    for (kind, name), text in jobs.get_runner().live_output(job_id).items():
+        st.caption(name.replace('_', ' ').title() if kind == 'element' else ', '.join(name) if isinstance(name, tuple) else name)
+        if kind == 'script':
+            st.code(text, language=name.split('.')[-1])
+        elif kind == 'scripts':
+            st.code(text)
         else:
-            return None
-    except Exception as e:
-        st.error(f"Error: Unable to generate music: {str(e)}")
-        return None
-
-# Generate multiple images based on customization settings
-def generate_images(customization, game_concept):
-    images = {}
-    
-    image_prompts = {
-        'Character': "Create a highly detailed, front-facing character concept art for a 2D game...",
-        'Enemy': "Design a menacing, front-facing enemy character concept art for a 2D game...",
-        'Background': "Create a wide, highly detailed background image for a level of the game...",
-        'Object': "Create a detailed object image for a 2D game...",
-        'Texture': "Generate a seamless texture pattern...",
-        'Sprite': "Create a game sprite sheet with multiple animation frames...",
-        'UI': "Design a cohesive set of user interface elements for a 2D game..."
-    }
-    
-    sizes = {
-        'Character': (1024, 1024),
-        'Enemy': (1024, 1024),
-        'Background': (1024, 1024),
-        'Object': (1024, 1024),
-        'Texture': (1024, 1024),
-        'Sprite': (1024, 1024),
-        'UI': (1024, 1024)
-    }
-
-    for img_type in customization['image_types']:
-        for i in range(customization['image_count'].get(img_type, 0)):
-            prompt = f"{image_prompts[img_type]} The design should fit the following game concept: {game_concept}. Variation {i + 1}"
-            size = sizes[img_type]
-            
-            image_url = generate_image(prompt, size)
-            
-            if image_url and not isinstance(image_url, str) and not image_url.startswith('Error'):
-                images[f"{img_type.lower()}_image_{i + 1}"] = image_url
-            else:
-                images[f"{img_type.lower()}_image_{i + 1}"] = image_url
-
-    return images
-
-# Generate scripts based on customization settings and code types
-def generate_scripts(customization, game_concept):
-    script_descriptions = {
-        'Player': "Create a comprehensive player character script for a 2D game. Include movement, input handling, and basic interactions.",
-        'Enemy': "Develop a detailed enemy AI script for a 2D game. Include patrolling, player detection, and attack behaviors.",
-        'Game Object': "Script a versatile game object that can be interacted with, collected, or activated by the player.",
-        'Level Background': "Create a script to manage the level background in a 2D game, including parallax scrolling if applicable."
-    }
-    
-    scripts = {}
-    selected_code_types = customization['code_types']
-    code_model = customization['code_model']
-
-    for script_type in customization['script_types']:
-        for i in range(customization['script_count'].get(script_type, 0)):
-            for code_type, selected in selected_code_types.items():
-                if selected:
-                    if code_type == 'unity':
-                        lang = 'csharp'
-                        file_ext = '.cs'
-                    elif code_type == 'unreal':
-                        lang = 'cpp'
-                        file_ext = '.cpp'
-                    elif code_type == 'blender':
-                        lang = 'python'
-                        file_ext = '.py'
-                    else:
-                        continue  # Skip if it's an unknown code type
-                    
-                    desc = f"{script_descriptions[script_type]} The script should be for {code_type.capitalize()}. Generate ONLY the code, without any explanations or comments outside the code. Ensure the code is complete and can be directly used in a project."
-
-                    if code_model in ['gpt-4o', 'gpt-4o-mini']:
-                        script_code = generate_content(desc, "game development")
-                    elif code_model == 'llama':
-                        try:
-                            client = replicate.Client(api_token=st.session_state.api_keys['replicate'])
-                            output = client.run(
-                                "meta/llama-2-70b-chat:02e509c789964a7ea8736978a43525956ef40397be9033abf9fd2badfe68c9e3",
-                                input={
-                                    "prompt": desc,
-                                    "temperature": 0.7,
-                                    "top_p": 0.95,
-                                    "max_length": 2048,
-                                    "repetition_penalty": 1.1
-                                }
-                            )
-                            script_code = ''.join(output)
-                        except Exception as e:
-                            script_code = f"Error: Unable to generate script using Llama: {str(e)}"
-                    else:
-                        script_code = "Error: Invalid code model selected."
-
-                    # Clean up the generated code
-                    script_code = script_code.strip()
-                    script_code = re.sub(r'^```\w*\n|```$', '', script_code, flags=re.MULTILINE)  # Remove code block markers
-                    script_code = re.sub(r'^.*?Here\'s.*?:\n', '', script_code, flags=re.DOTALL)  # Remove introductory text
-                    script_code = re.sub(r'\n+//.+?$', '', script_code, flags=re.MULTILINE)  # Remove trailing comments
-
-                    scripts[f"{script_type.lower()}_{code_type}_script_{i + 1}{file_ext}"] = script_code
-
-    return scripts
-
-# Generate a complete game plan
-def generate_game_plan(user_prompt, customization):
-    game_plan = {}
-    
-    # Status updates
-    status = st.empty()
-    progress_bar = st.progress(0)
-    
-    def update_status(message, progress):
-        status.text(message)
-        progress_bar.progress(progress)
-
-    # Generate game elements
-    elements_to_generate = customization['generate_elements']
-    for element, should_generate in elements_to_generate.items():
-        if should_generate:
-            update_status(f"Generating {element.replace('_', ' ')}...", 0.1)
-            game_plan[element] = generate_content(f"Create a detailed {element.replace('_', ' ')} for the following game concept: {user_prompt}", "game design")
-    
-    # Generate images
-    if any(customization['image_count'].values()):
-        update_status("Generating game images...", 0.5)
-        game_plan['images'] = generate_images(customization, game_plan.get('game_concept', ''))
-    
-    # Generate scripts
-    if any(customization['script_count'].values()):
-        update_status("Writing game scripts...", 0.7)
-        game_plan['scripts'] = generate_scripts(customization, game_plan.get('game_concept', ''))
-    
-    # Optional: Generate music
-    if customization['use_replicate']['generate_music']:
-        update_status("Composing background music...", 0.9)
-        music_prompt = f"Create background music for the game: {game_plan.get('game_concept', '')}"
-        game_plan['music'] = generate_music(music_prompt)
-
-    update_status("Game plan generation complete!", 1.0)
-
-    return game_plan
-
-# Function to display images
-def display_image(image_url, caption):
+            st.write(text)
+
+# Live queue depth of the provider scheduler shared by every session
+@st.fragment(run_every=1.0)
+def show_provider_queues():
+    stats = fair_share.get_scheduler().stats()
+    for provider, queue in stats['providers'].items():
+        queued = ', '.join(f"{count} {kind}" for kind, count in sorted(queue['queued'].items())) or "none"
+        tokens = f", {queue['tokens_available']:,} of {queue['tokens_per_minute']:,} tokens/min left" if queue['tokens_per_minute'] else ""
+        st.caption(f"{provider.capitalize()}: {queue['active']}/{queue['limit'] or 'unlimited'} running, queued: {queued}{tokens}")
+    waiting = sum(1 for session in stats['sessions'].values() if session['queued'])
+    st.caption(f"Sessions: {len(stats['sessions'])} active, {waiting} waiting")
+    session = stats['sessions'].get(st.session_state.session_id)
+    if session:
+        st.caption(f"This session: {session['active']} running, {session['queued']} queued, {session['served']} served, wait p50 {session['wait_p50']:.2f}s, p95 {session['wait_p95']:.2f}s")
+
+# Image previews shown side by side in the results
+THUMBNAILS_PER_ROW = 4
+
+# Full-resolution view of one image, fetched only when it is opened
+@st.dialog("Image", width="large")
+def show_full_image(image_url, caption):
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()  # Raise an exception for bad responses
-        image = Image.open(BytesIO(response.content))
-        st.image(image, caption=caption, use_column_width=True)
+        st.image(asset_store.get_store().fetch(image_url), caption=caption, width='stretch')
     except requests.RequestException as e:
         st.warning(f"Unable to load image: {caption}")
         st.error(f"Error: {str(e)}")
-    except Exception as e:
-        st.warning(f"Unable to display image: {caption}")
-        st.error(f"Error: {str(e)}")
+
+# Function to display images: a grid of cached thumbnails, each of which
+# opens the full-resolution image
+def display_images(job_id, images):
+    urls = [url for url in images.values() if isinstance(url, str) and not url.startswith('Error')]
+    previews = thumbnails.get_cache().for_urls(asset_store.get_store(), urls)
+    items = list(images.items())
+    for row in range(0, len(items), THUMBNAILS_PER_ROW):
+        for column, (img_name, img_url) in zip(st.columns(THUMBNAILS_PER_ROW), items[row:row + THUMBNAILS_PER_ROW]):
+            with column:
+                preview = previews.get(img_url)
+                if preview is None:
+                    st.write(f"{img_name}: {img_url}")
+                elif isinstance(preview, Exception):
+                    st.warning(f"Unable to display image: {img_name}")
+                    st.error(f"Error: {str(preview)}")
+                else:
+                    st.image(preview, caption=img_name, width='stretch')
+                    if st.button("Open", key=f"open_{job_id}_{img_name}"):
+                        show_full_image(img_url, img_name)
+
+# Build the download package for a finished job once, on first download
+@st.cache_data(max_entries=4, show_spinner=False)
+def plan_package(job_id):
+    job = jobs.get_runner().store.get(job_id)
+    zip_package, _ = exporter.build_package(job['plan'], asset_store.get_store(), job['customization'])
+    with zip_package:
+        return zip_package.read()
+
+# Build the download package for a saved project from its stored blobs
+@st.cache_data(max_entries=4, show_spinner=False)
+def project_package(project_id):
+    zip_package, _ = projects.get_store().build_package(project_id, asset_store.get_store())
+    with zip_package:
+        return zip_package.read()
+
+# Load a saved project and its plan once per session; its assets are
+# served from the blob directory, so nothing is downloaded or regenerated
+def session_project(project_id):
+    loaded = st.session_state.setdefault('loaded_projects', {})
+    if project_id not in loaded:
+        project = projects.get_store().get(project_id)
+        if project is None:
+            return None, None
+        loaded[project_id] = (project, projects.get_store().load(project_id, asset_store.get_store()))
+    return loaded[project_id]
+
+# Get a job, keeping finished jobs in the session so reruns skip the database
+def session_job(job_id):
+    finished = st.session_state.setdefault('finished_jobs', {})
+    if job_id in finished:
+        return finished[job_id]
+    job = jobs.get_runner().store.get(job_id)
+    if job is not None and job['status'] not in jobs.ACTIVE_STATUSES:
+        finished[job_id] = job
+    return job
+
+# Display a finished game plan and its download package, built by
+# package() if given. Images, scripts and music only render while their
+# section is open.
+def display_game_plan(job_id, game_plan, package=None):
+    # Display game plan results
+    st.markdown('<p class="section-header">Generated Game Plan</p>', unsafe_allow_html=True)
+
+    if 'game_concept' in game_plan:
+        st.subheader("Game Concept")
+        st.write(game_plan['game_concept'])
+
+    if 'world_concept' in game_plan:
+        st.subheader("World Concept")
+        st.write(game_plan['world_concept'])
+
+    if 'character_concepts' in game_plan:
+        st.subheader("Character Concepts")
+        st.write(game_plan['character_concepts'])
+
+    if 'plot' in game_plan:
+        st.subheader("Plot")
+        st.write(game_plan['plot'])
+
+    if game_plan.get('design_brief'):
+        with st.expander("Design Brief"):
+            for name, value in game_plan['design_brief'].items():
+                if name != 'concept_tokens':
+                    st.markdown(f"**{name.replace('_', ' ').capitalize()}:** {value}")
+            savings = game_plan.get('prompt_savings')
+            if savings:
+                st.caption(
+                    f"~{savings['tokens_saved']} prompt tokens saved across {savings['prompts']} asset prompts "
+                    f"({savings['context_tokens']} sent instead of {savings['concept_tokens']})"
+                )
+
+    if 'images' in game_plan:
+        st.subheader("Generated Assets")
+        with st.expander(f"Images ({len(game_plan['images'])})", key=f"images_{job_id}", on_change="rerun") as images_section:
+            if images_section.open:
+                display_images(job_id, game_plan['images'])
+
+    if 'scripts' in game_plan:
+        st.write("### Scripts")
+        for script_name, script_code in game_plan['scripts'].items():
+            with st.expander(f"View {script_name}", key=f"script_{job_id}_{script_name}", on_change="rerun") as script_section:
+                if script_section.open:
+                    st.code(script_code, language=script_name.split('.')[-1])
+        checks = game_plan.get('script_checks')
+        if checks and checks['failed']:
+            st.caption(
+                f"{checks['failed']} of {checks['checked']} scripts failed validation; "
+                f"{checks['regenerated']} regenerated, {checks['invalid']} still invalid"
+            )
+
+    if 'additional_elements' in game_plan:
+        st.subheader("Additional Game Elements")
+        for element_name, element_content in game_plan['additional_elements'].items():
+            with st.expander(f"View {element_name.capitalize()}"):
+                st.write(element_content)
+
+    # The archive is built on the first click and cached after that
+    st.download_button(
+        "Download Game Plan ZIP",
+        package or (lambda: plan_package(job_id)),
+        file_name="game_plan.zip",
+        mime="application/zip",
+        help="Download a ZIP file containing all generated assets and documents."
+    )
+
+    # Display generated music if applicable
+    if 'music' in game_plan and game_plan['music']:
+        with st.expander("Generated Music", key=f"music_{job_id}", on_change="rerun") as music_section:
+            if music_section.open:
+                try:
+                    st.audio(asset_store.get_store().fetch(game_plan['music']), format='audio/mp3')
+                except requests.RequestException:
+                    st.audio(game_plan['music'], format='audio/mp3')
+    else:
+        st.warning("No music was generated or an error occurred during music generation.")
 
 # Streamlit app layout
 st.markdown('<p class="main-header">Game Dev Automation</p>', unsafe_allow_html=True)
@@ -359,7 +226,7 @@ with st.sidebar:
         openai_key = st.text_input("OpenAI API Key", value=st.session_state.api_keys['openai'], type="password")
         replicate_key = st.text_input("Replicate API Key", value=st.session_state.api_keys['replicate'], type="password")
         if st.button("Save API Keys"):
-            save_api_keys(openai_key, replicate_key)
+            pipeline.save_api_keys(openai_key, replicate_key)
             st.session_state.api_keys['openai'] = openai_key
             st.session_state.api_keys['replicate'] = replicate_key
             st.success("API Keys saved successfully!")
@@ -367,21 +234,201 @@ with st.sidebar:
     
     # Model Selection
     st.markdown("### AI Model Selection")
-    st.session_state.customization['chat_model'] = st.selectbox(
-        "Select Chat Model",
-        options=['gpt-4o-mini', 'llama'],
-        index=1  # Set default to gpt-4o-mini
-    )
-    st.session_state.customization['image_model'] = st.selectbox(
-        "Select Image Generation Model",
-        options=['dall-e-3', 'SD Flux-1', 'SDXL Lightning'],
-        index=0
-    )
-    st.session_state.customization['code_model'] = st.selectbox(
-        "Select Code Generation Model",
-        options=['gpt-4o-mini', 'llama'],
-        index=1  # Set default to gpt-4o-mini
-    )
+    for kind, label in [('chat', "Select Chat Model"), ('image', "Select Image Generation Model"), ('code', "Select Code Generation Model")]:
+        options = providers.names(kind)
+        current = st.session_state.customization[f'{kind}_model']
+        st.session_state.customization[f'{kind}_model'] = st.selectbox(
+            label,
+            options=options,
+            index=options.index(current) if current in options else 0
+        )
+
+    # Concurrency settings
+    with st.expander("Performance"):
+        st.session_state.customization['stream_output'] = st.checkbox(
+            "Stream Text and Code As It Generates",
+            value=st.session_state.customization['stream_output']
+        )
+        st.session_state.customization['design_brief'] = st.checkbox(
+            "Condense the Concept Into a Design Brief",
+            value=st.session_state.customization['design_brief'],
+            help="Send asset prompts a short brief (style, palette, setting, characters, mechanics) instead of the full concept."
+        )
+        st.session_state.customization['prompt_budget'] = st.number_input(
+            "Brief Characters Per Prompt",
+            min_value=100,
+            max_value=4000,
+            value=st.session_state.customization['prompt_budget']
+        )
+        st.session_state.customization['reuse_results'] = st.checkbox(
+            "Only Regenerate What Changed",
+            value=st.session_state.customization['reuse_results'],
+            help="Reuse unchanged elements, images, scripts and music from the plan on screen."
+        )
+        st.session_state.customization['prediction_manager'] = st.checkbox(
+            "Track Replicate Predictions From One Poller",
+            value=st.session_state.customization['prediction_manager'],
+            help="Create Replicate predictions and poll all of them from a single background loop instead of each request polling on its own."
+        )
+        st.session_state.customization['max_workers'] = st.number_input(
+            "Max Parallel Requests",
+            min_value=1,
+            max_value=64,
+            value=st.session_state.customization['max_workers']
+        )
+        for provider in ['openai', 'replicate']:
+            st.session_state.customization['provider_limits'][provider] = st.number_input(
+                f"Max Concurrent {provider.capitalize()} Requests",
+                min_value=1,
+                max_value=64,
+                value=st.session_state.customization['provider_limits'][provider]
+            )
+        st.session_state.customization['pool_maxsize'] = st.number_input(
+            "Connections Per Host",
+            min_value=1,
+            max_value=128,
+            value=st.session_state.customization['pool_maxsize']
+        )
+        http_pool.configure(pool_maxsize=st.session_state.customization['pool_maxsize'])
+        for provider, totals in retry.get_stats().summary().items():
+            success_rate = totals['succeeded'] / totals['calls'] if totals['calls'] else 0.0
+            st.caption(f"{provider.capitalize()}: {totals['calls']} calls, {success_rate:.0%} succeeded, {totals['retries']} retries, {totals['throttled']} rate limited, {totals['waited']:.1f}s waiting")
+        pool_stats = http_pool.stats()
+        st.caption(f"Connections: {pool_stats['connections_opened']} opened, {pool_stats['connections_reused']} reused")
+        prediction_stats = predictions.get_manager().stats()
+        if prediction_stats['submitted']:
+            st.caption(f"Predictions: {prediction_stats['active']} running, {prediction_stats['queued']} queued, {prediction_stats['succeeded']} succeeded, {prediction_stats['failed']} failed, {prediction_stats['timed_out']} timed out, {prediction_stats['polls']} polls, {prediction_stats['webhooks']} webhooks")
+
+    # Provider calls from every session wait in one fair-share queue
+    with st.expander("Shared Queue"):
+        show_provider_queues()
+
+    # Response cache settings
+    with st.expander("Response Cache"):
+        st.session_state.customization['use_cache'] = st.checkbox(
+            "Reuse Cached Responses",
+            value=st.session_state.customization['use_cache']
+        )
+        st.session_state.customization['cache_max_mb'] = st.number_input(
+            "Cache Size Limit (MB)",
+            min_value=1,
+            value=st.session_state.customization['cache_max_mb']
+        )
+        st.session_state.customization['cache_ttl_hours'] = st.number_input(
+            "Expire Entries After (hours, 0 = never)",
+            min_value=0,
+            value=st.session_state.customization['cache_ttl_hours']
+        )
+        cache = response_cache.get_cache()
+        cache.configure(
+            max_bytes=st.session_state.customization['cache_max_mb'] * 1024 * 1024,
+            ttl=st.session_state.customization['cache_ttl_hours'] * 3600 or None
+        )
+        cache_stats = cache.stats()
+        st.caption(f"{cache_stats['entries']} entries, {cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+        if st.button("Clear Cache"):
+            cache.clear()
+            st.success("Response cache cleared!")
+
+    # Downloaded asset storage
+    with st.expander("Asset Storage"):
+        st.session_state.customization['asset_memory_mb'] = st.number_input(
+            "In-Memory Asset Budget (MB)",
+            min_value=0,
+            value=st.session_state.customization['asset_memory_mb']
+        )
+        st.session_state.customization['prefetch_assets'] = st.checkbox(
+            "Download Assets As Soon As They Are Generated",
+            value=st.session_state.customization['prefetch_assets']
+        )
+        store = asset_store.get_store()
+        store.configure(memory_budget=st.session_state.customization['asset_memory_mb'] * 1024 * 1024)
+        store_stats = store.stats()
+        st.caption(f"{store_stats['memory_items']} assets in memory, {store_stats['disk_items']} on disk, {store_stats['downloads']} downloads, {store_stats['hits']} reuses")
+        thumbnail_stats = thumbnails.get_cache().stats()
+        st.caption(f"{thumbnail_stats['entries']} thumbnails ({thumbnail_stats['bytes'] / 1024:.0f} KB), {thumbnail_stats['hits']} reused, {thumbnail_stats['misses']} made")
+
+    # Per-call timing
+    with st.expander("Tracing"):
+        tracing.enable(st.checkbox(
+            "Record Trace",
+            value=tracing.enabled(),
+            help="Time every provider call, download, image conversion and export step."
+        ))
+        tracer = tracing.get_tracer()
+        trace_summary = tracer.summary()
+        if trace_summary:
+            st.dataframe(trace_summary, hide_index=True)
+            st.download_button(
+                "Download Chrome Trace",
+                tracer.chrome_trace_json,
+                file_name="game_maker_trace.json",
+                mime="application/json",
+                help="Open in chrome://tracing or ui.perfetto.dev."
+            )
+            if st.button("Clear Trace"):
+                tracer.clear()
+                st.rerun()
+        else:
+            st.caption("No spans recorded yet.")
+
+    # Background generation jobs
+    with st.expander("Jobs"):
+        for recent_job in jobs.get_runner().store.recent():
+            label = f"{recent_job['status']} · {recent_job['prompt'][:40]}"
+            if st.button(label, key=f"job_{recent_job['id']}", help=f"Open job {recent_job['id']}"):
+                st.session_state.job_id = recent_job['id']
+                st.session_state.pop('project_id', None)
+                st.query_params.pop('project', None)
+                st.query_params['job'] = recent_job['id']
+
+    # Saved projects
+    with st.expander("Projects"):
+        st.session_state.customization['save_projects'] = st.checkbox(
+            "Save Finished Plans as Projects",
+            value=st.session_state.customization['save_projects'],
+            help="Keep each plan with its images, music and scripts on disk so it reopens without any API calls."
+        )
+        project_store = projects.get_store()
+        project_stats = project_store.stats()
+        st.caption(
+            f"{project_stats['projects']} projects, {project_stats['blobs']} stored files "
+            f"({project_stats['bytes'] / (1024 * 1024):.1f} MB, {project_stats['bytes_saved'] / (1024 * 1024):.1f} MB saved by deduplication)"
+        )
+        recent_projects = project_store.recent()
+        for project in recent_projects:
+            label = f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(project['created']))} · {project['name'][:40]}"
+            details = f"{project['nodes']} items, {project['bytes'] / 1024:.0f} KB · {project['chat_model']}, {project['image_model']}, {project['code_model']}"
+            open_column, delete_column = st.columns([5, 1])
+            if open_column.button(label, key=f"project_{project['id']}", help=details):
+                st.session_state.project_id = project['id']
+                st.session_state.pop('job_id', None)
+                st.query_params.pop('job', None)
+                st.query_params['project'] = project['id']
+            if delete_column.button("🗑", key=f"delete_project_{project['id']}", help="Delete this project and any files no other project uses"):
+                project_store.delete(project['id'])
+                st.session_state.get('loaded_projects', {}).pop(project['id'], None)
+                project_package.clear()
+                if st.session_state.get('project_id') == project['id']:
+                    st.session_state.pop('project_id', None)
+                    st.query_params.pop('project', None)
+                st.rerun()
+
+        # What changed between two saved projects
+        if len(recent_projects) >= 2:
+            st.markdown("**Compare Projects**")
+            project_names = {project['id']: project['name'][:40] for project in recent_projects}
+            old_id = st.selectbox("From Project", list(project_names), index=1, format_func=project_names.get)
+            new_id = st.selectbox("To Project", list(project_names), index=0, format_func=project_names.get)
+            changes = project_store.diff(old_id, new_id)
+            differences = [(node, status, kind) for node, status, kind in changes if status != 'same']
+            st.caption(f"{len(differences)} changed, {len(changes) - len(differences)} unchanged")
+            for node, status, kind in differences:
+                st.text(f"{status}: {node}")
+            text_changes = [node for node, status, kind in differences if status == 'changed' and kind == 'text']
+            if text_changes:
+                diff_node = st.selectbox("Show Changes In", text_changes)
+                st.code(project_store.diff_text(old_id, new_id, diff_node) or "No line changes", language='diff')
 
 # Main content area
 tab1, tab2, tab3, tab4 = st.tabs(["Game Concept", "Image Generation", "Script Generation", "Additional Elements"])
@@ -402,6 +449,39 @@ with tab2:
             value=st.session_state.customization['image_count'][img_type]
         )
 
+    with st.expander("Export Formats"):
+        st.session_state.customization['optimize_images'] = st.checkbox(
+            "Optimize Images When Exporting",
+            value=st.session_state.customization['optimize_images'],
+            help="Re-encode images in parallel with the settings below; the ZIP includes a report of the bytes saved."
+        )
+        for img_type in st.session_state.customization['image_types']:
+            settings = image_optimizer.settings_for(img_type, st.session_state.customization['image_formats'])
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                image_format = st.selectbox(f"{img_type} Format", image_optimizer.FORMATS, index=image_optimizer.FORMATS.index(settings['format']))
+            with col2:
+                quality = st.number_input(f"{img_type} Quality", min_value=1, max_value=100, value=settings['quality'])
+            with col3:
+                colors = st.number_input(f"{img_type} Palette Colors (0 = full color)", min_value=0, max_value=256, value=settings['colors'])
+            with col4:
+                mipmaps = st.checkbox(f"{img_type} Mipmaps", value=settings['mipmaps'])
+            st.session_state.customization['image_formats'][img_type] = {
+                'format': image_format, 'quality': quality, 'colors': colors, 'mipmaps': mipmaps
+            }
+
+    st.session_state.customization['atlas_types'] = st.multiselect(
+        "Pack Into Texture Atlases",
+        st.session_state.customization['image_types'],
+        default=st.session_state.customization['atlas_types'],
+        help="Trim these images and pack them into power-of-two atlases with Unity and TexturePacker frame data in the ZIP."
+    )
+    st.session_state.customization['atlas_max_size'] = st.selectbox(
+        "Largest Atlas Size",
+        [512, 1024, 2048, 4096, 8192],
+        index=[512, 1024, 2048, 4096, 8192].index(st.session_state.customization['atlas_max_size'])
+    )
+
 with tab3:
     st.markdown('<p class="section-header">Script Generation</p>', unsafe_allow_html=True)
     st.markdown('<p class="info-text">Specify the types and number of scripts you need for your game.</p>', unsafe_allow_html=True)
@@ -422,6 +502,25 @@ with tab3:
     with col3:
         st.session_state.customization['code_types']['blender'] = st.checkbox("Blender Python Scripts", value=st.session_state.customization['code_types']['blender'], key="blender")
 
+    st.session_state.customization['combine_engines'] = st.checkbox(
+        "Request All Selected Engines Together",
+        value=st.session_state.customization['combine_engines'],
+        help="Ask for every selected engine in one request per script instead of one request per engine."
+    )
+    st.session_state.customization['validate_scripts'] = st.checkbox(
+        "Check Scripts and Regenerate Broken Ones",
+        value=st.session_state.customization['validate_scripts'],
+        help="Compile Blender Python and check C# and C++ for balanced brackets and complete tokens. Only scripts that fail are requested again."
+    )
+    if st.session_state.customization['validate_scripts']:
+        st.session_state.customization['script_retry_budget'] = st.number_input(
+            "Script Regenerations per Plan",
+            min_value=0,
+            max_value=50,
+            value=st.session_state.customization['script_retry_budget'],
+            help=f"Each broken script is regenerated at most {pipeline.MAX_SCRIPT_RETRIES} times."
+        )
+
 with tab4:
     st.markdown('<p class="section-header">Additional Game Elements</p>', unsafe_allow_html=True)
     st.markdown('<p class="info-text">Select additional elements to enhance your game design.</p>', unsafe_allow_html=True)
@@ -441,102 +540,49 @@ if st.button("Generate Game Plan", key="generate_button"):
     if not st.session_state.api_keys['openai'] or not st.session_state.api_keys['replicate']:
         st.error("Please enter and save both OpenAI and Replicate API keys.")
     else:
-        with st.spinner('Generating game plan...'):
-            game_plan = generate_game_plan(user_prompt, st.session_state.customization)
-        st.success('Game plan generated successfully!')
-
-        # Display game plan results
-        st.markdown('<p class="section-header">Generated Game Plan</p>', unsafe_allow_html=True)
-
-        if 'game_concept' in game_plan:
-            st.subheader("Game Concept")
-            st.write(game_plan['game_concept'])
-
-        if 'world_concept' in game_plan:
-            st.subheader("World Concept")
-            st.write(game_plan['world_concept'])
-
-        if 'character_concepts' in game_plan:
-            st.subheader("Character Concepts")
-            st.write(game_plan['character_concepts'])
-
-        if 'plot' in game_plan:
-            st.subheader("Plot")
-            st.write(game_plan['plot'])
-
-        if 'images' in game_plan:
-            st.subheader("Generated Assets")
-            st.write("### Images")
-            for img_name, img_url in game_plan['images'].items():
-                if isinstance(img_url, str) and not img_url.startswith('Error'):
-                    display_image(img_url, img_name)
-                else:
-                    st.write(f"{img_name}: {img_url}")
-
-        if 'scripts' in game_plan:
-            st.write("### Scripts")
-            for script_name, script_code in game_plan['scripts'].items():
-                with st.expander(f"View {script_name}"):
-                    st.code(script_code, language=script_name.split('.')[-1])
-
-        if 'additional_elements' in game_plan:
-            st.subheader("Additional Game Elements")
-            for element_name, element_content in game_plan['additional_elements'].items():
-                with st.expander(f"View {element_name.capitalize()}"):
-                    st.write(element_content)
-
-        # Save results
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w') as zip_file:
-            # Add text documents
-            for key in ['game_concept', 'world_concept', 'character_concepts', 'plot']:
-                if key in game_plan:
-                    zip_file.writestr(f"{key}.txt", game_plan[key])
-            
-            # Add images
-            if 'images' in game_plan:
-                for asset_name, asset_url in game_plan['images'].items():
-                    if isinstance(asset_url, str) and asset_url.startswith('http'):
-                        img_response = requests.get(asset_url)
-                        img = Image.open(BytesIO(img_response.content))
-                        img_file_name = f"{asset_name}.png"
-                        with BytesIO() as img_buffer:
-                            img.save(img_buffer, format='PNG')
-                            zip_file.writestr(img_file_name, img_buffer.getvalue())
-            
-            # Add scripts
-            if 'scripts' in game_plan:
-                for script_name, script_code in game_plan['scripts'].items():
-                    zip_file.writestr(script_name, script_code)
-            
-            # Add additional elements
-            if 'additional_elements' in game_plan:
-                for element_name, element_content in game_plan['additional_elements'].items():
-                    zip_file.writestr(f"{element_name}.txt", element_content)
-            
-            # Add music if generated
-            if 'music' in game_plan and game_plan['music']:
-                try:
-                    music_response = requests.get(game_plan['music'])
-                    music_response.raise_for_status()
-                    zip_file.writestr("background_music.mp3", music_response.content)
-                except requests.RequestException as e:
-                    st.error(f"Error downloading music: {str(e)}")
-
-        st.download_button(
-            "Download Game Plan ZIP",
-            zip_buffer.getvalue(),
-            file_name="game_plan.zip",
-            mime="application/zip",
-            help="Download a ZIP file containing all generated assets and documents."
+        # Unchanged parts of the plan or project on screen are reused
+        previous_job = session_job(st.session_state.job_id) if st.session_state.get('job_id') else None
+        previous = previous_job['plan'] if previous_job and previous_job['status'] == 'done' else None
+        if st.session_state.get('project_id'):
+            previous = session_project(st.session_state.project_id)[1]
+        job_id = jobs.get_runner().submit(
+            st.session_state.api_keys, st.session_state.customization, user_prompt, previous, session=st.session_state.session_id
         )
-
-        # Display generated music if applicable
-        if 'music' in game_plan and game_plan['music']:
-            st.subheader("Generated Music")
-            st.audio(game_plan['music'], format='audio/mp3')
-        else:
-            st.warning("No music was generated or an error occurred during music generation.")
+        st.session_state.job_id = job_id
+        st.session_state.pop('project_id', None)
+        st.query_params.pop('project', None)
+        st.query_params['job'] = job_id
+
+# Reattach to a job after a refresh or from a shared link
+if 'job_id' not in st.session_state and 'job' in st.query_params:
+    st.session_state.job_id = st.query_params['job']
+if 'project_id' not in st.session_state and 'project' in st.query_params:
+    st.session_state.project_id = st.query_params['project']
+
+# Show a saved project, or the current job's progress or results
+if st.session_state.get('project_id'):
+    project, game_plan = session_project(st.session_state.project_id)
+    if project is None:
+        st.error(f"Project {st.session_state.project_id} was not found.")
+    else:
+        st.info(f"Saved project from {time.strftime('%Y-%m-%d %H:%M', time.localtime(project['created']))}: {project['name']}")
+        display_game_plan(project['id'], game_plan, lambda: project_package(project['id']))
+elif st.session_state.get('job_id'):
+    job = session_job(st.session_state.job_id)
+    if job is None:
+        st.error(f"Job {st.session_state.job_id} was not found.")
+    elif job['status'] in jobs.ACTIVE_STATUSES:
+        show_job_progress(job['id'])
+    elif job['status'] == 'done':
+        st.success('Game plan generated successfully!')
+        for warning in job['warnings']:
+            st.warning(warning)
+        display_game_plan(job['id'], job['plan'])
+    else:
+        st.error(f"Job {job['id']} {job['status']}: {job['error'] or job['message']}")
+        partial = jobs.get_runner().store.results(job['id'])
+        if partial:
+            st.info(f"{len(partial)} results were saved before the job stopped.")
 
 # Footer
 st.markdown("---")
@@ -547,14 +593,10 @@ st.markdown("""
     [Instagram](https://instagram.com/rhythrosalabs)
     """, unsafe_allow_html=True)
 
-# Initialize Replicate client
-if st.session_state.api_keys['replicate']:
-    replicate.Client(api_token=st.session_state.api_keys['replicate'])
-
 # Main execution
 if __name__ == "__main__":
     # Load API keys
-    openai_key, replicate_key = load_api_keys()
+    openai_key, replicate_key = pipeline.load_api_keys()
     if openai_key and replicate_key:
         st.session_state.api_keys['openai'] = openai_key
         st.session_state.api_keys['replicate'] = replicate_key
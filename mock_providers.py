@@ -0,0 +1,489 @@
+import copy
+import json
+import random
+import re
+import struct
+import threading
+import time
+import urllib.request
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default behaviour of the mock providers. Latencies are in seconds and are
+# multiplied by 'scale'; error_rate and throttle_rate are the chances that
+# a call fails with a 500 or a 429 (with Retry-After); broken_code_rate is
+# the chance that a script comes back truncated and fails validation.
+DEFAULT_PROFILE = {
+    'scale': 1.0,
+    'seed': 0,
+    'retry_after': 1.0,
+    'image_bytes': 1500000,
+    'music_bytes': 2000000,
+    'endpoints': {
+        'chat': {
+            'latency': {'distribution': 'lognormal', 'median': 2.0, 'sigma': 0.5},
+            'error_rate': 0.0,
+            'throttle_rate': 0.0,
+            'broken_code_rate': 0.0,
+            'payload_bytes': 4000,
+        },
+        'images': {
+            'latency': {'distribution': 'lognormal', 'median': 8.0, 'sigma': 0.3},
+            'error_rate': 0.0,
+            'throttle_rate': 0.0,
+        },
+        'predictions': {
+            'latency': {'distribution': 'lognormal', 'median': 6.0, 'sigma': 0.4},
+            'error_rate': 0.0,
+            'throttle_rate': 0.0,
+            'broken_code_rate': 0.0,
+            'payload_bytes': 2000,
+        },
+        'files': {
+            'latency': {'distribution': 'fixed', 'seconds': 0.05},
+            'error_rate': 0.0,
+            'throttle_rate': 0.0,
+        },
+    },
+}
+
+STREAM_CHUNKS = 20
+MP3_FRAME = b'\xff\xfb\x90\x64' + bytes(413)
+
+
+# Return a copy of the default profile with overrides merged in
+def make_profile(overrides=None):
+    profile = copy.deepcopy(DEFAULT_PROFILE)
+    for key, value in (overrides or {}).items():
+        if key == 'endpoints':
+            for endpoint, settings in value.items():
+                profile['endpoints'].setdefault(endpoint, {}).update(copy.deepcopy(settings))
+        else:
+            profile[key] = copy.deepcopy(value)
+    return profile
+
+
+# Sample a latency in seconds from a distribution spec:
+# {'distribution': 'fixed', 'seconds'}, {'distribution': 'uniform', 'low', 'high'},
+# {'distribution': 'lognormal', 'median', 'sigma'} or {'distribution': 'exponential', 'mean'}
+def sample_latency(spec, rng):
+    distribution = spec.get('distribution', 'fixed')
+    if distribution == 'fixed':
+        return spec.get('seconds', 0.0)
+    if distribution == 'uniform':
+        return rng.uniform(spec.get('low', 0.0), spec.get('high', 0.0))
+    if distribution == 'lognormal':
+        return rng.lognormvariate(0.0, spec.get('sigma', 0.5)) * spec.get('median', 1.0)
+    if distribution == 'exponential':
+        return rng.expovariate(1.0 / max(spec.get('mean', 1.0), 1e-9))
+    raise ValueError(f"Unknown latency distribution: {distribution}")
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+# Build a noise PNG of roughly size bytes. Returns a function that adds a
+# text chunk to make each served file's bytes unique.
+def synthetic_png(size, seed=0):
+    side = max(1, int((max(size, 3) / 3) ** 0.5))
+    rng = random.Random(seed)
+    rows = b''.join(b'\x00' + rng.randbytes(side * 3) for _ in range(side))
+    header = b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+    body = _png_chunk(b'IDAT', zlib.compress(rows, 1)) + _png_chunk(b'IEND', b'')
+    return lambda name: header + _png_chunk(b'tEXt', b'Title\x00' + name.encode()) + body
+
+
+# Build an MP3 of silent 128 kbps frames, roughly size bytes long
+def synthetic_mp3(size):
+    return MP3_FRAME * max(1, size // len(MP3_FRAME))
+
+
+# Filler text of roughly size bytes for chat responses
+def _filler(prompt, size):
+    words = (re.findall(r'\w+', prompt) or ['game']) * (size // 5 + 1)
+    return ' '.join(words)[:size]
+
+
+ENGINE_LANGUAGES = {'unity': 'csharp', 'unreal': 'cpp', 'blender': 'python'}
+
+
+# Source in language that passes script validation, carrying filler text
+# in a string. A broken script is cut off before its end.
+def _code(language, text, broken=False):
+    if language == 'python':
+        code = f"# generated\nimport bpy\n\nTEXT = {json.dumps(text)}\n"
+        return code.replace('import bpy', 'def generated(:') if broken else code
+    field = 'public string Text' if language == 'csharp' else 'const char* text'
+    code = f"// generated\nclass Generated\n{{\n    {field} = {json.dumps(text)};\n}}{';' if language == 'cpp' else ''}\n"
+    return code.rsplit('}', 1)[0] if broken else code
+
+
+# Chat response text: a JSON object for design brief prompts, fenced code
+# for script prompts, one '### engine' block per engine for combined
+# prompts, prose for everything else
+def chat_content(prompt, size, broken=False):
+    fields = re.findall(r'(\w+) \(at most (\d+) characters\)', prompt)
+    if fields:
+        return json.dumps({name: _filler(prompt, int(limit)) for name, limit in fields})
+    match = re.search(r'once for each of these engines: (.+?)\. ', prompt)
+    if match:
+        engines = re.findall(r'(\w+) \((\w+)\)', match.group(1))
+        per_engine = max(1, size // max(1, len(engines)))
+        return '\n\n'.join(
+            f"### {engine}\n```{language}\n{_code(language, _filler(prompt, per_engine), broken)}```" for engine, language in engines
+        )
+    if re.search(r'\bscript\b', prompt, re.IGNORECASE):
+        engine = re.search(r'should be for (\w+)\.', prompt)
+        language = ENGINE_LANGUAGES.get(engine.group(1).lower() if engine else '', 'csharp')
+        return f"Here's the script:\n```{language}\n{_code(language, _filler(prompt, size), broken)}```"
+    return _filler(prompt, size)
+
+
+# Serves both providers' endpoints; each server only answers for its provider
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        mock = self.server.mock
+        started = time.time()
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        body = json.loads(raw) if raw else {}
+        path = self.path.split('?')[0]
+        endpoint, handler = mock.route(method, path)
+        if handler is None:
+            self._send_json(404, {'error': {'message': f"No mock for {method} {path}"}})
+            mock.record('unknown', 404, started, len(raw), 0)
+            return
+        settings = mock.profile['endpoints'].get(endpoint, {})
+        failure = mock.inject_failure(settings)
+        if failure == 429:
+            sent = self._send_json(429, {'error': {'message': 'Rate limit exceeded'}}, {'Retry-After': str(mock.profile['retry_after'])})
+            mock.record(endpoint, 429, started, len(raw), sent)
+            return
+        if failure == 500:
+            sent = self._send_json(500, {'error': {'message': 'Internal server error'}})
+            mock.record(endpoint, 500, started, len(raw), sent)
+            return
+        status, sent = getattr(self, handler)(path, body, settings)
+        mock.record(endpoint, status, started, len(raw), sent)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        return len(data)
+
+    def _send_json(self, status, payload, headers=None):
+        return self._send(status, json.dumps(payload).encode(), 'application/json', headers)
+
+    # Send server-sent events without a length, closing the connection after
+    def _send_events(self, events, delay):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        sent = 0
+        for event in events:
+            data = event.encode()
+            self.wfile.write(data)
+            self.wfile.flush()
+            sent += len(data)
+            time.sleep(delay)
+        return sent
+
+    # Handlers return (status, bytes sent)
+    def _serve_file(self, path, body, settings):
+        mock = self.server.mock
+        time.sleep(mock.latency(settings))
+        if path.endswith('.mp3'):
+            return 200, self._send(200, mock._mp3, 'audio/mpeg')
+        return 200, self._send(200, mock._png(path.rsplit('/', 1)[-1]), 'image/png')
+
+    def _chat(self, path, body, settings):
+        mock = self.server.mock
+        delay = mock.latency(settings)
+        prompt = body.get('messages', [{}])[-1].get('content', '')
+        content = chat_content(prompt, settings.get('payload_bytes', 4000), mock.chance(settings.get('broken_code_rate', 0.0)))
+        usage = {
+            'prompt_tokens': sum(len(m.get('content', '')) for m in body.get('messages', [])) // 4,
+            'completion_tokens': len(content) // 4,
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        if not body.get('stream'):
+            time.sleep(delay)
+            return 200, self._send_json(200, {
+                'id': f"chatcmpl-{uuid.uuid4().hex[:12]}", 'object': 'chat.completion', 'model': body.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+        # Spread the latency over the streamed chunks
+        step = max(1, len(content) // STREAM_CHUNKS)
+        chunks = [content[i:i + step] for i in range(0, len(content), step)]
+        events = [
+            'data: ' + json.dumps({'choices': [{'index': 0, 'delta': {'content': chunk}}]}) + '\n\n' for chunk in chunks
+        ]
+        events.append('data: ' + json.dumps({'choices': [], 'usage': usage}) + '\n\n')
+        events.append('data: [DONE]\n\n')
+        return 200, self._send_events(events, delay / len(events))
+
+    def _images(self, path, body, settings):
+        mock = self.server.mock
+        time.sleep(mock.latency(settings))
+        data = [{'url': mock._file_url('.png')} for _ in range(body.get('n', 1))]
+        return 200, self._send_json(200, {'created': int(time.time()), 'data': data})
+
+    def _create_prediction(self, path, body, settings):
+        mock = self.server.mock
+        now = time.time()
+        model = '/'.join(path.split('/')[3:5]) if path.startswith('/v1/models/') else ''
+        prediction = {
+            'id': uuid.uuid4().hex[:16],
+            'model': model,
+            'version': body.get('version', ''),
+            'status': 'starting',
+            'input': body.get('input', {}),
+            'output': mock._prediction_output(body.get('input', {}), settings),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S.000000Z', time.gmtime(now)),
+            'ready_at': now + mock.latency(settings),
+        }
+        with mock._lock:
+            mock._predictions[prediction['id']] = prediction
+        if body.get('webhook'):
+            timer = threading.Timer(prediction['ready_at'] - now, mock._send_webhook, args=(body['webhook'], prediction))
+            timer.daemon = True
+            timer.start()
+        # 'Prefer: wait[=seconds]' holds the response until the prediction
+        # finishes or the wait runs out
+        prefer = self.headers.get('Prefer', '')
+        if prefer.startswith('wait'):
+            wait = float(prefer.partition('=')[2] or 60)
+            time.sleep(max(0.0, min(prediction['ready_at'] - now, wait)))
+        return 201, self._send_json(201, mock._prediction_json(prediction))
+
+    def _lookup(self, path):
+        prediction_id = re.search(r'/(?:predictions|stream)/(\w+)', path).group(1)
+        with self.server.mock._lock:
+            return self.server.mock._predictions.get(prediction_id)
+
+    def _get_prediction(self, path, body, settings):
+        prediction = self._lookup(path)
+        if prediction is None:
+            return 404, self._send_json(404, {'detail': 'Not found'})
+        return 200, self._send_json(200, self.server.mock._prediction_json(prediction))
+
+    def _cancel_prediction(self, path, body, settings):
+        prediction = self._lookup(path)
+        if prediction is None:
+            return 404, self._send_json(404, {'detail': 'Not found'})
+        prediction['status'] = 'canceled'
+        return 200, self._send_json(200, self.server.mock._prediction_json(prediction))
+
+    def _get_version(self, path, body, settings):
+        return 200, self._send_json(200, {
+            'id': path.rsplit('/', 1)[-1],
+            'created_at': '2024-01-01T00:00:00.000000Z',
+            'cog_version': '0.9.0',
+            'openapi_schema': {},
+        })
+
+    # Stream a text prediction's output tokens as Replicate server-sent events
+    def _stream_prediction(self, path, body, settings):
+        prediction = self._lookup(path)
+        if prediction is None:
+            return 404, self._send_json(404, {'detail': 'Not found'})
+        output = prediction['output'] if isinstance(prediction['output'], list) else [str(prediction['output'])]
+        remaining = max(0.0, prediction['ready_at'] - time.time())
+        events = [f"event: output\nid: {i}\ndata: {token}\n\n" for i, token in enumerate(output)]
+        events.append(f"event: done\nid: {len(output)}\ndata: {{}}\n\n")
+        return 200, self._send_events(events, remaining / len(events))
+
+
+# A local stand-in for the OpenAI or Replicate API, with configurable
+# latency, failures and payload sizes. Every request is recorded so a run
+# can report per-endpoint latency percentiles and bytes transferred.
+class MockProviderServer:
+    def __init__(self, provider, profile=None, host='127.0.0.1', port=0):
+        if provider not in ('openai', 'replicate'):
+            raise ValueError(f"Unknown provider: {provider}")
+        self.provider = provider
+        self.profile = make_profile(profile)
+        self._rng = random.Random(f"{self.profile['seed']}-{provider}")
+        self._lock = threading.Lock()
+        self._records = []
+        self._predictions = {}
+        self._png = synthetic_png(self.profile['image_bytes'], self.profile['seed'])
+        self._mp3 = synthetic_mp3(self.profile['music_bytes'])
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"mock-{self.provider}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def route(self, method, path):
+        if path.startswith('/files/') and method == 'GET':
+            return 'files', '_serve_file'
+        if self.provider == 'openai' and method == 'POST':
+            if path == '/v1/chat/completions':
+                return 'chat', '_chat'
+            if path == '/v1/images/generations':
+                return 'images', '_images'
+        if self.provider == 'replicate':
+            if method == 'POST' and (path == '/v1/predictions' or re.fullmatch(r'/v1/models/[^/]+/[^/]+/predictions', path)):
+                return 'predictions', '_create_prediction'
+            if method == 'POST' and re.fullmatch(r'/v1/predictions/\w+/cancel', path):
+                return 'cancel', '_cancel_prediction'
+            if method == 'GET' and re.fullmatch(r'/v1/predictions/\w+', path):
+                return 'poll', '_get_prediction'
+            if method == 'GET' and re.fullmatch(r'/v1/models/[^/]+/[^/]+/versions/\w+', path):
+                return 'versions', '_get_version'
+            if method == 'GET' and path.startswith('/stream/'):
+                return 'stream', '_stream_prediction'
+        return None, None
+
+    def latency(self, settings):
+        with self._lock:
+            return sample_latency(settings.get('latency', {}), self._rng) * self.profile['scale']
+
+    def inject_failure(self, settings):
+        with self._lock:
+            roll = self._rng.random()
+        if roll < settings.get('throttle_rate', 0.0):
+            return 429
+        if roll < settings.get('throttle_rate', 0.0) + settings.get('error_rate', 0.0):
+            return 500
+        return None
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self._lock:
+            return self._rng.random() < rate
+
+    def record(self, endpoint, status, started, bytes_in, bytes_out):
+        with self._lock:
+            self._records.append({
+                'endpoint': endpoint, 'status': status, 'seconds': time.time() - started,
+                'bytes_in': bytes_in, 'bytes_out': bytes_out,
+            })
+
+    def reset(self):
+        with self._lock:
+            self._records = []
+            self._predictions = {}
+
+    def records(self):
+        with self._lock:
+            return list(self._records)
+
+    def _file_url(self, extension):
+        return f"{self.url}/files/{uuid.uuid4().hex}{extension}"
+
+    # Output shaped like the model the input was meant for
+    def _prediction_output(self, model_input, settings):
+        if 'num_outputs' in model_input:
+            return [self._file_url('.png') for _ in range(model_input['num_outputs'])]
+        if model_input.get('output_format') == 'mp3':
+            return self._file_url('.mp3')
+        if 'aspect_ratio' in model_input:
+            return self._file_url('.png')
+        if 'max_length' in model_input:
+            text = chat_content(
+                model_input.get('prompt', ''), settings.get('payload_bytes', 2000), self.chance(settings.get('broken_code_rate', 0.0))
+            )
+            return re.findall(r'\S+\s*', text)
+        return [self._file_url('.png')]
+
+    # POST the finished prediction to its webhook URL, as Replicate does
+    def _send_webhook(self, url, prediction):
+        request = urllib.request.Request(
+            url, data=json.dumps(self._prediction_json(prediction)).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+        except OSError:
+            pass
+
+    def _prediction_json(self, prediction):
+        done = time.time() >= prediction['ready_at']
+        status = prediction['status'] if prediction['status'] == 'canceled' else ('succeeded' if done else 'starting')
+        return {
+            'id': prediction['id'],
+            'model': prediction['model'],
+            'version': prediction['version'],
+            'status': status,
+            'input': prediction['input'],
+            'output': prediction['output'] if status == 'succeeded' else None,
+            'error': None,
+            'logs': '',
+            'created_at': prediction['created_at'],
+            'urls': {
+                'get': f"{self.url}/v1/predictions/{prediction['id']}",
+                'cancel': f"{self.url}/v1/predictions/{prediction['id']}/cancel",
+                'stream': f"{self.url}/stream/{prediction['id']}",
+            },
+        }
+
+# Per-endpoint call counts, failures, latency percentiles and bytes for a
+# list of request records
+def summarize(records):
+    endpoints = {}
+    for record in records:
+        endpoints.setdefault(record['endpoint'], []).append(record)
+    summary = {}
+    for endpoint, group in sorted(endpoints.items()):
+        seconds = sorted(record['seconds'] for record in group)
+        summary[endpoint] = {
+            'calls': len(group),
+            'errors': sum(1 for record in group if record['status'] >= 500),
+            'throttled': sum(1 for record in group if record['status'] == 429),
+            'p50': round(percentile(seconds, 50), 4),
+            'p95': round(percentile(seconds, 95), 4),
+            'bytes_in': sum(record['bytes_in'] for record in group),
+            'bytes_out': sum(record['bytes_out'] for record in group),
+        }
+    return summary
+
+
+# Nearest-rank percentile of a sorted list
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * pct // 100))
+    return values[int(rank) - 1]
@@ -0,0 +1,76 @@
+import requests
+
+import design_brief
+import pipeline
+
+# OpenAI backends for the provider registry, imported the first time one
+# is used. Endpoint URLs are read from pipeline at call time so they can be
+# pointed at a local server.
+
+
+# Chat completion with an OpenAI chat model; also serves code generation
+# With on_token, the response is streamed and each token is passed to it.
+def chat(ctx, backend, system, prompt, use_cache=None, on_token=None):
+    data = {
+        "model": backend.model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
+        ]
+    }
+    prompt_tokens = design_brief.estimate_tokens(system or '') + design_brief.estimate_tokens(prompt)
+
+    def compute():
+        try:
+            if on_token:
+                stream = lambda: pipeline.stream_openai_chat(ctx, data)
+                return pipeline.stream_with_retry(ctx, stream, 'openai', backend.model, on_token, prompt_tokens)
+
+            response = pipeline.post_openai(
+                ctx, pipeline.CHAT_API_URL, data, backend.model, tokens=prompt_tokens + pipeline.EXPECTED_COMPLETION_TOKENS
+            )
+            response_data = response.json()
+            if "choices" not in response_data:
+                error_message = response_data.get("error", {}).get("message", "Unknown error")
+                return f"Error: {error_message}"
+
+            content_text = response_data["choices"][0]["message"]["content"]
+            return content_text
+
+        except requests.RequestException as e:
+            return f"Error: Unable to communicate with the OpenAI API: {str(e)}"
+
+    return pipeline.cached_response(ctx, backend.model, system, prompt, {}, compute, use_cache, on_token)
+
+
+def dalle_image(ctx, backend, prompt, size):
+    width, height = backend.fit_size(size)
+    data = {
+        "model": backend.model,
+        "prompt": prompt,
+        "size": f"{width}x{height}",
+        "n": 1,
+        "response_format": "url"
+    }
+    try:
+        response = pipeline.post_openai(ctx, pipeline.DALLE_API_URL, data, backend.model, kind='image')
+        response_data = response.json()
+        if "data" not in response_data:
+            error_message = response_data.get("error", {}).get("message", "Unknown error")
+            return f"Error: {error_message}"
+        if not response_data["data"]:
+            return "Error: No data returned from API."
+        return response_data["data"][0]["url"]
+    except requests.RequestException as e:
+        return f"Error: Unable to generate image: {str(e)}"
+
+
+# DALL-E 3 only accepts n=1, so a batch is one request per image
+def dalle_images(ctx, backend, prompt, size, count):
+    return [dalle_image(ctx, backend, prompt, size) for _ in range(count)]
+
+
+# Code generation is a chat completion with the code model; the response
+# length is left to the model
+def code(ctx, backend, system, prompt, use_cache=None, on_token=None, max_length=2048):
+    return chat(ctx, backend, system, prompt, use_cache, on_token)
@@ -0,0 +1,893 @@
+import copy
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import requests
+
+import asset_store
+import design_brief
+import fair_share
+import http_pool
+import prefetch
+import providers
+import response_cache
+import retry
+import script_validation
+import tracing
+from scheduler import TaskGraph, DEFAULT_MAX_WORKERS, DEFAULT_PROVIDER_LIMITS
+from script_cleanup import ScriptCleaner, code_blocks, split_engine_blocks
+
+# Constants
+CHAT_API_URL = "https://api.openai.com/v1/chat/completions"
+DALLE_API_URL = "https://api.openai.com/v1/images/generations"
+API_KEY_FILE = "api_keys.json"
+# Completion tokens charged to the token budget before a reply is known
+EXPECTED_COMPLETION_TOKENS = 1000
+
+IMAGE_TYPES = ['Character', 'Enemy', 'Background', 'Object', 'Texture', 'Sprite', 'UI']
+SCRIPT_TYPES = ['Player', 'Enemy', 'Game Object', 'Level Background']
+# Scripts that fail validation are regenerated up to MAX_SCRIPT_RETRIES
+# times each, and at most DEFAULT_SCRIPT_RETRY_BUDGET times per plan
+MAX_SCRIPT_RETRIES = 2
+DEFAULT_SCRIPT_RETRY_BUDGET = 4
+
+DEFAULT_CUSTOMIZATION = {
+    'image_types': IMAGE_TYPES,
+    'script_types': SCRIPT_TYPES,
+    'image_count': {t: 0 for t in IMAGE_TYPES},
+    'script_count': {t: 0 for t in SCRIPT_TYPES},
+    'use_replicate': {'generate_music': False},
+    'code_types': {'unity': False, 'unreal': False, 'blender': False},
+    'generate_elements': {
+        'game_concept': True,
+        'world_concept': True,
+        'character_concepts': True,
+        'plot': True,
+        'storyline': False,
+        'dialogue': False,
+        'game_mechanics': False,
+        'level_design': False
+    },
+    'image_model': providers.DEFAULT_MODELS['image'],
+    'chat_model': providers.DEFAULT_MODELS['chat'],
+    'code_model': providers.DEFAULT_MODELS['code'],
+    'max_workers': DEFAULT_MAX_WORKERS,
+    'provider_limits': dict(DEFAULT_PROVIDER_LIMITS),
+    'use_cache': True,
+    'prefetch_assets': True,
+    'stream_output': True,
+    'combine_engines': True,
+    'validate_scripts': True,
+    'script_retry_budget': DEFAULT_SCRIPT_RETRY_BUDGET,
+    'reuse_results': True,
+    'save_projects': True,
+    'prediction_manager': True,
+    'design_brief': True,
+    'prompt_budget': design_brief.DEFAULT_PROMPT_BUDGET,
+    'atlas_types': ['Object', 'Sprite', 'UI'],
+    'atlas_max_size': 2048,
+    'atlas_padding': 2,
+    'optimize_images': False,
+    'image_formats': {},
+}
+
+# Return a fresh copy of the default customization with each set of
+# overrides merged in order (nested dicts are updated, not replaced)
+def default_customization(*overrides):
+    customization = copy.deepcopy(DEFAULT_CUSTOMIZATION)
+    for override in overrides:
+        for key, value in (override or {}).items():
+            if isinstance(value, dict) and isinstance(customization.get(key), dict):
+                customization[key].update(copy.deepcopy(value))
+            else:
+                customization[key] = copy.deepcopy(value)
+    return customization
+
+# Everything a generation run needs: API keys, customization settings, a
+# warning sink and optional per-provider CallSlots that cap how many
+# provider calls may be in flight at once ('*' applies to all). Calls wait
+# for their turn in the fair-share scheduler as the named session.
+class GenerationContext:
+    def __init__(self, api_keys, customization, on_warning=None, call_slots=None, session=None):
+        self.api_keys = api_keys
+        self.customization = customization
+        self.on_warning = on_warning
+        self.call_slots = call_slots or {}
+        self.session = session or fair_share.DEFAULT_SESSION
+        self._lock = threading.Lock()
+        self._prompt_stats = {'prompts': 0, 'concept_tokens': 0, 'context_tokens': 0, 'brief_tokens': 0}
+        self._script_stats = {'checked': 0, 'failed': 0, 'regenerated': 0, 'invalid': 0}
+        self._script_retries = customization.get('script_retry_budget', DEFAULT_SCRIPT_RETRY_BUDGET)
+        self._local = threading.local()
+
+    def warn(self, message):
+        if self.on_warning:
+            self.on_warning(message)
+        else:
+            print(message, file=sys.stderr)
+
+    # Record the concept tokens a prompt would have carried and what it sent instead
+    def note_prompt(self, concept_tokens, context_tokens):
+        with self._lock:
+            self._prompt_stats['prompts'] += 1
+            self._prompt_stats['concept_tokens'] += concept_tokens
+            self._prompt_stats['context_tokens'] += context_tokens
+
+    def note_brief(self, tokens):
+        with self._lock:
+            self._prompt_stats['brief_tokens'] += tokens
+
+    # Tokens saved by sending the design brief instead of the full concept,
+    # net of the call that wrote the brief; None if no prompt used a brief
+    def prompt_savings(self):
+        with self._lock:
+            stats = dict(self._prompt_stats)
+        if not stats['prompts']:
+            return None
+        stats['tokens_saved'] = stats['concept_tokens'] - stats['context_tokens'] - stats['brief_tokens']
+        return stats
+
+    # Count a script validation outcome: 'checked', 'failed' (on the first
+    # check), 'regenerated' or 'invalid' (still failing when kept)
+    def note_script(self, outcome):
+        with self._lock:
+            self._script_stats[outcome] += 1
+
+    # Take one script regeneration from the plan's budget, if any is left
+    def take_script_retry(self):
+        with self._lock:
+            if self._script_retries <= 0:
+                return False
+            self._script_retries -= 1
+            return True
+
+    # Collect the response cache keys read or written on this thread inside
+    # the block, so a response that turns out to be unusable can be evicted
+    @contextmanager
+    def cache_keys(self):
+        keys = []
+        previous = getattr(self._local, 'cache_keys', None)
+        self._local.cache_keys = keys
+        try:
+            yield keys
+        finally:
+            self._local.cache_keys = previous
+
+    def note_cache_key(self, key):
+        keys = getattr(self._local, 'cache_keys', None)
+        if keys is not None:
+            keys.append(key)
+
+    # Script validation counts, or None if no script was checked
+    def script_checks(self):
+        with self._lock:
+            return dict(self._script_stats) if self._script_stats['checked'] else None
+
+    # Hold call slots for count concurrent calls to provider, then a slot
+    # from the fair-share scheduler for calls of kind ('text', 'image' or
+    # 'audio') expected to use tokens. Both are taken whole, in this
+    # thread, and released together. Time spent waiting counts as queue
+    # wait. Yields the scheduler's ticket, whose used() corrects the token
+    # count.
+    @contextmanager
+    def call_slot(self, provider, kind='text', tokens=0, count=1):
+        slots = self.call_slots.get(provider) or self.call_slots.get('*')
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            if slots is not None:
+                stack.enter_context(slots.hold(count))
+            ticket = stack.enter_context(fair_share.get_scheduler().slot(provider, self.session, kind, tokens, count))
+            tracing.add(queue_wait=time.perf_counter() - started)
+            yield ticket
+
+# Load API keys from a file
+def load_api_keys():
+    if os.path.exists(API_KEY_FILE):
+        with open(API_KEY_FILE, 'r') as file:
+            data = json.load(file)
+            return data.get('openai'), data.get('replicate')
+    return None, None
+
+# Save API keys to a file
+def save_api_keys(openai_key, replicate_key):
+    with open(API_KEY_FILE, 'w') as file:
+        json.dump({"openai": openai_key, "replicate": replicate_key}, file)
+
+# Get headers for OpenAI API
+def get_openai_headers(ctx):
+    return {
+        "Authorization": f"Bearer {ctx.api_keys['openai']}",
+        "Content-Type": "application/json"
+    }
+
+# Return a cached model response, or compute it and cache it on success.
+# A cache hit is passed to on_token in one piece.
+def cached_response(ctx, model, system, prompt, params, compute, use_cache=None, on_token=None):
+    if use_cache is None:
+        use_cache = ctx.customization.get('use_cache', True)
+    if not use_cache:
+        return compute()
+    cache = response_cache.get_cache()
+    key = response_cache.make_key(model, system, prompt, params)
+    ctx.note_cache_key(key)
+    cached = cache.get(key)
+    tracing.annotate(cache='hit' if cached is not None else 'miss')
+    if cached is not None:
+        if on_token:
+            on_token(cached)
+        return cached
+    result = compute()
+    if isinstance(result, str) and not result.startswith('Error'):
+        cache.set(key, result)
+    return result
+
+# Token counts from an OpenAI usage object, for tracing
+def usage_fields(usage):
+    return {
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+    }
+
+# Post JSON to an OpenAI endpoint, retrying rate limits and server errors.
+# tokens is the expected usage, corrected from the response's usage.
+def post_openai(ctx, url, data, label, kind='text', tokens=0):
+    def send():
+        with ctx.call_slot('openai', kind, tokens) as ticket:
+            response = http_pool.post(url, headers=get_openai_headers(ctx), json=data)
+            usage = (response.json().get('usage') or {}) if response.ok and (tokens or tracing.enabled()) else {}
+            if 'total_tokens' in usage:
+                ticket.used(usage['total_tokens'])
+            if tracing.enabled():
+                tracing.annotate(bytes_sent=len(response.request.body or b''), bytes_received=len(response.content))
+                if response.ok:
+                    tracing.annotate(**usage_fields(usage))
+            response.raise_for_status()
+            return response
+
+    with tracing.span(label, 'openai', model=data.get('model', label)):
+        return retry.call_with_retry(send, 'openai', label)
+
+# Pass tokens from stream() to on_token, retrying only while nothing was
+# emitted yet. The call is charged prompt_tokens plus the expected reply,
+# then corrected by the length of the reply.
+def stream_with_retry(ctx, stream, provider, label, on_token, prompt_tokens=0):
+    tokens = []
+
+    def attempt():
+        with ctx.call_slot(provider, 'text', prompt_tokens + EXPECTED_COMPLETION_TOKENS) as ticket:
+            for token in stream():
+                tokens.append(token)
+                on_token(token)
+            ticket.used(prompt_tokens + design_brief.estimate_tokens(''.join(tokens)))
+        return ''.join(tokens)
+
+    with tracing.span(label, provider, model=label, streamed=True):
+        return retry.call_with_retry(attempt, provider, label, can_retry=lambda: not tokens)
+
+# Yield content tokens from an OpenAI chat completion stream (server-sent events).
+# The final chunk carries the token usage, which is recorded on the trace.
+def stream_openai_chat(ctx, data):
+    data = {**data, "stream": True, "stream_options": {"include_usage": True}}
+    with http_pool.post(CHAT_API_URL, headers=get_openai_headers(ctx), json=data, stream=True) as response:
+        tracing.annotate(bytes_sent=len(response.request.body or b''))
+        response.raise_for_status()
+        for line in response.iter_lines(decode_unicode=True):
+            tracing.add(bytes_received=len(line) + 1)
+            if not line or not line.startswith("data: "):
+                continue
+            payload = line[len("data: "):]
+            if payload == "[DONE]":
+                break
+            chunk = json.loads(payload)
+            if "error" in chunk:
+                raise requests.RequestException(chunk["error"].get("message", "Unknown error"))
+            if chunk.get("usage"):
+                tracing.annotate(**usage_fields(chunk["usage"]))
+            choices = chunk.get("choices") or []
+            delta = choices[0].get("delta", {}).get("content") if choices else None
+            if delta:
+                yield delta
+
+# System prompt for an assistant specializing in role
+def system_prompt(role):
+    return f"You are a highly skilled assistant specializing in {role}. Provide detailed, creative, and well-structured responses optimized for game development."
+
+# Generate content using selected chat model.
+# With on_token, the response is streamed and each token is passed to it.
+def generate_content(ctx, prompt, role, use_cache=None, on_token=None):
+    backend = providers.get('chat', ctx.customization['chat_model'])
+    if backend is None:
+        return "Error: Invalid chat model selected."
+    return backend(ctx, system_prompt(role), prompt, use_cache, on_token if backend.streaming else None)
+
+# Generate an image using selected image model
+def generate_image(ctx, prompt, size):
+    return generate_image_batch(ctx, prompt, size, 1)[0]
+
+# Generate several images from one prompt, in as few requests as the
+# selected image model allows
+def generate_image_batch(ctx, prompt, size, count):
+    backend = providers.get('image', ctx.customization['image_model'])
+    if backend is None:
+        return ["Error: Invalid image model selected."] * count
+    return backend(ctx, prompt, size, count)
+
+# Generate music using Replicate's MusicGen
+def generate_music(ctx, prompt):
+    return providers.get('music', 'musicgen')(ctx, prompt)
+
+# Prompts and sizes for each image type
+IMAGE_PROMPTS = {
+    'Character': "Create a highly detailed, front-facing character concept art for a 2D game...",
+    'Enemy': "Design a menacing, front-facing enemy character concept art for a 2D game...",
+    'Background': "Create a wide, highly detailed background image for a level of the game...",
+    'Object': "Create a detailed object image for a 2D game...",
+    'Texture': "Generate a seamless texture pattern...",
+    'Sprite': "Create a game sprite sheet with multiple animation frames...",
+    'UI': "Design a cohesive set of user interface elements for a 2D game..."
+}
+
+IMAGE_SIZES = {
+    'Character': (1024, 1024),
+    'Enemy': (1024, 1024),
+    'Background': (1024, 1024),
+    'Object': (1024, 1024),
+    'Texture': (1024, 1024),
+    'Sprite': (1024, 1024),
+    'UI': (1024, 1024)
+}
+
+# Most images one generation task handles with the selected image model
+def image_batch_limit(customization):
+    backend = providers.get('image', customization['image_model'])
+    if backend is None:
+        return 1
+    limit = backend.batch_limit(customization)
+    if image_fanout(customization, backend):
+        # Each prediction of a fanned-out batch takes a provider slot
+        provider_limits = customization.get('provider_limits') or DEFAULT_PROVIDER_LIMITS
+        limit = min(limit, provider_limits.get(backend.provider) or limit)
+    return limit
+
+# Whether a batch of images from backend runs as concurrent predictions
+def image_fanout(customization, backend):
+    return backend.fanout > 1 and customization.get('prediction_manager', True)
+
+# List the (key, image type, variation index) of every image to generate
+def image_jobs(customization):
+    return [
+        (f"{img_type.lower()}_image_{i + 1}", img_type, i)
+        for img_type in customization['image_types']
+        for i in range(customization['image_count'].get(img_type, 0))
+    ]
+
+# Group image jobs into (image type, [(key, index), ...]) batches that one
+# request to the selected image model can serve, leaving out skipped keys
+def image_batches(customization, skip=()):
+    limit = image_batch_limit(customization)
+    batches = []
+    for key, img_type, i in image_jobs(customization):
+        if key in skip:
+            continue
+        if batches and batches[-1][0] == img_type and len(batches[-1][1]) < limit:
+            batches[-1][1].append((key, i))
+        else:
+            batches.append((img_type, [(key, i)]))
+    return batches
+
+# Condense the game concept into a size-bounded design brief, once per plan
+def generate_design_brief(ctx, game_concept):
+    if not game_concept or game_concept.startswith('Error'):
+        return {}
+    request = design_brief.brief_request(game_concept)
+    response = generate_content(ctx, request, "game art direction")
+    failed = response.startswith('Error')
+    brief = {} if failed else design_brief.parse_brief(response)
+    if not brief:
+        ctx.warn("Unable to condense the game concept into a design brief; using the start of the concept instead.")
+        brief = design_brief.fallback_brief(game_concept, ctx.customization.get('prompt_budget', design_brief.DEFAULT_PROMPT_BUDGET))
+    brief['concept_tokens'] = design_brief.estimate_tokens(game_concept)
+    # A failed request spent no tokens on a brief
+    if not failed:
+        ctx.note_brief(design_brief.estimate_tokens(request) + design_brief.estimate_tokens(response))
+    return brief
+
+# Concept context for one asset prompt: the fields of the design brief the
+# asset needs when there is a brief, otherwise the full game concept
+def asset_context(ctx, source, asset):
+    if not isinstance(source, dict):
+        return source or ''
+    budget = ctx.customization.get('prompt_budget', design_brief.DEFAULT_PROMPT_BUDGET)
+    context = design_brief.brief_context(source, asset, budget)
+    ctx.note_prompt(source.get('concept_tokens', 0), design_brief.estimate_tokens(context))
+    return context
+
+# Generate a single image variation
+def generate_image_variation(ctx, img_type, index, context):
+    prompt = f"{IMAGE_PROMPTS[img_type]} The design should fit the following game concept: {context}. Variation {index + 1}"
+    return generate_image(ctx, prompt, IMAGE_SIZES[img_type])
+
+# Generate a batch of image variations and return {key: url}
+def generate_image_group(ctx, img_type, jobs, context):
+    if len(jobs) == 1:
+        key, i = jobs[0]
+        return {key: generate_image_variation(ctx, img_type, i, context)}
+    prompt = f"{IMAGE_PROMPTS[img_type]} The design should fit the following game concept: {context}."
+    outputs = generate_image_batch(ctx, prompt, IMAGE_SIZES[img_type], len(jobs))
+    return {key: output for (key, i), output in zip(jobs, outputs)}
+
+SCRIPT_DESCRIPTIONS = {
+    'Player': "Create a comprehensive player character script for a 2D game. Include movement, input handling, and basic interactions.",
+    'Enemy': "Develop a detailed enemy AI script for a 2D game. Include patrolling, player detection, and attack behaviors.",
+    'Game Object': "Script a versatile game object that can be interacted with, collected, or activated by the player.",
+    'Level Background': "Create a script to manage the level background in a 2D game, including parallax scrolling if applicable."
+}
+
+# Language and file extension for each supported engine
+CODE_TYPES = {
+    'unity': ('csharp', '.cs'),
+    'unreal': ('cpp', '.cpp'),
+    'blender': ('python', '.py'),
+}
+
+# List the (file name, script type, code type) of every script to generate
+def script_jobs(customization):
+    jobs = []
+    for script_type in customization['script_types']:
+        for i in range(customization['script_count'].get(script_type, 0)):
+            for code_type, selected in customization['code_types'].items():
+                if selected and code_type in CODE_TYPES:
+                    file_ext = CODE_TYPES[code_type][1]
+                    jobs.append((f"{script_type.lower()}_{code_type}_script_{i + 1}{file_ext}", script_type, code_type))
+    return jobs
+
+# Request code from the selected code model and return the raw text
+def request_code(ctx, desc, code_model, on_token=None, max_length=2048):
+    backend = providers.get('code', code_model)
+    if backend is None:
+        return "Error: Invalid code model selected."
+    return backend(ctx, system_prompt("game development"), desc, None, on_token if backend.streaming else None, max_length)
+
+# Request a single script for one engine and return its extracted code.
+# problem is why a previous attempt failed validation, if this is a retry.
+# With on_token, cleaned code is passed to it line by line as it streams.
+def request_script(ctx, script_type, code_type, code_model, on_token=None, problem=None):
+    desc = f"{SCRIPT_DESCRIPTIONS[script_type]} The script should be for {code_type.capitalize()}. Generate ONLY the code, without any explanations or comments outside the code. Ensure the code is complete and can be directly used in a project."
+    if problem:
+        desc += f" A previous attempt was rejected because of this problem: {problem}. Make sure the code is syntactically valid."
+
+    # Clean up the generated code as it arrives
+    cleaner = ScriptCleaner()
+    streamed = []
+
+    def feed(token):
+        streamed.append(token)
+        cleaned = cleaner.feed(token)
+        if cleaned:
+            on_token(cleaned)
+
+    script_code = request_code(ctx, desc, code_model, feed if on_token else None)
+
+    if script_code.startswith('Error'):
+        return script_code
+    if not streamed:
+        cleaner.feed(script_code)
+    cleaned = cleaner.close()
+    if cleaned and on_token:
+        on_token(cleaned)
+    return cleaner.text()
+
+# Remove cached responses that produced an unusable script, so a later
+# run asks again instead of getting the same script back
+def evict_responses(keys):
+    cache = response_cache.get_cache()
+    for key in keys:
+        cache.delete(key)
+
+# Check a generated script and regenerate it while it fails, within the
+# plan's retry budget. A script that still fails is kept, with a warning.
+# cache_keys are the cached responses the script came from; they are
+# evicted if it fails, as are the responses of failed regenerations.
+def validated_script(ctx, script_type, code_type, code_model, code, cache_keys=()):
+    if not ctx.customization.get('validate_scripts', True) or code.startswith('Error'):
+        return code
+    language = CODE_TYPES[code_type][0]
+    problem = script_validation.check_script(code, language)
+    ctx.note_script('checked')
+    if problem:
+        ctx.note_script('failed')
+        evict_responses(cache_keys)
+    attempts = 0
+    while problem and attempts < MAX_SCRIPT_RETRIES and ctx.take_script_retry():
+        attempts += 1
+        ctx.note_script('regenerated')
+        with ctx.cache_keys() as retry_keys:
+            retried = request_script(ctx, script_type, code_type, code_model, problem=problem)
+        if retried.startswith('Error'):
+            break
+        code = retried
+        problem = script_validation.check_script(code, language)
+        if problem:
+            evict_responses(retry_keys)
+    if problem:
+        ctx.note_script('invalid')
+        ctx.warn(f"{script_type} script for {code_type.capitalize()} failed validation: {problem}")
+    return code
+
+# Generate a single script for one engine, regenerating it if it fails
+# validation. With on_token, cleaned code is passed to it line by line as
+# it streams.
+def generate_script(ctx, script_type, code_type, code_model, on_token=None):
+    with ctx.cache_keys() as keys:
+        code = request_script(ctx, script_type, code_type, code_model, on_token)
+    return validated_script(ctx, script_type, code_type, code_model, code, keys)
+
+# Group script jobs into (script type, [(file name, code type), ...]) per
+# variation, so all selected engines can be requested together, leaving
+# out skipped file names
+def script_groups(customization, skip=()):
+    groups = []
+    for script_type in customization['script_types']:
+        for i in range(customization['script_count'].get(script_type, 0)):
+            engines = [
+                (f"{script_type.lower()}_{code_type}_script_{i + 1}{CODE_TYPES[code_type][1]}", code_type)
+                for code_type, selected in customization['code_types'].items()
+                if selected and code_type in CODE_TYPES
+            ]
+            engines = [(file_name, code_type) for file_name, code_type in engines if file_name not in skip]
+            if engines:
+                groups.append((script_type, engines))
+    return groups
+
+# Generate one script for several engines in a single request and return
+# {file name: code}. Engines whose block is missing or empty are requested
+# on their own; blocks that fail validation are regenerated on their own.
+# With on_show, the code of the engine being written is passed to it, in
+# full, after each complete line; the headings and fences are not shown.
+def generate_script_group(ctx, script_type, engines, code_model, on_show=None):
+    if len(engines) == 1:
+        file_name, code_type = engines[0]
+        shown = []
+
+        def show(cleaned):
+            shown.append(cleaned)
+            on_show(''.join(shown))
+
+        return {file_name: generate_script(ctx, script_type, code_type, code_model, show if on_show else None)}
+
+    engine_names = ', '.join(f"{code_type} ({CODE_TYPES[code_type][0]})" for file_name, code_type in engines)
+    desc = (
+        f"{SCRIPT_DESCRIPTIONS[script_type]} Write this script once for each of these engines: {engine_names}. "
+        "For each engine, output a heading line '### <engine>' (for example '### unity') followed by exactly one fenced code block "
+        "containing the complete code for that engine. Generate ONLY the headings and code, without any explanations. "
+        "Ensure each script is complete and can be directly used in a project."
+    )
+    streamed = []
+
+    def feed(token):
+        streamed.append(token)
+        if '\n' in token:
+            text = ''.join(streamed)
+            blocks = code_blocks(text[:text.rindex('\n')])
+            if blocks:
+                on_show(blocks[-1][2])
+
+    with ctx.cache_keys() as keys:
+        response = request_code(ctx, desc, code_model, feed if on_show else None, max_length=2048 * len(engines))
+    languages = {code_type: CODE_TYPES[code_type][0] for file_name, code_type in engines}
+    blocks = {} if response.startswith('Error') else split_engine_blocks(response, list(languages), languages)
+
+    scripts = {}
+    for file_name, code_type in engines:
+        if code_type in blocks:
+            scripts[file_name] = validated_script(ctx, script_type, code_type, code_model, blocks[code_type], keys)
+        else:
+            scripts[file_name] = generate_script(ctx, script_type, code_type, code_model)
+    return scripts
+
+# Thread-safe text buffers for streamed output, drained by the UI thread
+class StreamBuffers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._text = {}
+        self._dirty = set()
+
+    # A callable that appends a token to key's text, or with replace,
+    # replaces the text
+    def writer(self, key, replace=False):
+        def write(token):
+            with self._lock:
+                self._text[key] = token if replace else self._text.get(key, '') + token
+                self._dirty.add(key)
+        return write
+
+    def drain(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return {key: self._text[key] for key in dirty}
+
+# Split a finished task result into (node, value) pairs, one per plan
+# node: 'element:<name>', 'image:<key>', 'script:<file name>' or 'music'
+def node_values(key, value):
+    kind, name = key
+    if kind == 'element':
+        return [(f"element:{name}", value)]
+    if kind == 'images':
+        # name is the tuple of image keys in the batch
+        values = value if isinstance(value, dict) else {image_key: value for image_key in name}
+        return [(f"image:{image_key}", image) for image_key, image in values.items()]
+    if kind == 'script':
+        return [(f"script:{name}", value)]
+    if kind == 'scripts':
+        # name is the tuple of script file names in the group
+        values = value if isinstance(value, dict) else {file_name: value for file_name in name}
+        return [(f"script:{file_name}", code) for file_name, code in values.items()]
+    if kind == 'music':
+        return [('music', value)]
+    if kind == 'brief':
+        return [('brief', value)]
+    return []
+
+# Store the value of one plan node in the game plan
+def set_plan_value(game_plan, node, value):
+    kind, _, name = node.partition(':')
+    if kind == 'element':
+        game_plan[name] = value
+    elif kind == 'image':
+        game_plan.setdefault('images', {})[name] = value
+    elif kind == 'script':
+        game_plan.setdefault('scripts', {})[name] = value
+    elif kind == 'music':
+        game_plan['music'] = None if isinstance(value, str) and value.startswith('Error') else value
+    elif kind == 'brief':
+        game_plan['design_brief'] = value
+
+# Read the value of one plan node back from a game plan
+def get_plan_value(game_plan, node):
+    kind, _, name = node.partition(':')
+    if kind == 'element':
+        return game_plan.get(name)
+    if kind == 'image':
+        return game_plan.get('images', {}).get(name)
+    if kind == 'script':
+        return game_plan.get('scripts', {}).get(name)
+    if kind == 'music':
+        return game_plan.get('music')
+    if kind == 'brief':
+        return game_plan.get('design_brief')
+    return None
+
+# List the asset URLs produced by a finished task
+def asset_urls(key, value):
+    if key[0] == 'images' and isinstance(value, dict):
+        return list(value.values())
+    if key[0] == 'music':
+        return [value]
+    return []
+
+# List every downloadable asset URL in a finished game plan
+def plan_asset_urls(game_plan):
+    urls = [url for url in game_plan.get('images', {}).values() if isinstance(url, str) and url.startswith('http')]
+    if isinstance(game_plan.get('music'), str):
+        urls.append(game_plan['music'])
+    return urls
+
+# Short hash of everything that determines a node's output
+def fingerprint(*inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+# Fingerprint every node of the plan a customization asks for, in plan
+# order. Images and music include the fingerprint of the game concept (or
+# of its design brief), so they change whenever that would be regenerated.
+def plan_fingerprints(customization, user_prompt):
+    fingerprints = {}
+    for element, should_generate in customization['generate_elements'].items():
+        if should_generate:
+            prompt = f"Create a detailed {element.replace('_', ' ')} for the following game concept: {user_prompt}"
+            fingerprints[f"element:{element}"] = fingerprint(customization['chat_model'], prompt)
+    concept = fingerprints.get('element:game_concept', '')
+    wants_assets = image_jobs(customization) or customization['use_replicate']['generate_music']
+    if concept and wants_assets and customization.get('design_brief', True):
+        fingerprints['brief'] = fingerprint(
+            customization['chat_model'], design_brief.brief_request(''), design_brief.BRIEF_FIELDS, concept
+        )
+        concept = fingerprint(
+            fingerprints['brief'], design_brief.ASSET_FIELDS,
+            customization.get('prompt_budget', design_brief.DEFAULT_PROMPT_BUDGET)
+        )
+    for key, img_type, i in image_jobs(customization):
+        fingerprints[f"image:{key}"] = fingerprint(
+            customization['image_model'], IMAGE_PROMPTS[img_type], IMAGE_SIZES[img_type], i, concept
+        )
+    for file_name, script_type, code_type in script_jobs(customization):
+        fingerprints[f"script:{file_name}"] = fingerprint(
+            customization['code_model'], SCRIPT_DESCRIPTIONS[script_type], code_type,
+            customization.get('validate_scripts', True)
+        )
+    if customization['use_replicate']['generate_music']:
+        fingerprints['music'] = fingerprint('musicgen', concept)
+    return fingerprints
+
+# Values from a previous plan that can stand in for nodes whose
+# fingerprint has not changed. Failed nodes always run again, and so do
+# assets that are no longer in the asset store, since provider URLs expire.
+def reusable_values(previous, fingerprints):
+    old_fingerprints = (previous or {}).get('fingerprints', {})
+    store = asset_store.get_store()
+    reused = {}
+    for node, node_fingerprint in fingerprints.items():
+        if old_fingerprints.get(node) != node_fingerprint:
+            continue
+        value = get_plan_value(previous, node)
+        if value is None or (isinstance(value, str) and value.startswith('Error')):
+            continue
+        if node.startswith(('image:', 'music')) and value.startswith('http') and value not in store:
+            continue
+        reused[node] = value
+    # Anything built from a concept or brief that runs again runs again too
+    for upstream in ('element:game_concept', 'brief'):
+        if upstream in fingerprints and upstream not in reused:
+            reused = {node: value for node, value in reused.items() if not node.startswith(('brief', 'image:', 'music'))}
+    return reused
+
+# Generate a complete game plan.
+# Every element, image variation, script and the music track is a task in a
+# dependency graph. The game concept is condensed into a design brief once,
+# and only images and music wait for it; they get just the fields they need.
+# Each node's fingerprint is stored in game_plan['fingerprints']; given the
+# previous plan, nodes whose fingerprint is unchanged reuse its values.
+# Callbacks all run on the calling thread:
+#   on_status(message, progress) reports overall progress,
+#   on_stream(key, text) receives the text streamed so far for a task,
+#   on_result(key, value) is called as each task finishes.
+# initializer runs in every worker thread before it starts.
+def generate_game_plan(ctx, user_prompt, on_status=None, on_stream=None, on_result=None, initializer=None, previous=None):
+    customization = ctx.customization
+
+    def update_status(message, progress):
+        if on_status:
+            on_status(message, progress)
+
+    streaming = customization.get('stream_output', True) and on_stream is not None
+    buffers = StreamBuffers()
+
+    def writer(key, replace=False):
+        return buffers.writer(key, replace) if streaming else None
+
+    fingerprints = plan_fingerprints(customization, user_prompt)
+    reused = reusable_values(previous, fingerprints) if customization.get('reuse_results', True) else {}
+    skip = {node.partition(':')[2] for node in reused}
+
+    # The plan's own provider limits only cap this graph; the shared
+    # limiter's maximums are the fair-share budgets
+    provider_limits = customization.get('provider_limits') or DEFAULT_PROVIDER_LIMITS
+
+    # Each task is tagged with the backend that serves it, so backends
+    # with their own concurrency limit are held to it
+    chat_backend = providers.get('chat', customization['chat_model'])
+    image_backend = providers.get('image', customization['image_model'])
+    code_backend = providers.get('code', customization['code_model'])
+    backends = [b for b in (chat_backend, image_backend, code_backend) if b is not None]
+    graph = TaskGraph(
+        max_workers=customization.get('max_workers', DEFAULT_MAX_WORKERS),
+        provider_limits=provider_limits,
+        initializer=initializer,
+        limiter=retry.get_limiter(),
+        backend_limits={b.key: b.max_concurrency for b in backends if b.max_concurrency}
+    )
+    chat_task = {'provider': chat_backend.provider, 'backend': chat_backend.key} if chat_backend else {}
+    image_task = {'provider': image_backend.provider, 'backend': image_backend.key} if image_backend else {}
+    code_task = {'provider': code_backend.provider, 'backend': code_backend.key} if code_backend else {}
+
+    # Generate game elements
+    for element, should_generate in customization['generate_elements'].items():
+        if should_generate and f"element:{element}" not in reused:
+            key = ('element', element)
+            prompt = f"Create a detailed {element.replace('_', ' ')} for the following game concept: {user_prompt}"
+            graph.add(key, lambda p=prompt, w=writer(key): generate_content(ctx, p, "game design", on_token=w), **chat_task)
+
+    # Assets wait for the game concept or its design brief, unless that is
+    # reused as it is
+    concept_deps = [('element', 'game_concept')] if ('element', 'game_concept') in graph.tasks else []
+    asset_deps = concept_deps
+    asset_source = reused.get('element:game_concept', '')
+    if 'brief' in reused:
+        asset_deps, asset_source = [], reused['brief']
+    elif 'brief' in fingerprints:
+        asset_deps = [graph.add(
+            ('brief', 'design_brief'),
+            lambda concept=asset_source: generate_design_brief(ctx, concept),
+            deps=concept_deps, **chat_task
+        )]
+
+    # Generate images
+    fanout = image_backend is not None and image_fanout(customization, image_backend)
+    for img_type, jobs in image_batches(customization, skip):
+        graph.add(
+            ('images', tuple(key for key, i in jobs)),
+            lambda source=asset_source, t=img_type, j=jobs: generate_image_group(ctx, t, j, asset_context(ctx, source, t)),
+            deps=asset_deps, slots=len(jobs) if fanout else 1, **image_task
+        )
+
+    # Generate scripts
+    code_model = customization['code_model']
+    for script_type, engines in script_groups(customization, skip):
+        if customization.get('combine_engines', True) and len(engines) > 1:
+            key = ('scripts', tuple(file_name for file_name, code_type in engines))
+            graph.add(
+                key,
+                lambda s=script_type, e=engines, w=writer(key, replace=True): generate_script_group(ctx, s, e, code_model, on_show=w),
+                deps=(), **code_task
+            )
+            continue
+        for file_name, code_type in engines:
+            key = ('script', file_name)
+            graph.add(
+                key,
+                lambda s=script_type, c=code_type, w=writer(key): generate_script(ctx, s, c, code_model, on_token=w),
+                deps=(), **code_task
+            )
+
+    # Optional: Generate music
+    if customization['use_replicate']['generate_music'] and 'music' not in reused:
+        graph.add(
+            ('music', 'music'),
+            lambda source=asset_source: generate_music(ctx, f"Create background music for the game: {asset_context(ctx, source, 'music')}"),
+            deps=asset_deps, provider=providers.get('music', 'musicgen').provider
+        )
+
+    total = len(graph)
+    finished = {}
+    prefetcher = prefetch.get_prefetcher() if customization.get('prefetch_assets', True) else None
+    downloads = {}
+
+    def on_tick():
+        for key, text in buffers.drain().items():
+            on_stream(key, text)
+
+    def on_complete(key, result, error):
+        kind, name = key
+        finished[key] = f"Error: {str(error)}" if error is not None else result
+        if on_result:
+            on_result(key, finished[key])
+        # Start downloading generated assets while their URLs are fresh
+        if prefetcher:
+            for url in asset_urls(key, result):
+                downloads[url] = prefetcher.prefetch(url)
+        label = ', '.join(name) if isinstance(name, tuple) else name.replace('_', ' ')
+        update_status(f"Finished {kind} {label} ({len(finished)}/{total})", len(finished) / total)
+
+    if reused:
+        update_status(f"Reusing {len(reused)} unchanged items, generating {total} items...", 0.0)
+    else:
+        update_status(f"Generating {total} items...", 0.0)
+    if total:
+        graph.run(on_complete=on_complete, on_tick=on_tick if streaming else None)
+
+    if prefetcher:
+        update_status("Downloading generated assets...", 1.0)
+        for url, error in prefetcher.wait(downloads).items():
+            ctx.warn(f"Unable to download {url}: {str(error)}")
+
+    # Put reused and new results in the order they were requested
+    values = dict(reused)
+    for key, value in finished.items():
+        values.update(node_values(key, value))
+    game_plan = {}
+    for node in fingerprints:
+        if node in values:
+            set_plan_value(game_plan, node, values[node])
+    game_plan['fingerprints'] = fingerprints
+    if ctx.prompt_savings():
+        game_plan['prompt_savings'] = ctx.prompt_savings()
+    if ctx.script_checks():
+        game_plan['script_checks'] = ctx.script_checks()
+
+    update_status("Game plan generation complete!", 1.0)
+
+    return game_plan
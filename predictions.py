@@ -0,0 +1,337 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import retry
+
+# Defaults for the prediction manager
+DEFAULT_POLL_INTERVAL = 0.5
+DEFAULT_MAX_POLL_INTERVAL = 5.0
+DEFAULT_TIMEOUT = 900
+DEFAULT_MAX_IN_FLIGHT = 256
+DEFAULT_HTTP_CONCURRENCY = 16
+# Seconds Replicate may hold the create request open for the prediction
+# to finish ('Prefer: wait'); 0 disables
+DEFAULT_CREATE_WAIT = 5
+
+
+# Raised for a prediction that failed or was canceled on Replicate
+class PredictionError(Exception):
+    def __init__(self, message, prediction_id=None, status=None):
+        super().__init__(message)
+        self.prediction_id = prediction_id
+        self.status = status
+
+
+# Raised for a prediction that did not finish within its timeout; it is
+# canceled on Replicate
+class PredictionDeadlineExceeded(PredictionError):
+    pass
+
+
+# One submitted prediction and where it is in its life
+class _Tracked:
+    __slots__ = ('future', 'client', 'ref', 'input', 'label', 'deadline', 'id', 'next_poll', 'interval', 'poll_errors')
+
+    def __init__(self, future, client, ref, input, label, deadline, interval):
+        self.future = future
+        self.client = client
+        self.ref = ref
+        self.input = input
+        self.label = label
+        self.deadline = deadline
+        self.id = None
+        self.next_poll = 0.0
+        self.interval = interval
+        self.poll_errors = 0
+
+
+# Receives Replicate webhooks and hands each prediction to the manager
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        manager = self.server.manager
+        if manager.webhook_secret:
+            from replicate.webhook import Webhooks, WebhookSigningSecret, WebhookValidationError
+            try:
+                Webhooks.validate(headers=dict(self.headers), body=body, secret=WebhookSigningSecret(key=manager.webhook_secret))
+            except WebhookValidationError:
+                self.send_response(401)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        try:
+            manager.deliver(json.loads(body))
+            status = 200
+        except ValueError:
+            status = 400
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+# Creates Replicate predictions and polls every one of them from a single
+# event loop thread, instead of each client.run call polling on its own.
+# Callers of run() still block on the result; submit() lets one thread
+# wait on several predictions.
+# submit() returns a Future for the prediction's output; cancelling the
+# future cancels the prediction, and each prediction has a timeout counted
+# from submission. Replicate holds each create open for up to create_wait
+# seconds, so a fast prediction finishes without being polled. With a
+# webhook_url (a public URL that reaches webhook_port), completions arrive
+# by webhook and polling slows to a fallback.
+class PredictionManager:
+    def __init__(self, poll_interval=DEFAULT_POLL_INTERVAL, max_poll_interval=DEFAULT_MAX_POLL_INTERVAL,
+                 timeout=DEFAULT_TIMEOUT, max_in_flight=DEFAULT_MAX_IN_FLIGHT, http_concurrency=DEFAULT_HTTP_CONCURRENCY,
+                 create_wait=DEFAULT_CREATE_WAIT, webhook_url=None, webhook_port=None, webhook_host='0.0.0.0', webhook_secret=None):
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.http_concurrency = http_concurrency
+        self.create_wait = create_wait
+        self.webhook_url = webhook_url.rstrip('/') if webhook_url else None
+        self.webhook_secret = webhook_secret
+        self._webhook_address = (webhook_host, webhook_port) if webhook_url and webhook_port else None
+        self._webhook_server = None
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._wake = None
+        self._http = None
+        self._queued = deque()
+        self._creating = 0
+        self._active = {}
+        self._counts = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'canceled': 0, 'timed_out': 0, 'polls': 0, 'webhooks': 0}
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            ready = threading.Event()
+            self._thread = threading.Thread(target=self._run_loop, args=(ready,), name='prediction-manager', daemon=True)
+            self._thread.start()
+            ready.wait()
+            if self._webhook_address:
+                self._webhook_server = ThreadingHTTPServer(self._webhook_address, _WebhookHandler)
+                self._webhook_server.daemon_threads = True
+                self._webhook_server.manager = self
+                threading.Thread(target=self._webhook_server.serve_forever, name='prediction-webhooks', daemon=True).start()
+
+    def _run_loop(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wake = asyncio.Event()
+        self._http = asyncio.Semaphore(self.http_concurrency)
+        ready.set()
+        self._loop.run_until_complete(self._main())
+
+    # Start a prediction for ref ('owner/name' or 'owner/name:version') and
+    # return a Future that resolves to its output
+    def submit(self, client, ref, input, label='', timeout=None):
+        self._start()
+        future = Future()
+        future.prediction_id = None
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        tracked = _Tracked(future, client, ref, input, label or ref, deadline, self.poll_interval)
+        future.add_done_callback(lambda f: f.cancelled() and self._loop.call_soon_threadsafe(self._wake.set))
+        with self._lock:
+            self._counts['submitted'] += 1
+        self._loop.call_soon_threadsafe(self._enqueue, tracked)
+        return future
+
+    # Run a prediction and wait for its output
+    def run(self, client, ref, input, label='', timeout=None):
+        return self.submit(client, ref, input, label, timeout).result()
+
+    # Accept a prediction delivered by webhook (called from any thread)
+    def deliver(self, prediction):
+        if not isinstance(prediction, dict) or 'id' not in prediction:
+            raise ValueError("Webhook body is not a prediction")
+        self._start()
+        with self._lock:
+            self._counts['webhooks'] += 1
+        self._loop.call_soon_threadsafe(self._on_update, prediction)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        counts['queued'] = len(self._queued)
+        counts['active'] = len(self._active) + self._creating
+        return counts
+
+    def _enqueue(self, tracked):
+        self._queued.append(tracked)
+        self._wake.set()
+
+    def _finish(self, tracked, outcome, result=None, error=None):
+        if tracked.id is not None:
+            self._active.pop(tracked.id, None)
+        with self._lock:
+            self._counts[outcome] += 1
+        try:
+            if error is not None:
+                tracked.future.set_exception(error)
+            elif outcome == 'succeeded':
+                tracked.future.set_result(result)
+        except InvalidStateError:
+            # Cancelled by the caller meanwhile
+            pass
+        self._wake.set()
+
+    # Apply a prediction state from a poll or a webhook
+    def _on_update(self, prediction):
+        tracked = self._active.get(prediction.get('id'))
+        if tracked is None:
+            return
+        status = prediction.get('status')
+        if status == 'succeeded':
+            self._finish(tracked, 'succeeded', result=prediction.get('output'))
+        elif status in ('failed', 'canceled'):
+            message = prediction.get('error') or f"Prediction {tracked.id} {status}"
+            self._finish(tracked, 'failed' if status == 'failed' else 'canceled', error=PredictionError(str(message), tracked.id, status))
+        else:
+            tracked.next_poll = time.monotonic() + tracked.interval
+            tracked.interval = min(self.max_poll_interval, tracked.interval * 1.5)
+
+    async def _main(self):
+        while True:
+            now = time.monotonic()
+            while self._queued and len(self._active) + self._creating < self.max_in_flight:
+                tracked = self._queued.popleft()
+                if tracked.future.cancelled():
+                    continue
+                self._creating += 1
+                self._loop.create_task(self._create(tracked))
+
+            next_wake = now + self.max_poll_interval
+            for tracked in list(self._active.values()):
+                if tracked.future.cancelled():
+                    self._active.pop(tracked.id, None)
+                    with self._lock:
+                        self._counts['canceled'] += 1
+                    self._loop.create_task(self._cancel(tracked))
+                elif now >= tracked.deadline:
+                    self._loop.create_task(self._cancel(tracked))
+                    self._finish(tracked, 'timed_out', error=PredictionDeadlineExceeded(
+                        f"Prediction {tracked.id} did not finish in time", tracked.id, 'timed_out'
+                    ))
+                elif tracked.next_poll is not None and tracked.next_poll <= now:
+                    tracked.next_poll = None
+                    self._loop.create_task(self._poll(tracked))
+                elif tracked.next_poll is not None:
+                    next_wake = min(next_wake, tracked.next_poll, tracked.deadline)
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(0.01, next_wake - time.monotonic()))
+            except asyncio.TimeoutError:
+                pass
+
+    # Create the prediction, retrying rate limits and server errors
+    async def _create(self, tracked):
+        params = {'input': tracked.input}
+        owner_name, _, version = tracked.ref.partition(':')
+        if version:
+            params['version'] = version
+            create = tracked.client.predictions.async_create
+        else:
+            # Predictions.async_create drops wait for models
+            params['model'] = owner_name
+            create = tracked.client.models.predictions.async_create
+        if self.webhook_url:
+            params['webhook'] = f"{self.webhook_url}/prediction"
+            params['webhook_events_filter'] = ['completed']
+        elif self.create_wait:
+            params['wait'] = self.create_wait
+
+        waited = 0.0
+        try:
+            for attempt in range(1, retry.DEFAULT_MAX_ATTEMPTS + 1):
+                try:
+                    async with self._http:
+                        prediction = await create(**params)
+                    break
+                except Exception as e:
+                    retryable, status, retry_after = retry.classify(e)
+                    if status == 429:
+                        retry.get_limiter().on_throttle('replicate')
+                        retry.get_stats().throttled('replicate')
+                    if not retryable or attempt == retry.DEFAULT_MAX_ATTEMPTS or tracked.future.cancelled():
+                        retry.get_stats().record('replicate', tracked.label, attempt, waited, False, status)
+                        self._finish(tracked, 'failed', error=e)
+                        return
+                    delay = random.uniform(0, min(retry.DEFAULT_MAX_DELAY, retry.DEFAULT_BASE_DELAY * 2 ** (attempt - 1)))
+                    if retry_after is not None:
+                        delay = max(delay, min(retry_after, retry.DEFAULT_MAX_DELAY))
+                    await asyncio.sleep(delay)
+                    waited += delay
+            retry.get_limiter().on_success('replicate')
+            retry.get_stats().record('replicate', tracked.label, attempt, waited, True)
+        finally:
+            self._creating -= 1
+
+        tracked.id = tracked.future.prediction_id = prediction.id
+        self._active[tracked.id] = tracked
+        if self.webhook_url:
+            # Polling is only a fallback for lost webhooks
+            tracked.interval = self.max_poll_interval
+        self._on_update(prediction.dict())
+        self._wake.set()
+
+    async def _poll(self, tracked):
+        try:
+            async with self._http:
+                prediction = await tracked.client.predictions.async_get(tracked.id)
+            with self._lock:
+                self._counts['polls'] += 1
+        except Exception as e:
+            tracked.poll_errors += 1
+            retryable, status, retry_after = retry.classify(e)
+            if not retryable or tracked.poll_errors >= retry.DEFAULT_MAX_ATTEMPTS:
+                self._finish(tracked, 'failed', error=e)
+                return
+            tracked.next_poll = time.monotonic() + max(tracked.interval, retry_after or 0)
+            self._wake.set()
+            return
+        tracked.poll_errors = 0
+        self._on_update(prediction.dict())
+        self._wake.set()
+
+    async def _cancel(self, tracked):
+        try:
+            async with self._http:
+                await tracked.client.predictions.async_cancel(tracked.id)
+        except Exception:
+            # Best effort; the prediction is no longer tracked either way
+            pass
+
+
+_default_manager = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide prediction manager. Webhooks are used when
+# GAME_MAKER_WEBHOOK_URL (a public URL) and GAME_MAKER_WEBHOOK_PORT (the
+# local port it reaches) are set; REPLICATE_WEBHOOK_SECRET enables
+# signature checks.
+def get_manager():
+    global _default_manager
+    with _default_lock:
+        if _default_manager is None:
+            port = os.environ.get('GAME_MAKER_WEBHOOK_PORT')
+            _default_manager = PredictionManager(
+                webhook_url=os.environ.get('GAME_MAKER_WEBHOOK_URL'),
+                webhook_port=int(port) if port else None,
+                webhook_secret=os.environ.get('REPLICATE_WEBHOOK_SECRET'),
+            )
+        return _default_manager
@@ -0,0 +1,129 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+
+import http_pool
+import tracing
+
+# Defaults for background asset downloads
+DEFAULT_WORKERS = 4
+DEFAULT_RETRIES = 3
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_TIMEOUT = 60
+CHUNK_SIZE = 256 * 1024
+
+
+# Raised when an asset is larger than the configured limit
+class AssetTooLarge(Exception):
+    pass
+
+
+# Downloads generated asset URLs into an asset store in the background,
+# as soon as they are known, so short-lived URLs are captured before they
+# expire. Interrupted downloads resume with a Range request.
+class Prefetcher:
+    def __init__(self, store, workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES,
+                 max_bytes=DEFAULT_MAX_BYTES, timeout=DEFAULT_TIMEOUT):
+        self.store = store
+        self.retries = retries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='prefetch')
+        # Downloads in flight; each is dropped when it finishes
+        self._futures = {}
+        self._counts = {'done': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    # Start downloading a URL unless it is stored or already in flight, and
+    # return the download's future
+    def prefetch(self, url):
+        if not isinstance(url, str) or not url.startswith('http'):
+            return None
+        with self._lock:
+            future = self._futures.get(url)
+            if future is not None:
+                return future
+            future = self._futures[url] = self._pool.submit(self._download, url)
+        future.add_done_callback(lambda future: self._finished(url, future))
+        return future
+
+    def _finished(self, url, future):
+        with self._lock:
+            if self._futures.get(url) is future:
+                del self._futures[url]
+            self._counts['failed' if future.exception() is not None else 'done'] += 1
+
+    # Wait for downloads ({url: future}, as returned by prefetch) and
+    # return {url: error}
+    def wait(self, futures, timeout=None):
+        futures = {u: f for u, f in futures.items() if f is not None}
+        wait(list(futures.values()), timeout=timeout)
+        return {u: f.exception() for u, f in futures.items() if f.done() and f.exception() is not None}
+
+    def _download(self, url):
+        with self.store.url_lock(url):
+            if url in self.store:
+                return
+            fd, path = tempfile.mkstemp(dir=self.store.spill_dir)
+            os.close(fd)
+            try:
+                with tracing.span('prefetch', 'download', url=url) as span:
+                    span.set(bytes_received=self._download_to(url, path))
+            except BaseException:
+                os.remove(path)
+                raise
+            self.store.adopt(url, path)
+
+    def _download_to(self, url, path):
+        received = 0
+        for attempt in range(self.retries + 1):
+            headers = {'Range': f"bytes={received}-"} if received else {}
+            try:
+                with http_pool.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    if received and response.status_code != 206:
+                        # The server ignored the range; start over
+                        received = 0
+                    length = response.headers.get('Content-Length')
+                    if length is not None and received + int(length) > self.max_bytes:
+                        raise AssetTooLarge(f"{url} is {received + int(length)} bytes (limit {self.max_bytes})")
+                    with open(path, 'ab' if received else 'wb') as file:
+                        for chunk in response.iter_content(CHUNK_SIZE):
+                            received += len(chunk)
+                            if received > self.max_bytes:
+                                raise AssetTooLarge(f"{url} exceeds {self.max_bytes} bytes")
+                            file.write(chunk)
+                return received
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                if attempt == self.retries or (status is not None and status < 500 and status not in (408, 429)):
+                    raise
+                tracing.add(retries=1)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+                tracing.add(retries=1)
+            time.sleep(min(30, 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def stats(self):
+        with self._lock:
+            return {'queued': len(self._futures), **self._counts}
+
+
+_default_prefetcher = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide prefetcher for the shared asset store
+def get_prefetcher():
+    global _default_prefetcher
+    with _default_lock:
+        if _default_prefetcher is None:
+            import asset_store
+            _default_prefetcher = Prefetcher(asset_store.get_store())
+        return _default_prefetcher
@@ -0,0 +1,273 @@
+import difflib
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+
+import pipeline
+import response_cache
+import tracing
+
+# Defaults for the project store
+DEFAULT_PROJECT_DB = os.path.join(response_cache.DEFAULT_CACHE_DIR, 'projects.sqlite3')
+DEFAULT_BLOB_DIR = os.path.join(response_cache.DEFAULT_CACHE_DIR, 'blobs')
+
+# Plan keys kept alongside the nodes, which are stored as blobs
+PLAN_EXTRAS = ('fingerprints', 'prompt_savings', 'script_checks', 'additional_elements')
+
+
+def _dump(value):
+    return json.dumps(value, default=str)
+
+
+def _node_kind(node, value):
+    if node.startswith('image:') and isinstance(value, str) and value.startswith('http'):
+        return 'image'
+    if node == 'music' and isinstance(value, str) and value.startswith('http'):
+        return 'audio'
+    return 'text' if isinstance(value, str) else 'json'
+
+
+# Every (node, value) in a finished game plan, as named by plan_fingerprints
+def plan_nodes(game_plan):
+    nodes = list(game_plan.get('fingerprints') or [])
+    nodes += [f"image:{name}" for name in game_plan.get('images', {}) if f"image:{name}" not in nodes]
+    nodes += [f"script:{name}" for name in game_plan.get('scripts', {}) if f"script:{name}" not in nodes]
+    if 'music' not in nodes and game_plan.get('music'):
+        nodes.append('music')
+    values = [(node, pipeline.get_plan_value(game_plan, node)) for node in nodes]
+    return [(node, value) for node, value in values if value is not None]
+
+
+# Saved game plans. SQLite holds each project's prompt, models and
+# customization and maps every plan node (element, image, script, music)
+# to a blob. Blobs are files named by the SHA-256 of their content, so an
+# asset or script shared by several projects is stored once.
+class ProjectStore:
+    def __init__(self, path=DEFAULT_PROJECT_DB, blob_dir=DEFAULT_BLOB_DIR):
+        self.blob_dir = blob_dir
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # Blobs written by saves that have not recorded their nodes yet
+        self._pending = Counter()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS projects ("
+            "id TEXT PRIMARY KEY, name TEXT NOT NULL, prompt TEXT NOT NULL, customization TEXT NOT NULL, "
+            "chat_model TEXT, image_model TEXT, code_model TEXT, extras TEXT NOT NULL, created REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS project_nodes ("
+            "project_id TEXT NOT NULL, node TEXT NOT NULL, position INTEGER NOT NULL, kind TEXT NOT NULL, "
+            "digest TEXT NOT NULL, size INTEGER NOT NULL, url TEXT, PRIMARY KEY (project_id, node));"
+            "CREATE INDEX IF NOT EXISTS project_nodes_digest ON project_nodes (digest);"
+            "CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, created REAL NOT NULL);"
+        )
+        self._conn.commit()
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    # Store bytes under their hash, unless a blob with that hash exists
+    def put_blob(self, data):
+        with self._lock:
+            return self._put_blob(data)
+
+    # The lock is held from the existence check to the blob row, so
+    # delete() cannot remove the file in between
+    def _put_blob(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        self._conn.execute("INSERT OR IGNORE INTO blobs (digest, size, created) VALUES (?, ?, ?)", (digest, len(data), time.time()))
+        self._conn.commit()
+        return digest
+
+    def read_blob(self, digest):
+        with open(self.blob_path(digest), 'rb') as file:
+            return file.read()
+
+    # Save a finished game plan and return the project id. Images and
+    # music are taken from asset_store, downloading any it does not hold;
+    # one that cannot be downloaded is saved as its URL, and its error is
+    # passed to on_error. Blobs stay pending, safe from delete(), until
+    # the project's nodes refer to them.
+    def save(self, game_plan, prompt, customization, asset_store, project_id=None, name=None, on_error=None):
+        project_id = project_id or uuid.uuid4().hex[:12]
+        rows = []
+        try:
+            with tracing.span('save_project', 'projects', project=project_id) as span:
+                for position, (node, value) in enumerate(plan_nodes(game_plan)):
+                    kind = _node_kind(node, value)
+                    data = None
+                    if kind in ('image', 'audio'):
+                        try:
+                            data = asset_store.fetch(value)
+                            url = value
+                        except requests.RequestException as e:
+                            kind = 'text'
+                            if on_error:
+                                on_error(f"Unable to save {node} in the project: {str(e)}")
+                    if data is None:
+                        data = (value if kind == 'text' else _dump(value)).encode('utf-8')
+                        url = None
+                    with self._lock:
+                        digest = self._put_blob(data)
+                        self._pending[digest] += 1
+                    rows.append((project_id, node, position, kind, digest, len(data), url))
+                span.set(nodes=len(rows), bytes=sum(row[5] for row in rows))
+            extras = {key: game_plan[key] for key in PLAN_EXTRAS if key in game_plan}
+            with self._lock:
+                self._conn.execute("DELETE FROM project_nodes WHERE project_id = ?", (project_id,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO projects (id, name, prompt, customization, chat_model, image_model, code_model, extras, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        project_id, name or ' '.join(prompt.split())[:60] or project_id, prompt, _dump(customization),
+                        customization.get('chat_model'), customization.get('image_model'), customization.get('code_model'),
+                        _dump(extras), time.time()
+                    )
+                )
+                self._conn.executemany(
+                    "INSERT INTO project_nodes (project_id, node, position, kind, digest, size, url) VALUES (?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self._conn.commit()
+        finally:
+            with self._lock:
+                self._pending.subtract(row[4] for row in rows)
+                # Drop the counts that reached zero
+                self._pending += Counter()
+        return project_id
+
+    def get(self, project_id):
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,))
+            row = cursor.fetchone()
+            columns = [column[0] for column in cursor.description]
+        if row is None:
+            return None
+        project = dict(zip(columns, row))
+        project['customization'] = json.loads(project['customization'])
+        project['extras'] = json.loads(project['extras'])
+        return project
+
+    # (node, kind, digest, size, url) of each node in a project, in plan order
+    def nodes(self, project_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT node, kind, digest, size, url FROM project_nodes WHERE project_id = ? ORDER BY position", (project_id,)
+            ).fetchall()
+
+    # Rebuild a project's game plan without any API calls. Image and music
+    # blobs are attached to asset_store under their original URLs, so they
+    # are read from the blob directory instead of downloaded.
+    def load(self, project_id, asset_store):
+        project = self.get(project_id)
+        if project is None:
+            return None
+        game_plan = {}
+        with tracing.span('load_project', 'projects', project=project_id):
+            for node, kind, digest, size, url in self.nodes(project_id):
+                if kind in ('image', 'audio'):
+                    asset_store.attach(url, self.blob_path(digest))
+                    value = url
+                else:
+                    text = self.read_blob(digest).decode('utf-8')
+                    value = text if kind == 'text' else json.loads(text)
+                pipeline.set_plan_value(game_plan, node, value)
+        game_plan.update(project['extras'])
+        return game_plan
+
+    def recent(self, limit=20):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT p.id, p.name, p.chat_model, p.image_model, p.code_model, p.created, COUNT(n.node), COALESCE(SUM(n.size), 0) "
+                "FROM projects p LEFT JOIN project_nodes n ON n.project_id = p.id "
+                "GROUP BY p.id ORDER BY p.created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        columns = ('id', 'name', 'chat_model', 'image_model', 'code_model', 'created', 'nodes', 'bytes')
+        return [dict(zip(columns, row)) for row in rows]
+
+    # Compare two projects node by node. Returns [(node, status, kind)]
+    # with status 'added', 'removed', 'changed' or 'same', comparing hashes
+    # only.
+    def diff(self, old_id, new_id):
+        old = {node: (kind, digest) for node, kind, digest, size, url in self.nodes(old_id)}
+        new = {node: (kind, digest) for node, kind, digest, size, url in self.nodes(new_id)}
+        changes = []
+        for node in list(old) + [node for node in new if node not in old]:
+            if node not in new:
+                changes.append((node, 'removed', old[node][0]))
+            elif node not in old:
+                changes.append((node, 'added', new[node][0]))
+            else:
+                changes.append((node, 'same' if old[node][1] == new[node][1] else 'changed', new[node][0]))
+        return changes
+
+    # Unified diff of one text node between two projects
+    def diff_text(self, old_id, new_id, node):
+        texts = []
+        for project_id in (old_id, new_id):
+            digest = next((digest for name, kind, digest, size, url in self.nodes(project_id) if name == node), None)
+            texts.append(self.read_blob(digest).decode('utf-8') if digest else '')
+        return ''.join(difflib.unified_diff(
+            texts[0].splitlines(keepends=True), texts[1].splitlines(keepends=True),
+            fromfile=f"{old_id}/{node}", tofile=f"{new_id}/{node}"
+        ))
+
+    # Build the ZIP package for a project from its stored blobs
+    def build_package(self, project_id, asset_store):
+        import exporter
+        game_plan = self.load(project_id, asset_store)
+        return exporter.build_package(game_plan, asset_store, self.get(project_id)['customization'])
+
+    # Delete a project and every blob no other project uses
+    def delete(self, project_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM project_nodes WHERE project_id = ?", (project_id,))
+            self._conn.execute("DELETE FROM projects WHERE id = ?", (project_id,))
+            unused = [row[0] for row in self._conn.execute(
+                "SELECT digest FROM blobs WHERE digest NOT IN (SELECT digest FROM project_nodes)"
+            ).fetchall()]
+            unused = [digest for digest in unused if not self._pending[digest]]
+            self._conn.executemany("DELETE FROM blobs WHERE digest = ?", [(digest,) for digest in unused])
+            self._conn.commit()
+            for digest in unused:
+                try:
+                    os.remove(self.blob_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    # Project and blob counts; bytes_saved is what deduplication avoids storing
+    def stats(self):
+        with self._lock:
+            projects = self._conn.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+            blobs, stored = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            referenced = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM project_nodes").fetchone()[0]
+        return {'projects': projects, 'blobs': blobs, 'bytes': stored, 'bytes_saved': max(0, referenced - stored)}
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide project store
+def get_store():
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = ProjectStore()
+        return _default_store
@@ -0,0 +1,97 @@
+import importlib
+import math
+
+# Replicate model versions
+LLAMA_MODEL = "meta/llama-2-70b-chat:02e509c789964a7ea8736978a43525956ef40397be9033abf9fd2badfe68c9e3"
+FLUX_MODEL = "black-forest-labs/flux-pro"
+SDXL_LIGHTNING_MODEL = "bytedance/sdxl-lightning-4step:5f24084160c9089501c1b3545d9be3c27883ae2239b6f412990e82d4a6210f8f"
+MUSICGEN_MODEL = "meta/musicgen:671ac645ce5e552cc63a54a2bbff63fcf798043055d2dac5fc9e36a837eedcfb"
+
+
+# A model the app can generate with and what it supports:
+#   streaming        tokens can be passed on as they are generated
+#   batch_size       outputs one request can return
+#   fanout           outputs one task may request as concurrent predictions
+#                    when the prediction manager is on
+#   max_concurrency  requests in flight at once, on top of the provider limit
+#   sizes            (width, height) sizes it can produce; empty means any
+# The function that calls it is named as 'module:function' and is only
+# imported the first time the backend is used. It is called as
+# function(ctx, backend, *args).
+class Backend:
+    def __init__(self, name, kind, provider, entry, model=None, streaming=False, batch_size=1, fanout=1,
+                 max_concurrency=None, sizes=()):
+        self.name = name
+        self.kind = kind
+        self.provider = provider
+        self.entry = entry
+        self.model = model or name
+        self.streaming = streaming
+        self.batch_size = batch_size
+        self.fanout = fanout
+        self.max_concurrency = max_concurrency
+        self.sizes = tuple(sizes)
+        self._function = None
+
+    @property
+    def key(self):
+        return f"{self.kind}:{self.name}"
+
+    def load(self):
+        if self._function is None:
+            module, _, function = self.entry.partition(':')
+            self._function = getattr(importlib.import_module(module), function)
+        return self._function
+
+    def __call__(self, ctx, *args, **kwargs):
+        return self.load()(ctx, self, *args, **kwargs)
+
+    # Most outputs one generation task should ask this backend for
+    def batch_limit(self, customization):
+        if self.fanout > 1 and customization.get('prediction_manager', True):
+            return self.fanout
+        return self.batch_size
+
+    # The supported size closest in aspect ratio, then area, to size
+    def fit_size(self, size):
+        if not self.sizes:
+            return size
+        width, height = size
+        return min(self.sizes, key=lambda s: (abs(math.log((s[0] / s[1]) / (width / height))), abs(s[0] * s[1] - width * height)))
+
+
+BACKENDS = [
+    Backend('gpt-4o', 'chat', 'openai', 'openai_backends:chat', streaming=True),
+    Backend('gpt-4o-mini', 'chat', 'openai', 'openai_backends:chat', streaming=True),
+    Backend('gpt-4', 'chat', 'openai', 'openai_backends:chat', streaming=True),
+    Backend('llama', 'chat', 'replicate', 'replicate_backends:llama_chat', model=LLAMA_MODEL, streaming=True),
+    Backend('dall-e-3', 'image', 'openai', 'openai_backends:dalle_images', max_concurrency=4,
+            sizes=[(1024, 1024), (1792, 1024), (1024, 1792)]),
+    Backend('SD Flux-1', 'image', 'replicate', 'replicate_backends:flux_images', model=FLUX_MODEL, fanout=8),
+    Backend('SDXL Lightning', 'image', 'replicate', 'replicate_backends:sdxl_images', model=SDXL_LIGHTNING_MODEL, batch_size=4),
+    Backend('gpt-4o', 'code', 'openai', 'openai_backends:code', streaming=True),
+    Backend('gpt-4o-mini', 'code', 'openai', 'openai_backends:code', streaming=True),
+    Backend('llama', 'code', 'replicate', 'replicate_backends:llama_code', model=LLAMA_MODEL, streaming=True),
+    Backend('musicgen', 'music', 'replicate', 'replicate_backends:musicgen', model=MUSICGEN_MODEL),
+]
+
+# Model used for each kind when none is chosen
+DEFAULT_MODELS = {'chat': 'gpt-4o-mini', 'image': 'dall-e-3', 'code': 'gpt-4o-mini', 'music': 'musicgen'}
+
+_registry = {backend.key: backend for backend in BACKENDS}
+
+
+# Add a backend, replacing any of the same kind and name
+def register(backend):
+    _registry[backend.key] = backend
+
+
+# The backend for a kind ('chat', 'image', 'code' or 'music') and model
+# name, or None if there is none
+def get(kind, name):
+    return _registry.get(f"{kind}:{name}")
+
+
+# Names of every backend of a kind, in registration order
+def names(kind):
+    return [backend.name for backend in _registry.values() if backend.kind == kind]
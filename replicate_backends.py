@@ -0,0 +1,173 @@
+import design_brief
+import http_pool
+import predictions
+import retry
+import tracing
+from pipeline import cached_response, stream_with_retry
+
+# Replicate backends for the provider registry, imported the first time one
+# is used.
+
+
+# Run a Replicate model, retrying rate limits and server errors.
+# Output files come back as plain URLs, as the rest of the pipeline expects.
+# kind and tokens are passed to the fair-share scheduler.
+def run_replicate(ctx, model, input, label, kind='text', tokens=0):
+    client = http_pool.get_replicate_client(ctx.api_keys['replicate'])
+
+    def run():
+        with ctx.call_slot('replicate', kind, tokens):
+            return client.run(model, input=input, use_file_output=False)
+
+    if ctx.customization.get('prediction_manager', True):
+        # The manager retries creating the prediction itself
+        with tracing.span(label, 'replicate', model=model), ctx.call_slot('replicate', kind, tokens):
+            return predictions.get_manager().run(client, model, input, label)
+    with tracing.span(label, 'replicate', model=model):
+        return retry.call_with_retry(run, 'replicate', label)
+
+# Run several image predictions of one model at once through the
+# prediction manager and return each output, or the exception it raised.
+# The batch holds one call slot per prediction until all have finished;
+# if it is interrupted, predictions still running are canceled.
+def run_replicate_many(ctx, model, inputs, label):
+    client = http_pool.get_replicate_client(ctx.api_keys['replicate'])
+    manager = predictions.get_manager()
+    futures = []
+    results = []
+    with tracing.span(label, 'replicate', model=model, predictions=len(inputs)), \
+            ctx.call_slot('replicate', 'image', count=len(inputs)):
+        try:
+            for input in inputs:
+                try:
+                    futures.append(manager.submit(client, model, input, label))
+                except Exception as e:
+                    futures.append(e)
+            for future in futures:
+                try:
+                    results.append(future if isinstance(future, Exception) else future.result())
+                except Exception as e:
+                    results.append(e)
+        finally:
+            for future in futures:
+                if not isinstance(future, Exception):
+                    future.cancel()
+    return results
+
+# Run a Llama prediction, streaming tokens to on_token if given
+def run_llama(ctx, model, input, on_token=None):
+    prompt_tokens = design_brief.estimate_tokens(input['prompt'])
+    if not on_token:
+        return ''.join(run_replicate(ctx, model, input, 'llama', 'text', prompt_tokens + input['max_length']))
+    client = http_pool.get_replicate_client(ctx.api_keys['replicate'])
+    events = lambda: (str(event) for event in client.stream(model, input=input))
+    return stream_with_retry(ctx, events, 'replicate', 'llama', on_token, prompt_tokens)
+
+
+def llama_chat(ctx, backend, system, prompt, use_cache=None, on_token=None):
+    params = {
+        "temperature": 0.75,
+        "top_p": 0.9,
+        "max_length": 500,
+        "repetition_penalty": 1
+    }
+
+    def compute():
+        try:
+            return run_llama(ctx, backend.model, {"prompt": f"{system}\n\nHuman: {prompt}\n\nAssistant:", **params}, on_token)
+        except Exception as e:
+            return f"Error: Unable to generate content using Llama: {str(e)}"
+
+    return cached_response(ctx, backend.model, system, prompt, params, compute, use_cache, on_token)
+
+
+# Code is requested from Llama with the bare prompt and a longer output
+def llama_code(ctx, backend, system, prompt, use_cache=None, on_token=None, max_length=2048):
+    params = {
+        "temperature": 0.7,
+        "top_p": 0.95,
+        "max_length": max_length,
+        "repetition_penalty": 1.1
+    }
+
+    def compute():
+        try:
+            return run_llama(ctx, backend.model, {"prompt": prompt, **params}, on_token)
+        except Exception as e:
+            return f"Error: Unable to generate script using Llama: {str(e)}"
+
+    return cached_response(ctx, backend.model, None, prompt, params, compute, use_cache, on_token)
+
+
+# Input for a Flux Pro prediction
+def flux_input(prompt, size, steps=25, guidance=3.0, interval=2.0):
+    # Convert size to aspect ratio
+    width, height = size
+    if width == height:
+        aspect_ratio = "1:1"
+    elif width > height:
+        aspect_ratio = "16:9" if width / height > 1.7 else "3:2"
+    else:
+        aspect_ratio = "9:16" if height / width > 1.7 else "2:3"
+    return {
+        "prompt": prompt,
+        "aspect_ratio": aspect_ratio,
+        "steps": steps,
+        "guidance": guidance,
+        "interval": interval,
+        "safety_tolerance": 2,
+        "output_format": "png",
+        "output_quality": 100
+    }
+
+
+# Flux Pro returns one image per prediction, so a batch is fanned out as
+# concurrent predictions through the prediction manager
+def flux_images(ctx, backend, prompt, size, count):
+    if count == 1 or not ctx.customization.get('prediction_manager', True):
+        outputs = []
+        for _ in range(count):
+            try:
+                outputs.append(run_replicate(ctx, backend.model, flux_input(prompt, size), 'flux-pro', 'image'))
+            except Exception as e:
+                outputs.append(e)
+    else:
+        outputs = run_replicate_many(ctx, backend.model, [flux_input(prompt, size)] * count, 'flux-pro')
+    return [
+        f"Error: Unable to generate image using SD Flux-1: {str(output)}" if isinstance(output, Exception) else output
+        for output in outputs
+    ]
+
+
+# SDXL Lightning returns up to four images from one prediction
+def sdxl_images(ctx, backend, prompt, size, count):
+    input = {"prompt": prompt, "num_outputs": count} if count > 1 else {"prompt": prompt}
+    try:
+        output = list(run_replicate(ctx, backend.model, input, 'sdxl-lightning', 'image') or [])
+        output += ["Error: No image returned by SDXL Lightning."] * (count - len(output))
+        return output[:count]
+    except Exception as e:
+        return [f"Error: Unable to generate image using SDXL Lightning: {str(e)}"] * count
+
+
+# Generate music using Replicate's MusicGen
+def musicgen(ctx, backend, prompt):
+    try:
+        output = run_replicate(ctx,
+            backend.model,
+            {
+                "prompt": prompt,
+                "model_version": "stereo-large",
+                "output_format": "mp3",
+                "normalization_strategy": "peak"
+            },
+            'musicgen',
+            'audio'
+        )
+        if isinstance(output, str) and output.startswith("http"):
+            return output
+        else:
+            return None
+    except Exception as e:
+        ctx.warn(f"Error: Unable to generate music: {str(e)}")
+        return None
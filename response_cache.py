@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Defaults for the completion cache
+DEFAULT_CACHE_DIR = os.environ.get('GAME_MAKER_CACHE_DIR', os.path.join('.cache', 'game_maker'))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_TTL = None
+
+
+# Build a stable cache key from everything that affects a completion
+def make_key(model, system, prompt, params=None):
+    payload = json.dumps(
+        {'model': model, 'system': system, 'prompt': prompt, 'params': params or {}},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Disk-backed, content-addressed cache of model responses with LRU
+# eviction by total size and an optional time-to-live (in seconds).
+class ResponseCache:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._conn.commit()
+
+    def configure(self, max_bytes=None, ttl=None):
+        with self._lock:
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self.ttl = ttl
+            self._evict()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self):
+        if self.ttl is not None:
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+        self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': total,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide response cache
+def get_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(os.path.join(DEFAULT_CACHE_DIR, 'responses.sqlite3'))
+        return _default_cache
@@ -0,0 +1,149 @@
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+import tracing
+
+# Defaults for provider call retries
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+# Parse a Retry-After header (seconds or an HTTP date) into seconds
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+# Classify an exception from requests, httpx or replicate as
+# (retryable, status, retry_after)
+def classify(error):
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(error, 'status', None) or getattr(error, 'status_code', None)
+    headers = getattr(response, 'headers', None) or {}
+    retry_after = parse_retry_after(headers.get('Retry-After') or headers.get('retry-after'))
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS, status, retry_after
+    name = type(error).__name__
+    if any(word in name for word in ('Timeout', 'ConnectionError', 'ConnectError', 'RemoteProtocolError', 'ReadError')):
+        return True, None, retry_after
+    return False, None, retry_after
+
+
+# Additive-increase / multiplicative-decrease concurrency limit per
+# provider: each success raises the limit by 1/limit, each 429 halves it.
+class AdaptiveLimiter:
+    def __init__(self, max_limits=None):
+        self._lock = threading.Lock()
+        self._max = dict(max_limits or {})
+        self._limits = dict(self._max)
+
+    # Set a provider's maximum; a limit that has not backed off follows it
+    def set_max(self, provider, limit):
+        with self._lock:
+            previous = self._max.get(provider)
+            current = self._limits.get(provider, limit)
+            if previous is None or current >= previous:
+                current = limit
+            self._max[provider] = limit
+            self._limits[provider] = min(current, limit)
+
+    # Current limit as a share of its maximum; 1.0 for providers without one
+    def fraction(self, provider):
+        with self._lock:
+            value, maximum = self._limits.get(provider), self._max.get(provider)
+            return 1.0 if not value or not maximum else min(1.0, value / maximum)
+
+    def on_success(self, provider):
+        with self._lock:
+            if provider in self._limits:
+                current = self._limits[provider]
+                self._limits[provider] = min(self._max[provider], current + 1.0 / max(1.0, current))
+
+    def on_throttle(self, provider):
+        with self._lock:
+            if provider in self._limits:
+                self._limits[provider] = max(1.0, self._limits[provider] / 2)
+
+
+# Process-wide record of provider calls, retries and time spent waiting
+class RetryStats:
+    def __init__(self, history=500):
+        self._lock = threading.Lock()
+        self.calls = deque(maxlen=history)
+        self.totals = {}
+
+    def record(self, provider, label, attempts, waited, ok, status=None):
+        with self._lock:
+            self.calls.append({
+                'provider': provider, 'label': label, 'attempts': attempts,
+                'waited': waited, 'ok': ok, 'status': status, 'time': time.time()
+            })
+            totals = self.totals.setdefault(provider, {'calls': 0, 'succeeded': 0, 'retries': 0, 'throttled': 0, 'waited': 0.0})
+            totals['calls'] += 1
+            totals['succeeded'] += int(ok)
+            totals['retries'] += attempts - 1
+            totals['waited'] += waited
+
+    def throttled(self, provider):
+        with self._lock:
+            totals = self.totals.setdefault(provider, {'calls': 0, 'succeeded': 0, 'retries': 0, 'throttled': 0, 'waited': 0.0})
+            totals['throttled'] += 1
+
+    def summary(self):
+        with self._lock:
+            return {p: dict(t) for p, t in self.totals.items()}
+
+
+_limiter = AdaptiveLimiter()
+_stats = RetryStats()
+
+
+def get_limiter():
+    return _limiter
+
+
+def get_stats():
+    return _stats
+
+
+# Call fn(), retrying retryable errors with jittered exponential backoff
+# and honouring Retry-After. can_retry() may veto a retry (for example once
+# a streamed response has already produced output).
+def call_with_retry(fn, provider, label='', max_attempts=DEFAULT_MAX_ATTEMPTS,
+                    base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, can_retry=None):
+    waited = 0.0
+    for attempt in range(1, max_attempts + 1):
+        try:
+            result = fn()
+        except Exception as e:
+            retryable, status, retry_after = classify(e)
+            if status == 429:
+                _limiter.on_throttle(provider)
+                _stats.throttled(provider)
+            if not retryable or attempt == max_attempts or (can_retry is not None and not can_retry()):
+                _stats.record(provider, label, attempt, waited, False, status)
+                tracing.annotate(retries=attempt - 1, retry_wait=waited, status=status)
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, max_delay))
+            time.sleep(delay)
+            waited += delay
+            continue
+        _limiter.on_success(provider)
+        _stats.record(provider, label, attempt, waited, True)
+        tracing.annotate(retries=attempt - 1, retry_wait=waited)
+        return result
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+import tracing
+
+# Defaults for the plan scheduler
+DEFAULT_MAX_WORKERS = 8
+# Replicate counts each prediction of a fanned-out image batch, which the
+# prediction manager polls without holding a worker
+DEFAULT_PROVIDER_LIMITS = {'openai': 4, 'replicate': 16}
+
+
+# Raised for tasks that were skipped because a dependency failed
+class DependencyError(Exception):
+    pass
+
+
+# Call slots shared by several plans, e.g. a batch's --max-calls. hold()
+# takes count slots at once, so a caller never holds some while waiting
+# for the rest; a request larger than the whole pool runs once every slot
+# is free.
+class CallSlots:
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.active = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def hold(self, count=1):
+        with self._cond:
+            while self.active and self.active + count > self.limit:
+                self._cond.wait()
+            self.active += count
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= count
+                self._cond.notify_all()
+
+
+# A single unit of work in the task graph. slots is how many provider
+# calls it makes at once, e.g. the predictions of a fanned-out batch.
+class Task:
+    def __init__(self, key, fn, deps=(), provider=None, backend=None, slots=1):
+        self.key = key
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.provider = provider
+        self.backend = backend
+        self.slots = max(1, int(slots))
+
+
+# Dependency-aware scheduler that runs tasks on a bounded thread pool.
+# A task starts as soon as all of its dependencies have finished and its
+# provider (and backend, if it has its own limit) has enough free slots;
+# the callable receives the dependency results as positional arguments,
+# in the order the dependencies were declared.
+class TaskGraph:
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, provider_limits=None, initializer=None, limiter=None, backend_limits=None):
+        self.max_workers = max(1, int(max_workers))
+        self.provider_limits = dict(DEFAULT_PROVIDER_LIMITS if provider_limits is None else provider_limits)
+        self.backend_limits = dict(backend_limits or {})
+        self.initializer = initializer
+        # Optional object with fraction(provider) that scales a provider's
+        # limit down while the graph runs, e.g. after rate-limit errors
+        self.limiter = limiter
+        self.tasks = {}
+
+    def add(self, key, fn, deps=(), provider=None, backend=None, slots=1):
+        if key in self.tasks:
+            raise ValueError(f"Duplicate task: {key}")
+        self.tasks[key] = Task(key, fn, deps, provider, backend, slots)
+        return key
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def _check(self):
+        for task in self.tasks.values():
+            missing = [d for d in task.deps if d not in self.tasks]
+            if missing:
+                raise ValueError(f"Task {task.key} depends on unknown tasks: {', '.join(map(str, missing))}")
+
+    # Run a task inside a trace span that records how long it waited to start
+    @staticmethod
+    def _run_task(task, ready, args):
+        kind, name = task.key if isinstance(task.key, tuple) and len(task.key) == 2 else ('task', task.key)
+        label = ', '.join(name) if isinstance(name, tuple) else str(name)
+        with tracing.span(kind, 'task', label=label, provider=task.provider, queue_wait=time.perf_counter() - ready):
+            return task.fn(*args)
+
+    def _has_capacity(self, task, active, active_backends):
+        backend_limit = self.backend_limits.get(task.backend)
+        if backend_limit is not None and active_backends[task.backend] >= max(1, backend_limit):
+            return False
+        provider = task.provider
+        limit = self.provider_limits.get(provider)
+        if self.limiter is not None and limit is not None:
+            limit = int(limit * self.limiter.fraction(provider))
+        # A task wider than the limit runs once the provider is idle
+        return limit is None or not active[provider] or active[provider] + task.slots <= max(1, limit)
+
+    # Run every task and return (results, errors) keyed by task key.
+    # on_complete(key, result, error) is called from the calling thread, and
+    # so is on_tick() every tick_interval seconds while tasks are running.
+    def run(self, on_complete=None, on_tick=None, tick_interval=0.25):
+        self._check()
+        results, errors = {}, {}
+        pending = dict(self.tasks)
+        running = {}
+        active = defaultdict(int)
+        active_backends = defaultdict(int)
+        ready = {}
+
+        def finish(key, result=None, error=None):
+            if error is None:
+                results[key] = result
+            else:
+                errors[key] = error
+            if on_complete:
+                on_complete(key, result, error)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, initializer=self.initializer) as pool:
+            while pending or running:
+                for key, task in list(pending.items()):
+                    failed = [d for d in task.deps if d in errors]
+                    if failed:
+                        del pending[key]
+                        finish(key, error=DependencyError(f"Skipped because {', '.join(map(str, failed))} failed"))
+                        continue
+                    if not all(d in results for d in task.deps):
+                        continue
+                    ready.setdefault(key, time.perf_counter())
+                    if len(running) >= self.max_workers or not self._has_capacity(task, active, active_backends):
+                        continue
+                    del pending[key]
+                    active[task.provider] += task.slots
+                    active_backends[task.backend] += 1
+                    args = [results[d] for d in task.deps]
+                    if tracing.enabled():
+                        future = pool.submit(self._run_task, task, ready[key], args)
+                    else:
+                        future = pool.submit(task.fn, *args)
+                    running[future] = task
+
+                if not running:
+                    if pending:
+                        raise ValueError(f"Dependency cycle between tasks: {', '.join(map(str, pending))}")
+                    break
+
+                done, _ = wait(running, timeout=tick_interval if on_tick else None, return_when=FIRST_COMPLETED)
+                if on_tick:
+                    on_tick()
+                for future in done:
+                    task = running.pop(future)
+                    active[task.provider] -= task.slots
+                    active_backends[task.backend] -= 1
+                    try:
+                        finish(task.key, result=future.result())
+                    except Exception as e:
+                        finish(task.key, error=e)
+
+        return results, errors
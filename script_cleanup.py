@@ -0,0 +1,132 @@
+import re
+
+# A code fence line: ``` or ~~~ (or longer), with an optional language
+# after an opening fence
+FENCE_RE = re.compile(r'^ {0,3}(`{3,}|~{3,})[ \t]*([^`\s]*)[^`]*$')
+INTRO_RE = re.compile(r"^\s*(?:Sure[,.!]?\s*)?Here(?:'s| is| are)\b.*:\s*$", re.IGNORECASE)
+HEADING_RE = re.compile(r'^#+\s*(\w+)')
+# Lines of leading text held back while looking for an opening fence
+MAX_INTRO_LINES = 20
+
+
+# Whether fence closes a block opened with the opening fence marker
+def closes(fence, opening):
+    marker, language = fence.group(1), fence.group(2)
+    return not language and marker[0] == opening[0] and len(marker) >= len(opening)
+
+
+# Extract code as it streams in, one complete line at a time.
+# When the response has fenced code blocks, only their contents are kept:
+# text before, between and after them is dropped. A response without
+# fences is kept whole, less an introductory "Here's ...:" line and any
+# stray fence markers.
+class ScriptCleaner:
+    def __init__(self):
+        self._partial = ''
+        self._head = []
+        # 'head' until the first fence or MAX_INTRO_LINES lines, then 'code'
+        # inside a fenced block, 'prose' outside one, or 'plain' if unfenced
+        self._state = 'head'
+        self._fence = None
+        self._lines = []
+
+    # Feed raw text and return the newly cleaned text, if any
+    def feed(self, text):
+        self._partial += text
+        *complete, self._partial = self._partial.split('\n')
+        return self._emit(complete)
+
+    # Flush what is left and return the newly cleaned text, if any
+    def close(self):
+        remaining, self._partial = self._partial, ''
+        lines = [remaining] if remaining else []
+        output = self._emit(lines)
+        if self._state == 'head':
+            output += self._release_head()
+        return output
+
+    # The full cleaned text so far
+    def text(self):
+        return '\n'.join(self._lines).strip()
+
+    def _release_head(self):
+        head, self._head = self._head, []
+        self._state = 'plain'
+        return self._keep(head)
+
+    def _emit(self, lines):
+        output = ''
+        for line in lines:
+            line = line.rstrip('\r')
+            fence = FENCE_RE.match(line)
+            if self._state == 'code':
+                if fence and closes(fence, self._fence):
+                    self._state = 'prose'
+                else:
+                    output += self._keep([line])
+            elif fence:
+                if self._state != 'plain':
+                    # Separate consecutive blocks with a blank line
+                    if self._lines:
+                        output += self._keep([''])
+                    self._head = []
+                    self._state = 'code'
+                    self._fence = fence.group(1)
+            elif self._state == 'plain':
+                output += self._keep([line])
+            elif self._state == 'head':
+                if INTRO_RE.search(line):
+                    self._head = []
+                    continue
+                self._head.append(line)
+                if len(self._head) > MAX_INTRO_LINES:
+                    output += self._release_head()
+        return output
+
+    def _keep(self, lines):
+        kept = []
+        for line in lines:
+            if not self._lines and not line.strip():
+                continue
+            self._lines.append(line)
+            kept.append(line)
+        return ''.join(line + '\n' for line in kept)
+
+
+# Fenced code blocks in a complete response, as (heading, language, code)
+# where heading is the last Markdown heading word before the block. A
+# final block left open, as in a truncated response, runs to the end.
+def code_blocks(text):
+    blocks = []
+    heading, opening, language, lines = None, None, '', []
+    for line in text.split('\n'):
+        line = line.rstrip('\r')
+        fence = FENCE_RE.match(line)
+        if opening is None:
+            if fence:
+                opening, language, lines = fence.group(1), fence.group(2).lower(), []
+            elif HEADING_RE.match(line):
+                heading = HEADING_RE.match(line).group(1)
+        elif fence and closes(fence, opening):
+            blocks.append((heading, language, '\n'.join(lines)))
+            opening = None
+        else:
+            lines.append(line)
+    if opening is not None:
+        blocks.append((heading, language, '\n'.join(lines)))
+    return blocks
+
+
+# Split a multi-engine response into {engine: code}, keeping only the
+# requested engines with a non-empty code block. Blocks are matched to an
+# engine by their '### engine' heading, or else by their language using
+# languages ({engine: language}).
+def split_engine_blocks(text, engines, languages=None):
+    blocks = {}
+    for heading, language, code in code_blocks(text):
+        engine = heading.lower() if heading else None
+        if engine not in engines or engine in blocks:
+            engine = next((e for e in engines if e not in blocks and (languages or {}).get(e) == language), None)
+        if engine is not None and engine not in blocks and code.strip():
+            blocks[engine] = code.strip()
+    return blocks
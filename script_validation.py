@@ -0,0 +1,164 @@
+import re
+
+# Cheap local checks for generated scripts, run before a script is kept.
+# Each check returns a short description of the first problem found, or
+# None if the script looks usable.
+
+OPENERS = {'(': ')', '[': ']', '{': '}'}
+CLOSERS = {')': '(', ']': '[', '}': '{'}
+# Tokens a C# or C++ source file can end with
+FINAL_TOKENS = ('}', ';')
+IDENTIFIER_RE = re.compile(r'[A-Za-z_]\w*')
+# Numbers, including C++14 digit separators (1'000'000)
+NUMBER_RE = re.compile(r"\.?\d(?:[\w.]|'(?=\w))*")
+RAW_STRING_RE = re.compile(r'R"([^()\\\s]{0,16})\(')
+
+
+# Python (Blender) scripts must compile
+def check_python(code):
+    try:
+        compile(code, '<script>', 'exec')
+    except SyntaxError as e:
+        return f"SyntaxError on line {e.lineno}: {e.msg}"
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+# Split C# or C++ source into (kind, text, line) tokens, where kind is
+# 'bracket', 'string', 'word' (identifiers and numbers) or 'symbol'.
+# Comments and preprocessor lines are skipped. Raises ValueError for text no compiler would accept:
+# unterminated strings or comments and stray Markdown fences.
+def tokenize_c_like(code):
+    tokens = []
+    i, line, length = 0, 1, len(code)
+    at_line_start = True
+    while i < length:
+        char = code[i]
+        if char == '\n':
+            line += 1
+            at_line_start = True
+            i += 1
+            continue
+        if char in ' \t\r\f\v':
+            i += 1
+            continue
+        if char == '#' and at_line_start:
+            # Preprocessor directive, with backslash continuations
+            while i < length and code[i] != '\n':
+                if code[i] == '\\' and code.startswith('\n', i + 1):
+                    line += 1
+                    i += 1
+                i += 1
+            continue
+        at_line_start = False
+        if code.startswith('//', i):
+            end = code.find('\n', i)
+            i = length if end < 0 else end
+            continue
+        if code.startswith('/*', i):
+            end = code.find('*/', i + 2)
+            if end < 0:
+                raise ValueError(f"Unterminated comment on line {line}")
+            line += code.count('\n', i, end)
+            i = end + 2
+            continue
+        if char == '`':
+            raise ValueError(f"Stray '`' on line {line}")
+        start, start_line = i, line
+        raw = RAW_STRING_RE.match(code, i)
+        if raw:
+            # C++ raw string: R"delim( ... )delim"
+            end = code.find(f'){raw.group(1)}"', raw.end())
+            if end < 0:
+                raise ValueError(f"Unterminated raw string on line {line}")
+            i = end + len(raw.group(1)) + 2
+        elif code.startswith('"""', i) or code.startswith('$"""', i):
+            # C# raw string literal
+            i = code.index('"', i)
+            quotes = len(code[i:]) - len(code[i:].lstrip('"'))
+            end = code.find('"' * quotes, i + quotes)
+            if end < 0:
+                raise ValueError(f"Unterminated string on line {line}")
+            i = end + quotes
+        elif code.startswith('@"', i) or code.startswith('$@"', i) or code.startswith('@$"', i):
+            # C# verbatim string, where "" is an escaped quote
+            i = code.index('"', i) + 1
+            while True:
+                end = code.find('"', i)
+                if end < 0:
+                    raise ValueError(f"Unterminated string on line {line}")
+                if code.startswith('""', end):
+                    i = end + 2
+                    continue
+                i = end + 1
+                break
+        elif char in '"\'' or (char in '$LuU' and re.match(r'(\$|L|u8?|U)["\']', code[i:i + 3])):
+            quote_at = i
+            while code[quote_at] not in '"\'':
+                quote_at += 1
+            quote = code[quote_at]
+            i = quote_at + 1
+            while i < length and code[i] != quote:
+                if code[i] == '\n':
+                    break
+                i += 2 if code[i] == '\\' else 1
+            if i >= length or code[i] != quote:
+                literal = 'string' if quote == '"' else 'character literal'
+                raise ValueError(f"Unterminated {literal} on line {line}")
+            i += 1
+        else:
+            word = IDENTIFIER_RE.match(code, i) or NUMBER_RE.match(code, i)
+            if word:
+                tokens.append(('word', word.group(), line))
+                i = word.end()
+            else:
+                tokens.append(('bracket' if char in OPENERS or char in CLOSERS else 'symbol', char, line))
+                i += 1
+            continue
+        line += code.count('\n', start, i)
+        tokens.append(('string', code[start:i], start_line))
+    return tokens
+
+
+# C# and C++ scripts must tokenize, balance their brackets and end on a
+# complete statement or block
+def check_c_like(code):
+    try:
+        tokens = tokenize_c_like(code)
+    except ValueError as e:
+        return str(e)
+    if not tokens:
+        return "Script has no code"
+    stack = []
+    for kind, text, line in tokens:
+        if kind != 'bracket':
+            continue
+        if text in OPENERS:
+            stack.append((text, line))
+        elif not stack or stack[-1][0] != CLOSERS[text]:
+            return f"Unexpected '{text}' on line {line}"
+        else:
+            stack.pop()
+    if stack:
+        text, line = stack[-1]
+        return f"Unclosed '{text}' from line {line}"
+    if tokens[-1][1] not in FINAL_TOKENS:
+        return f"Script ends mid-statement on line {tokens[-1][2]}"
+    return None
+
+
+CHECKS = {
+    'python': check_python,
+    'csharp': check_c_like,
+    'cpp': check_c_like,
+}
+
+
+# Check a script written in language ('python', 'csharp' or 'cpp').
+# Returns the problem found, or None; languages without a check pass.
+def check_script(code, language):
+    if not code or not code.strip():
+        return "Script is empty"
+    check = CHECKS.get(language)
+    return check(code) if check else None
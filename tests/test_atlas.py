@@ -0,0 +1,56 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from atlas import pack
+
+
+def is_power_of_two(value):
+    return value > 0 and value & (value - 1) == 0
+
+
+# Every size placed once, padded, inside a power-of-two page, with no overlaps
+def check_pages(sizes, pages, padding):
+    placed = sorted(i for width, height, frames in pages for i, x, y in frames)
+    assert placed == list(range(len(sizes)))
+    for width, height, frames in pages:
+        assert is_power_of_two(width) and is_power_of_two(height)
+        rects = []
+        for i, x, y in frames:
+            w, h = sizes[i]
+            assert x >= padding and y >= padding
+            assert x + w + padding <= width and y + h + padding <= height
+            rects.append((x - padding, y - padding, x + w + padding, y + h + padding))
+        for a in range(len(rects)):
+            for b in range(a + 1, len(rects)):
+                left, top, right, bottom = rects[a]
+                other_left, other_top, other_right, other_bottom = rects[b]
+                assert right <= other_left or other_right <= left or bottom <= other_top or other_bottom <= top
+
+
+def test_pack_fits_one_page():
+    sizes = [(100, 50), (60, 60), (30, 120), (64, 64), (10, 10)]
+    pages = pack(sizes, max_size=512, padding=2)
+    assert len(pages) == 1
+    check_pages(sizes, pages, 2)
+
+
+def test_pack_spills_to_more_pages():
+    sizes = [(200, 200)] * 10
+    pages = pack(sizes, max_size=512, padding=1)
+    assert len(pages) > 1
+    assert all(width <= 512 and height <= 512 for width, height, frames in pages)
+    check_pages(sizes, pages, 1)
+
+
+def test_page_grows_to_fit_an_oversized_image():
+    sizes = [(700, 100), (20, 20)]
+    pages = pack(sizes, max_size=256, padding=2)
+    assert pages[0][0] == 1024
+    check_pages(sizes, pages, 2)
+
+
+def test_page_shrinks_to_its_content():
+    pages = pack([(10, 10)], max_size=2048, padding=2)
+    assert pages == [(16, 16, [(0, 2, 2)])]
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fair_share import FairShareScheduler
+
+
+# Queue calls (session, kind) one after another behind a held slot, then
+# release it and return the order they were served in
+def served_order(calls):
+    scheduler = FairShareScheduler({'p': {'concurrency': 1}})
+    order = []
+
+    def call(session, kind):
+        with scheduler.slot('p', session, kind):
+            order.append((session, kind))
+
+    threads = []
+    with scheduler.slot('p', 'holder'):
+        for queued, (session, kind) in enumerate(calls, 1):
+            thread = threading.Thread(target=call, args=(session, kind))
+            thread.start()
+            threads.append(thread)
+            while sum(scheduler.stats()['providers']['p']['queued'].values()) < queued:
+                time.sleep(0.001)
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+# A session that queued first does not hold back one that asks later
+def test_sessions_take_turns():
+    order = served_order([('heavy', 'text')] * 3 + [('light', 'text')])
+    assert [session for session, kind in order] == ['heavy', 'light', 'heavy', 'heavy']
+
+
+def test_text_is_served_before_images():
+    order = served_order([('a', 'image'), ('a', 'audio'), ('b', 'text')])
+    assert [kind for session, kind in order] == ['text', 'audio', 'image']
+
+
+def test_wide_slot_waits_for_enough_free_slots():
+    scheduler = FairShareScheduler({'p': {'concurrency': 4}})
+    admitted = threading.Event()
+
+    def wide():
+        with scheduler.slot('p', 'a', count=3):
+            admitted.set()
+
+    with scheduler.slot('p', 'b', count=2):
+        thread = threading.Thread(target=wide)
+        thread.start()
+        assert not admitted.wait(0.1)
+    thread.join(5)
+    assert admitted.is_set()
+    assert scheduler.stats()['providers']['p']['active'] == 0
+
+
+def test_token_bucket_delays_calls_until_it_refills():
+    scheduler = FairShareScheduler({'p': {'tokens_per_minute': 60000}})
+    with scheduler.slot('p', 'a', tokens=60000):
+        pass
+    assert scheduler.stats()['providers']['p']['tokens_available'] == 0
+    started = time.monotonic()
+    with scheduler.slot('p', 'a', tokens=200):
+        pass
+    assert time.monotonic() - started >= 0.15
+
+
+def test_unused_tokens_are_returned():
+    scheduler = FairShareScheduler({'p': {'tokens_per_minute': 60000}})
+    with scheduler.slot('p', 'a', tokens=60000) as ticket:
+        ticket.used(100)
+    started = time.monotonic()
+    with scheduler.slot('p', 'a', tokens=30000):
+        pass
+    assert time.monotonic() - started < 0.1
@@ -0,0 +1,77 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asset_store
+import pipeline
+
+
+def customization(**overrides):
+    return pipeline.default_customization({
+        'image_count': {'Character': 2},
+        'script_count': {'Player': 1},
+        'code_types': {'unity': True},
+    }, overrides)
+
+
+# A finished plan for customization and prompt whose images are stored
+def finished_plan(custom, prompt):
+    fingerprints = pipeline.plan_fingerprints(custom, prompt)
+    plan = {'fingerprints': fingerprints}
+    for node in fingerprints:
+        value = f"value of {node}"
+        if node.startswith('image:'):
+            value = f"http://assets.test/{fingerprints[node]}.png"
+            asset_store.get_store().put(value, b'png')
+        elif node == 'brief':
+            value = {'style': 'pixel art'}
+        pipeline.set_plan_value(plan, node, value)
+    return plan
+
+
+def test_unchanged_plan_is_reused_whole():
+    custom = customization()
+    previous = finished_plan(custom, "a space game")
+    fingerprints = pipeline.plan_fingerprints(custom, "a space game")
+    reused = pipeline.reusable_values(previous, fingerprints)
+    assert set(reused) == set(fingerprints)
+    assert reused['brief'] == {'style': 'pixel art'}
+
+
+# A new concept reruns the brief and every image, but not the scripts
+def test_new_prompt_invalidates_concept_and_assets():
+    custom = customization()
+    previous = finished_plan(custom, "a space game")
+    reused = pipeline.reusable_values(previous, pipeline.plan_fingerprints(custom, "a farming game"))
+    assert 'element:game_concept' not in reused
+    assert not [node for node in reused if node.startswith(('brief', 'image:'))]
+    assert 'script:player_unity_script_1.cs' in reused
+
+
+def test_new_image_model_only_invalidates_images():
+    previous = finished_plan(customization(), "a space game")
+    fingerprints = pipeline.plan_fingerprints(customization(image_model='SD Flux-1'), "a space game")
+    reused = pipeline.reusable_values(previous, fingerprints)
+    assert not [node for node in reused if node.startswith('image:')]
+    assert 'element:game_concept' in reused and 'brief' in reused
+
+
+def test_errors_and_missing_assets_are_regenerated():
+    custom = customization()
+    previous = finished_plan(custom, "a space game")
+    fingerprints = pipeline.plan_fingerprints(custom, "a space game")
+    images = sorted(node for node in fingerprints if node.startswith('image:'))
+    pipeline.set_plan_value(previous, 'element:plot', "Error: rate limited")
+    asset_store.get_store().discard(pipeline.get_plan_value(previous, images[0]))
+    reused = pipeline.reusable_values(previous, fingerprints)
+    assert 'element:plot' not in reused
+    assert images[0] not in reused
+    assert images[1] in reused
+
+
+def test_fingerprints_follow_their_inputs():
+    base = pipeline.plan_fingerprints(customization(), "a space game")
+    assert base == pipeline.plan_fingerprints(customization(), "a space game")
+    changed = pipeline.plan_fingerprints(customization(code_model='gpt-4o'), "a space game")
+    assert [node for node in base if base[node] != changed[node]] == ['script:player_unity_script_1.cs']
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retry
+from predictions import PredictionDeadlineExceeded, PredictionError, PredictionManager
+
+
+class ReadTimeout(Exception):
+    pass
+
+
+class Forbidden(Exception):
+    status = 403
+
+
+class Prediction:
+    def __init__(self, id, status, output=None, error=None):
+        self.id = id
+        self.state = {'id': id, 'status': status, 'output': output, 'error': error}
+
+    def dict(self):
+        return dict(self.state)
+
+
+# Replicate's async predictions API. Each poll takes the next of updates:
+# a status, or an exception to raise.
+class FakePredictions:
+    def __init__(self, updates, output='image.png'):
+        self.updates = list(updates)
+        self.output = output
+        self.created = []
+        self.polls = 0
+        self.canceled = []
+
+    async def async_create(self, **params):
+        self.created.append(params)
+        return Prediction('p1', 'starting')
+
+    async def async_get(self, id):
+        self.polls += 1
+        update = self.updates.pop(0) if self.updates else 'processing'
+        if isinstance(update, Exception):
+            raise update
+        return Prediction(id, update, self.output if update == 'succeeded' else None, 'out of memory' if update == 'failed' else None)
+
+    async def async_cancel(self, id):
+        self.canceled.append(id)
+
+
+class FakeClient:
+    def __init__(self, updates):
+        self.predictions = FakePredictions(updates)
+        self.models = self
+
+
+# Cancels are sent in the background; wait briefly for one to arrive
+def canceled(client):
+    for _ in range(100):
+        if client.predictions.canceled:
+            break
+        time.sleep(0.01)
+    return client.predictions.canceled
+
+
+def manager(**options):
+    return PredictionManager(poll_interval=0.01, max_poll_interval=0.05, create_wait=0, **options)
+
+
+def test_prediction_is_polled_until_it_succeeds():
+    client = FakeClient(['processing', 'processing', 'succeeded'])
+    assert manager().run(client, 'owner/model:v1', {'prompt': 'cat'}) == 'image.png'
+    assert client.predictions.polls == 3
+    assert client.predictions.created == [{'input': {'prompt': 'cat'}, 'version': 'v1'}]
+
+
+def test_model_refs_ask_replicate_to_wait():
+    client = FakeClient(['succeeded'])
+    PredictionManager(poll_interval=0.01, create_wait=3).run(client, 'owner/model', {})
+    assert client.predictions.created == [{'input': {}, 'model': 'owner/model', 'wait': 3}]
+
+
+def test_failed_prediction_raises_its_error():
+    with pytest.raises(PredictionError, match='out of memory') as error:
+        manager().run(FakeClient(['failed']), 'owner/model', {})
+    assert error.value.status == 'failed'
+    assert error.value.prediction_id == 'p1'
+
+
+def test_transient_poll_errors_are_retried():
+    client = FakeClient([ReadTimeout(), ReadTimeout(), 'succeeded'])
+    assert manager().run(client, 'owner/model', {}) == 'image.png'
+
+
+def test_poll_gives_up_after_max_attempts():
+    client = FakeClient([ReadTimeout()] * retry.DEFAULT_MAX_ATTEMPTS + ['succeeded'])
+    with pytest.raises(ReadTimeout):
+        manager().run(client, 'owner/model', {})
+    assert client.predictions.polls == retry.DEFAULT_MAX_ATTEMPTS
+
+
+def test_non_retryable_poll_error_fails_at_once():
+    client = FakeClient([Forbidden(), 'succeeded'])
+    with pytest.raises(Forbidden):
+        manager().run(client, 'owner/model', {})
+    assert client.predictions.polls == 1
+
+
+def test_slow_prediction_times_out_and_is_canceled():
+    client = FakeClient([])
+    with pytest.raises(PredictionDeadlineExceeded):
+        manager().run(client, 'owner/model', {}, timeout=0.1)
+    assert canceled(client) == ['p1']
+
+
+def test_canceled_future_cancels_the_prediction():
+    client = FakeClient([])
+    future = manager().submit(client, 'owner/model', {})
+    with pytest.raises(TimeoutError):
+        future.result(0.1)
+    future.cancel()
+    assert canceled(client) == ['p1']
@@ -0,0 +1,71 @@
+import os
+import sys
+from concurrent.futures import Future
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fair_share
+import http_pool
+import predictions
+import replicate_backends
+from pipeline import GenerationContext
+from scheduler import CallSlots
+
+
+class Interrupted(BaseException):
+    pass
+
+
+class InterruptedFuture(Future):
+    def result(self, timeout=None):
+        raise Interrupted()
+
+
+# The first prediction succeeds, the second fails to submit, the third
+# interrupts the caller and the fourth never finishes
+class FakeManager:
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, client, model, input, label):
+        if input == 'error':
+            raise RuntimeError("submit failed")
+        future = InterruptedFuture() if input == 'interrupt' else Future()
+        if input == 'ok':
+            future.set_result('image')
+        self.futures.append(future)
+        return future
+
+
+def run(monkeypatch, inputs):
+    manager = FakeManager()
+    monkeypatch.setattr(predictions, 'get_manager', lambda: manager)
+    monkeypatch.setattr(http_pool, 'get_replicate_client', lambda key: None)
+    slots = CallSlots(4)
+    ctx = GenerationContext({'replicate': 'key'}, {}, call_slots={'replicate': slots}, session='test')
+    return manager, slots, lambda: replicate_backends.run_replicate_many(ctx, 'model', inputs, 'Images')
+
+
+def replicate_active():
+    return fair_share.get_scheduler().stats()['providers']['replicate']['active']
+
+
+def test_failed_submit_is_returned_as_result(monkeypatch):
+    manager, slots, call = run(monkeypatch, ['ok', 'error'])
+    results = call()
+    assert results[0] == 'image'
+    assert isinstance(results[1], RuntimeError)
+    assert slots.active == 0
+    assert replicate_active() == 0
+
+
+# An interrupted batch must give back every slot and cancel what is left
+def test_interrupted_fanout_releases_slots(monkeypatch):
+    manager, slots, call = run(monkeypatch, ['ok', 'interrupt', 'pending'])
+    with pytest.raises(Interrupted):
+        call()
+    assert slots.active == 0
+    assert replicate_active() == 0
+    assert manager.futures[2].cancelled()
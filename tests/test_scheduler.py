@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scheduler import CallSlots, DependencyError, TaskGraph
+
+
+def fail():
+    raise RuntimeError("concept failed")
+
+
+# Pipeline task keys are tuples; a failed task must skip its dependents
+def test_failed_tuple_key_skips_dependents():
+    graph = TaskGraph(max_workers=2)
+    concept = graph.add(('element', 'game_concept'), fail)
+    graph.add(('image', ('Character', 1)), lambda concept: concept, deps=[concept])
+    graph.add(('element', 'plot'), lambda: 'plot')
+    results, errors = graph.run()
+    assert results == {('element', 'plot'): 'plot'}
+    assert isinstance(errors[('image', ('Character', 1))], DependencyError)
+    assert "('element', 'game_concept')" in str(errors[('image', ('Character', 1))])
+
+
+def test_unknown_tuple_dependency_is_reported():
+    graph = TaskGraph()
+    graph.add(('element', 'plot'), lambda concept: concept, deps=[('element', 'game_concept')])
+    with pytest.raises(ValueError, match="game_concept"):
+        graph.run()
+
+
+def test_tuple_key_cycle_is_reported():
+    graph = TaskGraph()
+    graph.add(('element', 'a'), lambda b: b, deps=[('element', 'b')])
+    graph.add(('element', 'b'), lambda a: a, deps=[('element', 'a')])
+    with pytest.raises(ValueError, match="Dependency cycle"):
+        graph.run()
+
+
+# A fanned-out task takes one provider slot per call
+def test_wide_task_takes_several_provider_slots():
+    running = []
+    peak = []
+
+    def work():
+        running.append(1)
+        peak.append(len(running))
+        time.sleep(0.05)
+        running.pop()
+
+    graph = TaskGraph(max_workers=4, provider_limits={'replicate': 4})
+    graph.add('fanout', work, provider='replicate', slots=3)
+    graph.add('single', work, provider='replicate')
+    graph.add('other', work, provider='replicate', slots=2)
+    results, errors = graph.run()
+    assert not errors
+    assert max(peak) <= 2
+
+
+def test_call_slots_hold_many_at_once():
+    slots = CallSlots(2)
+    with slots.hold(2):
+        assert slots.active == 2
+    with slots.hold(5):
+        assert slots.active == 5
+    assert slots.active == 0
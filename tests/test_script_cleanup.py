@@ -0,0 +1,57 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script_cleanup import ScriptCleaner, split_engine_blocks
+
+RESPONSE = (
+    "Here's the script for each engine:\n"
+    "### unity\n"
+    "```csharp\n"
+    "public class Player { }\n"
+    "```\n"
+    "### blender\n"
+    "```python\n"
+    "import bpy\n"
+    "```\n"
+    "Let me know if you need anything else.\n"
+)
+
+
+def clean(chunks):
+    cleaner = ScriptCleaner()
+    streamed = ''.join(cleaner.feed(chunk) for chunk in chunks) + cleaner.close()
+    return streamed, cleaner.text()
+
+
+# Chunk boundaries must not change the result, even inside a fence marker
+def test_cleaner_is_independent_of_chunking():
+    whole = clean([RESPONSE])
+    assert whole == clean(list(RESPONSE))
+    assert whole == clean([RESPONSE[:40], RESPONSE[40:43], RESPONSE[43:]])
+    assert whole[1] == "public class Player { }\n\nimport bpy"
+
+
+def test_unfenced_response_drops_only_the_intro():
+    streamed, text = clean(["Sure! Here is the code:\nint x = 1;\n", "int y = 2;"])
+    assert text == "int x = 1;\nint y = 2;"
+    assert streamed == "int x = 1;\nint y = 2;\n"
+
+
+def test_engine_blocks_split_by_heading():
+    assert split_engine_blocks(RESPONSE, ['unity', 'blender']) == {
+        'unity': "public class Player { }",
+        'blender': "import bpy",
+    }
+
+
+def test_engine_blocks_fall_back_to_language():
+    text = "```python\nimport bpy\n```\n```cpp\nint main() { return 0; }\n```\n"
+    blocks = split_engine_blocks(text, ['unreal', 'blender'], {'unreal': 'cpp', 'blender': 'python'})
+    assert blocks == {'blender': "import bpy", 'unreal': "int main() { return 0; }"}
+
+
+def test_missing_and_empty_blocks_are_left_out():
+    text = "### unity\n```csharp\n\n```\n### unreal\n```cpp\nint x;\n"
+    assert split_engine_blocks(text, ['unity', 'unreal', 'blender']) == {'unreal': "int x;"}
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from script_validation import check_script
+
+
+@pytest.mark.parametrize('code, language', [
+    ("import bpy\n\nbpy.ops.mesh.primitive_cube_add()\n", 'python'),
+    ("public class Player : MonoBehaviour {\n    void Update() { var s = \"}\"; }\n}\n", 'csharp'),
+    ("#include <string>\n// trailing {\nint main() { auto s = R\"x(})x\"; return 1'000; }\n", 'cpp'),
+    ("anything goes", 'lua'),
+])
+def test_valid_scripts_pass(code, language):
+    assert check_script(code, language) is None
+
+
+@pytest.mark.parametrize('code, language, problem', [
+    ("", 'python', "empty"),
+    ("def update(:\n    pass\n", 'python', "SyntaxError on line 1"),
+    ("class Player {\n    void Update() {\n", 'csharp', "Unclosed '{' from line 2"),
+    ("void f() { g(]; }", 'cpp', "Unexpected ']' on line 1"),
+    ("class A { }\nint x = 1", 'cpp', "ends mid-statement on line 2"),
+    ("```csharp\nclass A { }\n```", 'csharp', "Stray '`' on line 1"),
+    ("class A { /* open", 'csharp', "Unterminated comment on line 1"),
+])
+def test_broken_scripts_report_the_problem(code, language, problem):
+    assert problem in check_script(code, language)
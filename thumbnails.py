@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import response_cache
+import tracing
+
+# Defaults for preview thumbnails
+DEFAULT_THUMBNAIL_DIR = os.path.join(response_cache.DEFAULT_CACHE_DIR, 'thumbnails')
+DEFAULT_SIZE = 256
+DEFAULT_QUALITY = 80
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_WORKERS = 4
+
+
+# WebP where Pillow was built with it, JPEG otherwise
+def thumbnail_format():
+    from PIL import features
+    return 'WEBP' if features.check('webp') else 'JPEG'
+
+
+# Encode a small preview of an image, at most size pixels on its longest side
+def make_thumbnail(data, size=DEFAULT_SIZE, format='WEBP', quality=DEFAULT_QUALITY):
+    from PIL import Image
+    with Image.open(BytesIO(data)) as image:
+        # Lets JPEG sources decode at a reduced scale
+        image.draft('RGB', (size, size))
+        image.thumbnail((size, size), reducing_gap=2.0)
+        if format == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        if format == 'JPEG' and image.mode == 'RGBA':
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        options = {'method': 4} if format == 'WEBP' else {'optimize': True}
+        with BytesIO() as buffer:
+            image.save(buffer, format=format, quality=quality, **options)
+            return buffer.getvalue()
+
+
+# Thumbnails on disk, keyed by a hash of the source image's bytes, so each
+# distinct image is only ever scaled down once. Least recently used files
+# are removed once the directory grows past max_bytes.
+class ThumbnailCache:
+    def __init__(self, directory, size=DEFAULT_SIZE, quality=DEFAULT_QUALITY, max_bytes=DEFAULT_MAX_BYTES, workers=DEFAULT_WORKERS):
+        self.directory = directory
+        self.size = size
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self._format = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._url_keys = {}
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='thumbnail')
+        os.makedirs(directory, exist_ok=True)
+
+    # Worked out on the first thumbnail request, so building the cache
+    # (e.g. for stats) does not import Pillow
+    @property
+    def format(self):
+        if self._format is None:
+            self._format = thumbnail_format()
+        return self._format
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}-{self.size}q{self.quality}.{self.format.lower()}")
+
+    # Thumbnail for the given image bytes
+    def thumbnail(self, data):
+        path = self._path(hashlib.sha256(data).hexdigest())
+        try:
+            with open(path, 'rb') as file:
+                thumbnail = file.read()
+            os.utime(path)
+            with self._lock:
+                self.hits += 1
+            return thumbnail
+        except FileNotFoundError:
+            pass
+        with tracing.span('thumbnail', 'image', image_bytes=len(data)) as span:
+            thumbnail = make_thumbnail(data, self.size, self.format, self.quality)
+            span.set(thumbnail_bytes=len(thumbnail))
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(thumbnail)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.misses += 1
+        self._evict()
+        return thumbnail
+
+    # Thumbnail for an asset URL; the source is read from the asset store,
+    # and only on the first request for that URL in this process
+    def for_url(self, store, url):
+        with self._lock:
+            digest = self._url_keys.get(url)
+        if digest is not None:
+            try:
+                with open(self._path(digest), 'rb') as file:
+                    thumbnail = file.read()
+                with self._lock:
+                    self.hits += 1
+                return thumbnail
+            except FileNotFoundError:
+                pass
+        data = store.fetch(url)
+        thumbnail = self.thumbnail(data)
+        with self._lock:
+            self._url_keys[url] = hashlib.sha256(data).hexdigest()
+        return thumbnail
+
+    # Make the thumbnails for several URLs in parallel and return
+    # {url: thumbnail bytes or the exception raised}
+    def for_urls(self, store, urls):
+        futures = {url: self._pool.submit(self.for_url, store, url) for url in dict.fromkeys(urls)}
+        return {url: future.exception() or future.result() for url, future in futures.items()}
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                os.remove(entry.path)
+        with self._lock:
+            self._url_keys.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        entries = [entry.stat().st_size for entry in os.scandir(self.directory) if entry.is_file()]
+        with self._lock:
+            return {'entries': len(entries), 'bytes': sum(entries), 'hits': self.hits, 'misses': self.misses}
+
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+
+# Get the process-wide thumbnail cache
+def get_cache():
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = ThumbnailCache(DEFAULT_THUMBNAIL_DIR)
+        return _default_cache
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Most spans kept in memory; the oldest are dropped first
+DEFAULT_MAX_SPANS = 100000
+
+# Span attributes that are summed in the summary table
+SUMMED_ATTRIBUTES = (
+    'bytes_sent', 'bytes_received', 'prompt_tokens', 'completion_tokens', 'retries', 'retry_wait', 'queue_wait'
+)
+
+_local = threading.local()
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+# A timed operation with attributes (model, bytes, tokens, retries, ...).
+# Spans opened inside another span on the same thread nest under it.
+class Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start', 'end', 'thread_id', 'thread_name')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = self.end = 0
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+
+    def set(self, **attributes):
+        self.args.update(attributes)
+
+    def add(self, **amounts):
+        for name, amount in amounts.items():
+            self.args[name] = self.args.get(name, 0) + amount
+
+    def __enter__(self):
+        _stack().append(self)
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter_ns()
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.tracer.record(self)
+        return False
+
+    @property
+    def seconds(self):
+        return (self.end - self.start) / 1e9
+
+
+# Stands in for a span while tracing is off, so call sites cost almost nothing
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, **amounts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+# Collects finished spans and exports them as a Chrome trace or a summary
+class Tracer:
+    def __init__(self, max_spans=DEFAULT_MAX_SPANS):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+
+    def span(self, name, category, **args):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, category, args)
+
+    def record(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+    # Chrome trace-event JSON, viewable in chrome://tracing or Perfetto
+    def chrome_trace(self):
+        spans = self.spans()
+        pid = os.getpid()
+        events = []
+        threads = {}
+        for span in spans:
+            threads.setdefault(span.thread_id, span.thread_name)
+            events.append({
+                'name': span.name,
+                'cat': span.category,
+                'ph': 'X',
+                'ts': span.start / 1000,
+                'dur': (span.end - span.start) / 1000,
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': span.args,
+            })
+        for tid, thread_name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': thread_name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def chrome_trace_json(self):
+        return json.dumps(self.chrome_trace(), default=str)
+
+    # One row per (category, name): count, time, p95 and summed attributes
+    def summary(self):
+        groups = {}
+        for span in self.spans():
+            groups.setdefault((span.category, span.name), []).append(span)
+        rows = []
+        for (category, name), spans in sorted(groups.items()):
+            seconds = sorted(span.seconds for span in spans)
+            row = {
+                'category': category,
+                'name': name,
+                'count': len(spans),
+                'total_s': round(sum(seconds), 3),
+                'mean_ms': round(sum(seconds) / len(seconds) * 1000, 1),
+                'p95_ms': round(seconds[min(len(seconds) - 1, int(len(seconds) * 0.95))] * 1000, 1),
+                'errors': sum(1 for span in spans if 'error' in span.args),
+            }
+            for attribute in SUMMED_ATTRIBUTES:
+                total = sum(span.args.get(attribute, 0) or 0 for span in spans)
+                row[attribute] = round(total, 3) if isinstance(total, float) else total
+            rows.append(row)
+        return rows
+
+
+_tracer = Tracer()
+
+
+# Get the process-wide tracer
+def get_tracer():
+    return _tracer
+
+
+def enable(on=True):
+    _tracer.enabled = on
+
+
+def enabled():
+    return _tracer.enabled
+
+
+# Open a span on the process-wide tracer
+def span(name, category, **args):
+    if not _tracer.enabled:
+        return NOOP_SPAN
+    return Span(_tracer, name, category, args)
+
+
+# Set attributes on the innermost open span of this thread
+def annotate(**attributes):
+    if _tracer.enabled:
+        stack = _stack()
+        if stack:
+            stack[-1].set(**attributes)
+
+
+# Add to numeric attributes of the innermost open span of this thread
+def add(**amounts):
+    if _tracer.enabled:
+        stack = _stack()
+        if stack:
+            stack[-1].add(**amounts)